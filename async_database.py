@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from database import Database
+
+
+class AsyncDatabase:
+    """asyncio facade over Database
+    
+    Every public Database method is available as a coroutine of the same
+    name and signature (await adb.get_playlist_by_id(1), ...). Calls run on
+    a dedicated thread pool, at most max_concurrency at a time, so the
+    event loop never blocks on SQLite.
+    
+    Cancelling a call that has not started yet drops it; cancelling one
+    that is running interrupts its SQLite statement. Large listings are
+    available as async iterators that fetch one keyset page per executor
+    call, so a full-library scan takes turns with other requests instead
+    of holding a worker for its whole duration.
+    """
+    
+    # Database members that cannot be called from another thread as-is
+    NOT_WRAPPED = ('transaction', 'close')
+    
+    def __init__(self, db: Database, max_concurrency: Optional[int] = None):
+        """Wrap an open Database
+        
+        max_concurrency defaults to one call per pooled reader plus one for
+        the writer, which is all the parallelism the Database can use.
+        """
+        self.db = db
+        self.max_concurrency = max_concurrency or db.pool.max_readers + 1
+        self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="prism-db")
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+    
+    @classmethod
+    async def open(cls, *args, max_concurrency: Optional[int] = None, **kwargs) -> 'AsyncDatabase':
+        """Open a Database (connecting and migrating off the event loop) and wrap it"""
+        loop = asyncio.get_running_loop()
+        db = await loop.run_in_executor(None, functools.partial(Database, *args, **kwargs))
+        return cls(db, max_concurrency)
+    
+    async def _call(self, function: Callable, *args, **kwargs):
+        """Run a blocking call on the executor, interrupting it if cancelled
+        
+        The concurrency slot is held until the executor has finished the
+        call, not just until the caller stops waiting, so cancelled calls
+        still winding down count against max_concurrency.
+        """
+        loop = asyncio.get_running_loop()
+        worker = {}
+        worker_lock = threading.Lock()
+        
+        def run():
+            with worker_lock:
+                worker['thread'] = threading.get_ident()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with worker_lock:
+                    worker.clear()
+        
+        def release(future):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._slots.release)
+        
+        await self._slots.acquire()
+        try:
+            future = self._executor.submit(run)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            with worker_lock:
+                if 'thread' in worker:
+                    self.db.interrupt(worker['thread'])
+            raise
+    
+    def __getattr__(self, name: str):
+        attribute = getattr(self.db, name)
+        if (name.startswith('_') or name in self.NOT_WRAPPED or not callable(attribute)
+                or inspect.isgeneratorfunction(getattr(type(self.db), name, None))):
+            return attribute
+        
+        @functools.wraps(attribute)
+        async def call(*args, **kwargs):
+            return await self._call(attribute, *args, **kwargs)
+        return call
+    
+    async def run_in_transaction(self, function: Callable, *args, **kwargs):
+        """Run function(db, *args, **kwargs) inside one transaction() on a worker thread
+        
+        Raise Rollback inside function to undo its changes quietly.
+        """
+        def run():
+            with self.db.transaction():
+                return function(self.db, *args, **kwargs)
+        return await self._call(run)
+    
+    # Streaming listings
+    async def iter_songs(self, order_by: str = 'title', after_key: Optional[Tuple] = None,
+                         page_size: int = 500):
+        """Stream songs page by page in the given order"""
+        while True:
+            songs, after_key = await self._call(self.db.get_songs_page,
+                                                order_by, after_key, page_size)
+            for song in songs:
+                yield song
+            if after_key is None:
+                return
+    
+    async def iter_playlist_songs(self, playlist_id: int, page_size: int = 500):
+        """Stream a playlist's songs page by page"""
+        after_key = None
+        while True:
+            songs, after_key = await self._call(self.db.get_playlist_songs_page,
+                                                playlist_id, after_key, page_size)
+            for song in songs:
+                yield song
+            if after_key is None:
+                return
+    
+    async def iter_playlists(self, page_size: int = 100):
+        """Stream playlists page by page, most recently modified first"""
+        after_key = None
+        while True:
+            playlists, after_key = await self._call(self.db.get_playlists_page,
+                                                    after_key, page_size)
+            for playlist in playlists:
+                yield playlist
+            if after_key is None:
+                return
+    
+    async def get_all_songs(self) -> List[Dict]:
+        """Get all songs, fetched in pages so other calls can interleave"""
+        return [song async for song in self.iter_songs()]
+    
+    async def get_playlist_songs(self, playlist_id: int) -> List[Dict]:
+        """Get all songs in a playlist, fetched in pages"""
+        return [song async for song in self.iter_playlist_songs(playlist_id)]
+    
+    async def close(self):
+        """Close the Database and shut the executor down"""
+        await self._call(self.db.close)
+        self._executor.shutdown(wait=False)
+    
+    async def __aenter__(self) -> 'AsyncDatabase':
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,162 @@
+"""
+Rotated background backups of the P.R.I.S.M database
+
+BackupJob runs Database.backup on its own thread into a snapshot directory,
+optionally gzips the snapshot, and keeps only the newest few snapshots.
+Snapshots are named <database>-<YYYYmmdd-HHMMSS>.db[.gz], so they sort by
+age.
+"""
+
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bytes copied per read while compressing a snapshot
+COPY_CHUNK = 1 << 20
+
+
+class BackupCancelled(Exception):
+    """Raised inside a running backup to stop it"""
+
+
+class BackupJob:
+    """One backup of a Database, run synchronously or on a background thread
+    
+    progress(fraction) is called from the backup thread as pages are
+    copied; the same value is available as job.progress. After the job
+    finishes, job.path is the snapshot written, or None if it failed or
+    was cancelled.
+    """
+    
+    def __init__(self, db, directory: str, keep: int = 5, compress: bool = False,
+                 progress: Optional[Callable[[float], None]] = None, **options):
+        """options (pages, throttle) are passed on to Database.backup"""
+        self.db = db
+        self.directory = directory
+        self.keep = keep
+        self.compress = compress
+        self.options = options
+        self.on_progress = progress
+        self.progress = 0.0
+        self.path = None
+        self._cancelled = threading.Event()
+        self._thread = None
+    
+    @property
+    def stem(self) -> str:
+        """Snapshot name prefix, taken from the database file name"""
+        if self.db.pool.in_memory:
+            return "prism"
+        return os.path.splitext(os.path.basename(self.db.db_name))[0]
+    
+    def start(self) -> 'BackupJob':
+        """Run the job on a daemon thread and return immediately"""
+        self._thread = threading.Thread(target=self.run, name="prism-backup", daemon=True)
+        self._thread.start()
+        return self
+    
+    def cancel(self):
+        """Stop the copy after its current step"""
+        self._cancelled.set()
+    
+    def wait(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Wait for a started job and return the snapshot path"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.path
+    
+    @property
+    def done(self) -> bool:
+        return self._thread is not None and not self._thread.is_alive()
+    
+    def _step(self, remaining: int, total: int):
+        if self._cancelled.is_set():
+            raise BackupCancelled()
+        self.progress = (total - remaining) / total if total else 1.0
+        if self.on_progress:
+            self.on_progress(self.progress)
+    
+    def run(self) -> Optional[str]:
+        """Take the snapshot, compress it if asked, then rotate old ones"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.error("Cannot create backup folder %s: %s", self.directory, e)
+            return None
+        path = self._new_path()
+        try:
+            if not self.db.backup(path, progress=self._step, **self.options):
+                return None
+        except BackupCancelled:
+            logger.info("Backup to %s cancelled", path)
+            return None
+        if self.compress:
+            path = compress_snapshot(path)
+            if path is None:
+                return None
+        self.path = path
+        rotate_snapshots(self.directory, self.stem, self.keep)
+        return path
+    
+    def _new_path(self) -> str:
+        name = f"{self.stem}-{time.strftime('%Y%m%d-%H%M%S')}"
+        path = os.path.join(self.directory, f"{name}.db")
+        suffix = 1
+        while os.path.exists(path) or os.path.exists(path + ".gz"):
+            path = os.path.join(self.directory, f"{name}-{suffix}.db")
+            suffix += 1
+        return path
+
+
+def compress_snapshot(path: str) -> Optional[str]:
+    """Gzip a snapshot in place and return the new path"""
+    archive = path + ".gz"
+    try:
+        with open(path, 'rb') as source, gzip.open(archive + ".partial", 'wb') as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK)
+        os.replace(archive + ".partial", archive)
+        os.remove(path)
+        return archive
+    except OSError as e:
+        logger.error("Error compressing backup %s: %s", path, e)
+        if os.path.exists(archive + ".partial"):
+            os.remove(archive + ".partial")
+        return None
+
+
+def list_snapshots(directory: str, stem: str) -> List[str]:
+    """Snapshot paths for a database, oldest first"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    # Anchored on the timestamp BackupJob writes, so "prism-live-..." is
+    # not taken for a snapshot of "prism"
+    pattern = re.compile(re.escape(stem) + r"-(\d{8}-\d{6})(?:-(\d+))?\.db(?:\.gz)?")
+    snapshots = []
+    for name in names:
+        match = pattern.fullmatch(name)
+        if match:
+            snapshots.append(((match.group(1), int(match.group(2) or 0)), name))
+    # "-1" tie-breakers sort after the plain name, and numerically
+    snapshots.sort()
+    return [os.path.join(directory, name) for key, name in snapshots]
+
+
+def rotate_snapshots(directory: str, stem: str, keep: int) -> List[str]:
+    """Delete all but the newest `keep` snapshots and return the deleted paths"""
+    snapshots = list_snapshots(directory, stem)
+    expired = snapshots[:max(0, len(snapshots) - keep)]
+    for path in expired:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning("Cannot remove old backup %s: %s", path, e)
+    return expired
@@ -0,0 +1,674 @@
+"""
+Benchmarks for the P.R.I.S.M database
+
+generate_library() fills a database with a seeded synthetic library: songs
+by Zipf-popular artists with log-normal lengths, playlists with log-normal
+sizes (most hold a few dozen songs, a few run into the thousands) and a
+play history skewed towards popular songs and recent days. The same size
+and seed always produce the same library.
+
+run_benchmarks() times each scenario in SCENARIOS (one per Database
+operation) and reports latency percentiles; compare() checks a run against
+a stored baseline. From the command line:
+    
+    python benchmark.py --size 100k --output run.json --baseline baseline.json
+
+exits with status 1 when a scenario is slower than the baseline by more
+than --threshold. Each run works on a copy of the generated (or --db)
+file, so what the write scenarios change is never measured again.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from database import Database
+from metrics import LatencyHistogram
+from scanner import format_duration
+
+logger = logging.getLogger(__name__)
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+DEFAULT_SEED = 42
+
+# Library shape
+SONGS_PER_ARTIST = 12
+SONGS_PER_PLAYLIST_COUNT = 200      # one playlist per this many songs
+PLAYLIST_MEDIAN_SIZE = 40
+MAX_PLAYLIST_SIZE = 5000
+PLAYS_PER_SONG = 2
+PLAY_HISTORY_DAYS = 60
+
+# Scenario runs stop after this many timed calls or seconds, whichever
+# comes first, but never before MIN_CALLS
+MAX_CALLS = 500
+TIME_BUDGET = 2.0
+MIN_CALLS = 3
+
+# Comparisons ignore changes smaller than this, which are timer noise
+NOISE_FLOOR_MS = 0.05
+
+_SYLLABLES = ('la', 'mi', 'ron', 'ka', 'tes', 'vo', 'dan', 'sel', 'ur', 'bri', 'no', 'gal',
+              'phe', 'zu', 'mor', 'ti', 'an', 'quo', 'ler', 'sa', 'vin', 'ko', 'et', 'ry')
+
+
+def _vocabulary(rng: random.Random, size: int) -> List[str]:
+    """Pronounceable made-up words, so full-text search sees realistic tokens"""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 3))).capitalize())
+    return sorted(words)
+
+
+def _zipf_weights(count: int, exponent: float = 1.07) -> List[float]:
+    """Cumulative Zipf weights for random.choices(cum_weights=...)"""
+    total = 0.0
+    weights = []
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        weights.append(total)
+    return weights
+
+
+def generate_library(db: Database, songs: int, seed: int = DEFAULT_SEED,
+                     plays_per_song: float = PLAYS_PER_SONG) -> Dict:
+    """Fill an empty database with a synthetic library and return its counts"""
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    
+    # Songs
+    words = _vocabulary(rng, 3000)
+    word_weights = _zipf_weights(len(words))
+    artists = [' '.join(rng.choices(words, k=rng.randint(1, 2))) for _ in
+               range(max(50, songs // SONGS_PER_ARTIST))]
+    song_artists = rng.choices(artists, cum_weights=_zipf_weights(len(artists)), k=songs)
+    rows = []
+    seen = set()
+    for index, artist in enumerate(song_artists):
+        # No two songs share title and artist, so there is nothing to merge
+        title = None
+        while title is None or (title.lower(), artist) in seen:
+            title = ' '.join(rng.choices(words, cum_weights=word_weights, k=rng.randint(1, 4)))
+        seen.add((title.lower(), artist))
+        seconds = min(1200, max(30, int(rng.lognormvariate(math.log(220), 0.35))))
+        file_path = f"/music/{artist}/{index:07d} {title}.mp3" if rng.random() < 0.8 else ""
+        rows.append((title, artist, format_duration(seconds * 1000), file_path))
+    created = db.create_songs_bulk(rows, chunk_size=5000)['ids']
+    song_ids = [song_id for song_id in created if song_id]
+    
+    # Songs with a file are in the media manifest, as if a scan found them
+    mtime_ns = time.time_ns()
+    with db.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO library_files (path, size, mtime_ns, song_id) VALUES (?, ?, ?, ?)
+        ''', ((row[3], rng.randint(2, 12) << 20, mtime_ns, song_id)
+              for row, song_id in zip(rows, created) if song_id and row[3]))
+    del rows, seen
+    
+    # Playlists
+    memberships = []
+    playlist_count = max(10, songs // SONGS_PER_PLAYLIST_COUNT)
+    for number in range(playlist_count):
+        name = f"{' '.join(rng.choices(words, k=rng.randint(1, 3)))} #{number}"
+        playlist_id = db.create_playlist(name, rng.choice(['', 'Mix of ' + rng.choice(words)]))
+        size = min(len(song_ids), MAX_PLAYLIST_SIZE,
+                   max(1, int(rng.lognormvariate(math.log(PLAYLIST_MEDIAN_SIZE), 1.0))))
+        memberships.extend((playlist_id, song_id) for song_id in rng.sample(song_ids, size))
+    db.add_songs_to_playlist_bulk(memberships, chunk_size=5000)
+    
+    # Play history, oldest first, with the rollup triggers doing their work
+    play_count = int(len(song_ids) * plays_per_song)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    played = rng.choices(song_ids, cum_weights=_zipf_weights(len(song_ids), 0.9), k=play_count)
+    ages = sorted((min(PLAY_HISTORY_DAYS, rng.expovariate(1 / 7)) for _ in range(play_count)),
+                  reverse=True)
+    with db.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO recently_played (song_id, played_date) VALUES (?, ?)
+        ''', ((song_id, (now - timedelta(days=age)).strftime('%Y-%m-%d %H:%M:%S'))
+              for song_id, age in zip(played, ages)))
+    db.refresh_top_songs()
+    
+    result = {'songs': len(song_ids), 'playlists': playlist_count,
+              'memberships': len(memberships), 'plays': play_count,
+              'seconds': round(time.perf_counter() - started, 2)}
+    logger.info("Generated library: %s", result)
+    return result
+
+
+def library_counts(db: Database) -> Dict:
+    """How big the library in db actually is"""
+    counts = {}
+    for name, table in (('songs', 'songs'), ('playlists', 'playlists'),
+                        ('memberships', 'playlist_songs'), ('plays', 'recently_played')):
+        counts[name] = db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return counts
+
+
+def copy_database(source: str, target: str):
+    """Copy a database file (and anything still in its WAL) over target"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+class Fixture:
+    """What scenarios need to know about the benchmark library"""
+    
+    def __init__(self, db: Database, seed: int):
+        self.rng = random.Random(seed)
+        with db.transaction() as cursor:
+            cursor.execute("SELECT MIN(song_id), MAX(song_id) FROM songs")
+            self.first_song, self.last_song = cursor.fetchone()
+            cursor.execute("SELECT playlist_id FROM playlists ORDER BY playlist_id")
+            self.playlist_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute('''
+                SELECT playlist_id FROM playlists ORDER BY song_count DESC LIMIT 1
+            ''')
+            self.largest_playlist = cursor.fetchone()[0]
+            cursor.execute("SELECT song_id FROM playlist_songs WHERE playlist_id = ?",
+                           (self.largest_playlist,))
+            self.largest_members = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT title FROM songs WHERE song_id % 97 = 0 LIMIT 200")
+            self.title_words = sorted({title.split()[0] for (title,) in cursor.fetchall()})
+            cursor.execute("SELECT path FROM library_files LIMIT 1")
+            row = cursor.fetchone()
+        self.music_root = os.path.dirname(row[0]) if row else "/music"
+    
+    def song(self) -> int:
+        return self.rng.randint(self.first_song, self.last_song)
+    
+    def outsider(self) -> int:
+        """A song that is not in the largest playlist"""
+        song_id = self.song()
+        while song_id in self.largest_members:
+            song_id = self.song()
+        return song_id
+    
+    def songs(self, count: int) -> List[int]:
+        return [self.song() for _ in range(count)]
+    
+    def playlist(self) -> int:
+        return self.rng.choice(self.playlist_ids)
+    
+    def word(self) -> str:
+        return self.rng.choice(self.title_words)
+
+
+class Timer:
+    """Context manager that records the time spent inside it"""
+    
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.recording = False
+        self._started = 0.0
+    
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        if self.recording:
+            self.histogram.add(time.perf_counter() - self._started)
+        return False
+
+
+# Scenarios take (db, fixture, timer) and time one call with `with timer:`;
+# setup and cleanup around it are not counted. Write scenarios undo what
+# they add or remove, so the library keeps its size from run to run.
+SCENARIOS: Dict[str, Callable] = {}
+
+
+def scenario(name: str, max_calls: int = MAX_CALLS):
+    def register(function):
+        function.max_calls = max_calls
+        SCENARIOS[name] = function
+        return function
+    return register
+
+
+@scenario('get_all_playlists', 100)
+def _get_all_playlists(db, fx, timer):
+    with timer:
+        db.get_all_playlists()
+
+
+@scenario('get_playlist_by_id')
+def _get_playlist_by_id(db, fx, timer):
+    playlist_id = fx.playlist()
+    with timer:
+        db.get_playlist_by_id(playlist_id)
+
+
+@scenario('get_playlists_page')
+def _get_playlists_page(db, fx, timer):
+    with timer:
+        db.get_playlists_page(page_size=100)
+
+
+@scenario('get_playlist_songs')
+def _get_playlist_songs(db, fx, timer):
+    playlist_id = fx.playlist()
+    with timer:
+        db.get_playlist_songs(playlist_id)
+
+
+@scenario('get_playlist_songs.largest', 50)
+def _get_playlist_songs_largest(db, fx, timer):
+    with timer:
+        db.get_playlist_songs(fx.largest_playlist)
+
+
+@scenario('get_playlist_songs_page')
+def _get_playlist_songs_page(db, fx, timer):
+    with timer:
+        db.get_playlist_songs_page(fx.largest_playlist, page_size=100)
+
+
+@scenario('get_song_by_id')
+def _get_song_by_id(db, fx, timer):
+    song_id = fx.song()
+    with timer:
+        db.get_song_by_id(song_id)
+
+
+@scenario('get_all_songs', 5)
+def _get_all_songs(db, fx, timer):
+    with timer:
+        db.get_all_songs()
+
+
+@scenario('count_songs')
+def _count_songs(db, fx, timer):
+    with timer:
+        db.count_songs()
+
+
+@scenario('get_songs_page.title')
+def _get_songs_page_title(db, fx, timer):
+    with timer:
+        db.get_songs_page('title', (fx.word(), 0), 100)
+
+
+@scenario('get_songs_page.artist')
+def _get_songs_page_artist(db, fx, timer):
+    with timer:
+        db.get_songs_page('artist', (fx.word(), 0), 100)
+
+
+@scenario('get_songs_by_duration')
+def _get_songs_by_duration(db, fx, timer):
+    low = fx.rng.randint(60, 400) * 1000
+    with timer:
+        db.get_songs_by_duration(low, low + 5000, 100)
+
+
+@scenario('get_song_playlist_ids')
+def _get_song_playlist_ids(db, fx, timer):
+    song_id = fx.song()
+    with timer:
+        db.get_song_playlist_ids(song_id)
+
+
+@scenario('search_songs')
+def _search_songs(db, fx, timer):
+    query = fx.word()
+    with timer:
+        db.search_songs(query, limit=50)
+
+
+@scenario('search_songs.prefix')
+def _search_songs_prefix(db, fx, timer):
+    query = fx.word()[:3]
+    with timer:
+        db.search_songs(query, limit=50)
+
+
+@scenario('search_playlists')
+def _search_playlists(db, fx, timer):
+    query = fx.word()
+    with timer:
+        db.search_playlists(query)
+
+
+@scenario('get_recently_played')
+def _get_recently_played(db, fx, timer):
+    with timer:
+        db.get_recently_played(10)
+
+
+@scenario('get_top_songs.week')
+def _get_top_songs_week(db, fx, timer):
+    with timer:
+        db.get_top_songs('week', 10)
+
+
+@scenario('get_top_songs.all')
+def _get_top_songs_all(db, fx, timer):
+    with timer:
+        db.get_top_songs('all', 10)
+
+
+@scenario('resolve_songs', 50)
+def _resolve_songs(db, fx, timer):
+    songs = [db.get_song_by_id(song_id) for song_id in fx.songs(100)]
+    songs = [dict(song) for song in songs if song]
+    with timer:
+        db.resolve_songs(songs, create=False)
+
+
+@scenario('get_library_files', 20)
+def _get_library_files(db, fx, timer):
+    with timer:
+        db.get_library_files(fx.music_root)
+
+
+# Writes
+@scenario('create_playlist')
+def _create_playlist(db, fx, timer):
+    with timer:
+        playlist_id = db.create_playlist(f"bench {fx.rng.random()}")
+    db.delete_playlist(playlist_id)
+
+
+@scenario('update_playlist')
+def _update_playlist(db, fx, timer):
+    playlist_id = fx.playlist()
+    with timer:
+        db.update_playlist(playlist_id, description=f"bench {fx.rng.random()}")
+
+
+@scenario('delete_playlist')
+def _delete_playlist(db, fx, timer):
+    playlist_id = db.create_playlist(f"bench {fx.rng.random()}")
+    db.add_songs_to_playlist(playlist_id, fx.songs(50))
+    with timer:
+        db.delete_playlist(playlist_id)
+
+
+@scenario('add_song_to_playlist')
+def _add_song_to_playlist(db, fx, timer):
+    playlist_id, song_id = fx.largest_playlist, fx.outsider()
+    with timer:
+        added = db.add_song_to_playlist(playlist_id, song_id)
+    if added:
+        db.remove_song_from_playlist(playlist_id, song_id)
+
+
+@scenario('insert_song_at')
+def _insert_song_at(db, fx, timer):
+    songs, _ = db.get_playlist_songs_page(fx.largest_playlist, page_size=50)
+    before = fx.rng.choice(songs)['song_id']
+    song_id = fx.outsider()
+    with timer:
+        added = db.insert_song_at(fx.largest_playlist, song_id, before)
+    if added:
+        db.remove_song_from_playlist(fx.largest_playlist, song_id)
+
+
+@scenario('move_song')
+def _move_song(db, fx, timer):
+    songs, _ = db.get_playlist_songs_page(fx.largest_playlist, page_size=50)
+    moved, before = fx.rng.sample([song['song_id'] for song in songs], 2)
+    with timer:
+        db.move_song(fx.largest_playlist, moved, before)
+
+
+@scenario('remove_song_from_playlist')
+def _remove_song_from_playlist(db, fx, timer):
+    playlist_id, song_id = fx.largest_playlist, fx.outsider()
+    if not db.add_song_to_playlist(playlist_id, song_id):
+        return
+    with timer:
+        db.remove_song_from_playlist(playlist_id, song_id)
+
+
+@scenario('add_songs_to_playlist', 100)
+def _add_songs_to_playlist(db, fx, timer):
+    playlist_id, song_ids = fx.playlist(), fx.songs(500)
+    existing = {song['song_id'] for song in db.get_playlist_songs(playlist_id)}
+    with timer:
+        db.add_songs_to_playlist(playlist_id, song_ids)
+    db.remove_songs_from_playlist(playlist_id,
+                                  [song_id for song_id in song_ids if song_id not in existing])
+
+
+@scenario('add_songs_to_playlist_bulk', 100)
+def _add_songs_to_playlist_bulk(db, fx, timer):
+    playlist_id = db.create_playlist(f"bench {fx.rng.random()}")
+    memberships = [(playlist_id, song_id) for song_id in set(fx.songs(500))]
+    with timer:
+        db.add_songs_to_playlist_bulk(memberships)
+    db.delete_playlist(playlist_id)
+
+
+@scenario('create_song')
+def _create_song(db, fx, timer):
+    with timer:
+        song_id = db.create_song(f"bench {fx.rng.random()}", "Bench", "3:00")
+    db.delete_song(song_id)
+
+
+@scenario('create_songs_bulk', 50)
+def _create_songs_bulk(db, fx, timer):
+    rows = [(f"bench {fx.rng.random()}", "Bench", "3:00") for _ in range(500)]
+    with timer:
+        ids = db.create_songs_bulk(rows)['ids']
+    db.delete_songs([song_id for song_id in ids if song_id])
+
+
+@scenario('get_or_create_song')
+def _get_or_create_song(db, fx, timer):
+    song = db.get_song_by_id(fx.song())
+    with timer:
+        db.get_or_create_song(song['title'], song['artist'], song['duration'])
+
+
+@scenario('delete_song')
+def _delete_song(db, fx, timer):
+    song_id = db.create_song(f"bench {fx.rng.random()}", "Bench", "3:00")
+    db.add_song_to_playlist(fx.playlist(), song_id)
+    with timer:
+        db.delete_song(song_id)
+
+
+@scenario('delete_songs', 50)
+def _delete_songs(db, fx, timer):
+    ids = db.create_songs_bulk([(f"bench {fx.rng.random()}", "Bench", "3:00")
+                                for _ in range(500)])['ids']
+    with timer:
+        db.delete_songs([song_id for song_id in ids if song_id])
+
+
+@scenario('add_to_recently_played')
+def _add_to_recently_played(db, fx, timer):
+    song_id = fx.song()
+    with timer:
+        db.add_to_recently_played(song_id)
+
+
+@scenario('refresh_top_songs', 20)
+def _refresh_top_songs(db, fx, timer):
+    with timer:
+        db.refresh_top_songs()
+
+
+@scenario('rebuild_playlist_aggregates', 20)
+def _rebuild_playlist_aggregates(db, fx, timer):
+    playlist_id = fx.playlist()
+    with timer:
+        db.rebuild_playlist_aggregates(playlist_id)
+
+
+@scenario('rebalance_playlist', 20)
+def _rebalance_playlist(db, fx, timer):
+    with timer:
+        db.rebalance_playlist(fx.largest_playlist)
+
+
+@scenario('merge_duplicate_songs', 3)
+def _merge_duplicate_songs(db, fx, timer):
+    with timer:
+        db.merge_duplicate_songs()
+
+
+def run_scenario(db: Database, fixture: Fixture, name: str,
+                 budget: float = TIME_BUDGET) -> Dict:
+    """Time one scenario after an untimed warm-up call"""
+    function = SCENARIOS[name]
+    timer = Timer()
+    function(db, fixture, timer)
+    timer.recording = True
+    deadline = time.perf_counter() + budget
+    calls = 0
+    while calls < function.max_calls and (calls < MIN_CALLS or time.perf_counter() < deadline):
+        function(db, fixture, timer)
+        calls += 1
+    return timer.histogram.summary()
+
+
+def run_benchmarks(db: Database, seed: int = DEFAULT_SEED, names: Optional[List[str]] = None,
+                   budget: float = TIME_BUDGET) -> Dict:
+    """Time the given scenarios (default: all) and return the results by name"""
+    fixture = Fixture(db, seed)
+    results = {}
+    for name in names or SCENARIOS:
+        results[name] = run_scenario(db, fixture, name, budget)
+        logger.info("%-32s p50 %8.3f ms  p95 %8.3f ms  (%s calls)", name,
+                    results[name]['p50_ms'], results[name]['p95_ms'], results[name]['count'])
+    return results
+
+
+def environment() -> Dict:
+    """What the numbers were measured on"""
+    return {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'date': datetime.now().isoformat(timespec='seconds')
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float = 0.25,
+            metric: str = 'p50_ms') -> List[Dict]:
+    """Scenarios whose metric grew by more than threshold (a fraction) over the baseline
+    
+    Scenarios missing from either side are skipped, as are changes
+    smaller than NOISE_FLOOR_MS.
+    """
+    regressions = []
+    for name, summary in results.items():
+        before = baseline.get(name)
+        if not before or not before.get('count'):
+            continue
+        old, new = before[metric], summary[metric]
+        if new - old > NOISE_FLOOR_MS and new > old * (1 + threshold):
+            regressions.append({'scenario': name, 'baseline_ms': old, 'current_ms': new,
+                                'change': new / old - 1 if old else math.inf})
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the P.R.I.S.M database")
+    parser.add_argument("--size", default="10k", choices=sorted(SIZES),
+                        help="library size to generate (default: 10k)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help=f"random seed for the library and scenarios (default: {DEFAULT_SEED})")
+    parser.add_argument("--db", metavar="PATH",
+                        help="benchmark a copy of this database instead of a generated one "
+                             "(default: prism-bench-SIZE-SEED.db, generated on first use)")
+    parser.add_argument("--scenarios", metavar="NAME,...",
+                        help="comma-separated scenarios to run (default: all)")
+    parser.add_argument("--budget", type=float, default=TIME_BUDGET,
+                        help=f"seconds to spend per scenario (default: {TIME_BUDGET})")
+    parser.add_argument("--output", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare against an earlier --output file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown over the baseline (default: 0.25 = 25%%)")
+    parser.add_argument("--metric", default="p50_ms", choices=["p50_ms", "p95_ms", "mean_ms"],
+                        help="statistic compared with the baseline (default: p50_ms)")
+    parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Keep the report readable; scenarios call some methods thousands of times
+    logging.getLogger('database').setLevel(logging.WARNING)
+    if args.list:
+        print('\n'.join(SCENARIOS))
+        return 0
+    names = args.scenarios.split(',') if args.scenarios else None
+    unknown = set(names or ()) - set(SCENARIOS)
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    
+    # The write scenarios change the library, so every run works on a
+    # copy and the source stays pristine for the next one
+    source = args.db or f"prism-bench-{args.size}-{args.seed}.db"
+    if not args.db and not os.path.exists(source):
+        db = Database(source, slow_query_ms=None)
+        try:
+            generate_library(db, SIZES[args.size], args.seed)
+        finally:
+            db.close()
+    root, extension = os.path.splitext(source)
+    path = f"{root}.run{extension}"
+    copy_database(source, path)
+    db = Database(path, slow_query_ms=None)
+    try:
+        library = library_counts(db)
+        results = run_benchmarks(db, args.seed, names, args.budget)
+    finally:
+        db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    
+    report = {'size': None if args.db else args.size, 'seed': args.seed, 'library': library,
+              'environment': environment(), 'scenarios': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline.get('library'), baseline.get('seed')) != (library, args.seed):
+            logger.warning("Baseline was measured on a different library (%s, seed %s)",
+                           baseline.get('library'), baseline.get('seed'))
+        regressions = compare(results, baseline.get('scenarios', {}), args.threshold, args.metric)
+        for regression in regressions:
+            logger.error("REGRESSION %-32s %8.3f ms -> %8.3f ms (%+.0f%%)",
+                         regression['scenario'], regression['baseline_ms'],
+                         regression['current_ms'], regression['change'] * 100)
+        if regressions:
+            return 1
+        logger.info("No regressions against %s", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import Database
+import events
+
+
+class CachedDatabase:
+    """Read-through LRU cache in front of a Database
+    
+    Lookups and list queries are cached under a key that includes the
+    generation counters of everything they depend on: one counter per
+    table and one per playlist. Every change event the Database publishes
+    after a commit bumps only the counters it affects, so stale entries
+    simply stop being reachable and age out of the LRU; the few writes
+    that publish no event are wrapped here. Anything else is passed
+    straight to the Database.
+    
+    Cached results are shared between callers and must be treated as
+    read-only.
+    """
+    
+    # Tables each change event affects, besides the playlists it names
+    EVENT_DEPENDENCIES = {
+        events.PLAYLIST_CREATED: ('playlists',),
+        events.PLAYLIST_UPDATED: ('playlists',),
+        events.PLAYLIST_DELETED: ('playlists',),
+        events.SONGS_ADDED: ('playlists',),
+        events.SONGS_REMOVED: ('playlists',),
+        events.SONG_MOVED: ('playlists',),
+        events.POSITIONS_RESPACED: (),
+        events.SONGS_CREATED: ('songs',),
+        # Edited tags change the songs' playlists and their durations
+        events.SONGS_UPDATED: ('songs', 'playlists', 'playlist_songs'),
+        events.SONGS_DELETED: ('songs', 'playlists', 'recently_played', 'top_played'),
+        events.PLAY_RECORDED: ('recently_played',)
+    }
+    
+    def __init__(self, db: Database, max_entries: int = 1024):
+        self.db = db
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._deferred = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.db.events.subscribe(self._changed)
+    
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+    
+    # Cache bookkeeping
+    def _version(self, dependencies: Iterable) -> Tuple:
+        """Current generations of a query's dependencies
+        
+        A ('playlist', id) dependency also follows the 'playlist_songs'
+        generation, which invalidates every playlist at once.
+        """
+        version = []
+        for dependency in dependencies:
+            version.append(self._generations.get(dependency, 0))
+            if isinstance(dependency, tuple):
+                version.append(self._generations.get('playlist_songs', 0))
+        return tuple(version)
+    
+    def _cached(self, method: str, args: Tuple, dependencies: Tuple):
+        """Return a cached result, running the query on a miss"""
+        # Reads inside a transaction may see uncommitted rows, so they
+        # must not end up in the cache
+        if self.db.in_transaction:
+            return getattr(self.db, method)(*args)
+        
+        with self._lock:
+            key = (method, args, self._version(dependencies))
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        
+        value = getattr(self.db, method)(*args)
+        
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+    
+    def invalidate(self, *dependencies):
+        """Bump the generations of tables ('songs', ...) or playlists (('playlist', id))
+        
+        Inside a transaction the bump is held back until the outermost
+        scope ends, so no other thread can cache data from before the
+        commit under the new generation.
+        """
+        if self.db.in_transaction:
+            self._deferred.update(dependencies)
+            return
+        with self._lock:
+            for dependency in dependencies:
+                self._generations[dependency] = self._generations.get(dependency, 0) + 1
+                self.invalidations += 1
+    
+    def _changed(self, event):
+        """Invalidate what a committed change event affects"""
+        playlists = [('playlist', playlist_id) for playlist_id in event.playlist_ids]
+        self.invalidate(*self.EVENT_DEPENDENCIES.get(event.kind, ()), *playlists)
+    
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """Return hit/miss/eviction counters and the current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+    
+    @contextmanager
+    def transaction(self):
+        """Database.transaction() that applies held-back invalidations on exit"""
+        try:
+            with self.db.transaction() as cursor:
+                yield cursor
+        finally:
+            if not self.db.in_transaction and self._deferred:
+                deferred, self._deferred = self._deferred, set()
+                self.invalidate(*deferred)
+    
+    # Cached reads
+    def get_all_playlists(self) -> List[Dict]:
+        return self._cached('get_all_playlists', (), ('playlists',))
+    
+    def get_playlist_by_id(self, playlist_id: int) -> Optional[Dict]:
+        return self._cached('get_playlist_by_id', (playlist_id,), (('playlist', playlist_id),))
+    
+    def get_song_by_id(self, song_id: int) -> Optional[Dict]:
+        return self._cached('get_song_by_id', (song_id,), ('songs',))
+    
+    def get_playlist_songs(self, playlist_id: int) -> List[Dict]:
+        return self._cached('get_playlist_songs', (playlist_id,), (('playlist', playlist_id),))
+    
+    def get_recently_played(self, limit: int = 10) -> List[Dict]:
+        return self._cached('get_recently_played', (limit,), ('recently_played', 'songs'))
+    
+    def get_top_songs(self, period: str = 'week', limit: int = 10) -> List[Dict]:
+        return self._cached('get_top_songs', (period, limit), ('top_played', 'songs'))
+    
+    def count_songs(self) -> int:
+        return self._cached('count_songs', (), ('songs',))
+    
+    def search_songs(self, query: str, limit: Optional[int] = None) -> List[Dict]:
+        return self._cached('search_songs', (query, limit), ('songs',))
+    
+    def search_playlists(self, query: str) -> List[Dict]:
+        return self._cached('search_playlists', (query,), ('playlists',))
+    
+    # Writes that publish no change event
+    def rebuild_playlist_aggregates(self, playlist_id: Optional[int] = None) -> bool:
+        rebuilt = self.db.rebuild_playlist_aggregates(playlist_id)
+        self.invalidate('playlists',
+                        'playlist_songs' if playlist_id is None else ('playlist', playlist_id))
+        return rebuilt
+    
+    def merge_duplicate_songs(self, *args, **kwargs) -> Dict:
+        result = self.db.merge_duplicate_songs(*args, **kwargs)
+        # The merge refreshes the top-song rankings after its last event
+        self.invalidate('top_played')
+        return result
+    
+    def refresh_top_songs(self, *args, **kwargs) -> bool:
+        refreshed = self.db.refresh_top_songs(*args, **kwargs)
+        self.invalidate('top_played')
+        return refreshed
+    
+    def compact_play_history(self, *args, **kwargs) -> bool:
+        compacted = self.db.compact_play_history(*args, **kwargs)
+        self.invalidate('recently_played', 'top_played')
+        return compacted
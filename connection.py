@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class ConnectionManager:
+    """Owns one writer connection and a bounded pool of read-only connections
+    
+    The database runs in WAL mode so readers never block the writer (and
+    vice versa). Each thread borrows at most one reader at a time; when all
+    readers are in use, further threads wait for one to be returned.
+    """
+    
+    DEFAULT_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,        # negative means KiB, i.e. 64 MB
+        'mmap_size': 268435456,      # 256 MB
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON'
+    }
+    
+    # Pragmas that only make sense on the connection that writes
+    WRITER_ONLY_PRAGMAS = ('journal_mode', 'synchronous')
+    
+    def __init__(self, db_name: str, max_readers: int = 4,
+                 pragmas: Optional[Dict] = None, timeout: float = 5.0):
+        """Open the writer connection and prepare the reader pool"""
+        self.db_name = db_name
+        self.timeout = timeout
+        self.pragmas = dict(self.DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        unknown = set(self.pragmas) - set(self.DEFAULT_PRAGMAS)
+        if unknown:
+            raise ValueError(f"Unsupported pragmas: {', '.join(sorted(unknown))}")
+        
+        # In-memory databases are private to their connection, so they
+        # cannot be shared with a reader pool
+        self.in_memory = db_name == ":memory:" or db_name.startswith("file::memory:")
+        self.max_readers = 0 if self.in_memory else max(0, max_readers)
+        
+        self.write_lock = threading.RLock()
+        self.writer = sqlite3.connect(db_name, timeout=timeout, isolation_level=None,
+                                      check_same_thread=False)
+        self._apply_pragmas(self.writer, writer=True)
+        
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_readers or 1)
+        self._idle = []
+        self._readers = []
+        self._borrowed = {}
+        self._closed = False
+    
+    def _apply_pragmas(self, conn: sqlite3.Connection, writer: bool):
+        """Apply the configured pragmas to a fresh connection"""
+        for name, value in self.pragmas.items():
+            if not writer and name in self.WRITER_ONLY_PRAGMAS:
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+        if not writer:
+            conn.execute("PRAGMA query_only = ON")
+    
+    def _open_reader(self) -> sqlite3.Connection:
+        """Open a new read-only connection to the database file"""
+        uri = f"{Path(self.db_name).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.timeout,
+                               isolation_level=None, check_same_thread=False)
+        self._apply_pragmas(conn, writer=False)
+        return conn
+    
+    def dedicated_reader(self) -> sqlite3.Connection:
+        """Open a read-only connection outside the pool for a long-running job
+        
+        The caller owns the connection and must close it.
+        """
+        return self._open_reader()
+    
+    @property
+    def journal_mode(self) -> str:
+        """The journal mode actually in effect (WAL may be refused, e.g. on network shares)"""
+        return self.writer.execute("PRAGMA journal_mode").fetchone()[0]
+    
+    @contextmanager
+    def reader(self):
+        """Borrow the calling thread's read-only connection
+        
+        Re-entrant within a thread. Falls back to the writer connection
+        (under the write lock) when pooling is disabled.
+        """
+        conn = getattr(self._local, 'reader', None)
+        if conn is not None:
+            yield conn
+            return
+        
+        if self.max_readers == 0:
+            with self.write_lock:
+                yield self.writer
+            return
+        
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Timed out waiting for a reader connection")
+        try:
+            with self._pool_lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._open_reader()
+                with self._pool_lock:
+                    self._readers.append(conn)
+            self._local.reader = conn
+            with self._pool_lock:
+                self._borrowed[threading.get_ident()] = conn
+            try:
+                yield conn
+            finally:
+                with self._pool_lock:
+                    self._borrowed.pop(threading.get_ident(), None)
+                self._local.reader = None
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                with self._pool_lock:
+                    if not self._closed:
+                        self._idle.append(conn)
+        finally:
+            self._slots.release()
+    
+    def interrupt_reader(self, thread_id: int) -> bool:
+        """Abort the query running on the reader borrowed by another thread
+        
+        The interrupted call fails with sqlite3.OperationalError. Returns
+        False when that thread holds no reader.
+        """
+        with self._pool_lock:
+            conn = self._borrowed.get(thread_id)
+            if conn is None:
+                return False
+            conn.interrupt()
+            return True
+    
+    def close(self):
+        """Close the writer and every pooled reader"""
+        with self._pool_lock:
+            self._closed = True
+            readers, self._readers, self._idle = self._readers, [], []
+        for conn in readers:
+            conn.close()
+        self.writer.close()
@@ -1,138 +1,430 @@
+import json
+import logging
+import os
+import re
 import sqlite3
-from typing import List, Dict, Optional
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, List, Dict, Optional, Iterable, Tuple
+import migrations
+from connection import ConnectionManager
+from records import Song, Playlist, Rows
+from rebalancer import PositionRebalancer
+from metrics import QueryMetrics, TimedCursor, instrumented, statement_template
+from backup import BackupJob
+import events
+from events import ChangeEvent, EventBus
+import smart
 
+logger = logging.getLogger(__name__)
+
+
+class Rollback(Exception):
+    """Raise inside a transaction() scope to roll it back quietly"""
+
+
+@instrumented
 class Database:
     """Database handler for P.R.I.S.M application"""
     
-    def __init__(self, db_name: str = "prism.db"):
-        """Initialize database connection"""
+    # Public methods not timed by @instrumented
+    UNTIMED = ('transaction',)
+    
+    # A move or insert that leaves less room than this between neighbouring
+    # position keys queues the playlist for background respacing
+    REBALANCE_THRESHOLD = 16
+    
+    # Play history retention: raw events and hourly counts older than this
+    # are compacted away by compact_play_history()
+    RAW_PLAY_RETENTION_DAYS = 30
+    HOURLY_PLAY_RETENTION_DAYS = 14
+    
+    # Periods ranked by get_top_songs: (rollup table, bucket column, start of
+    # the period), or no table for all-time totals
+    PLAY_PERIODS = {
+        'day': ('play_counts_hourly', 'hour', "datetime('now', '-24 hours')"),
+        'week': ('play_counts_daily', 'day', "date('now', '-6 days')"),
+        'month': ('play_counts_daily', 'day', "date('now', '-29 days')"),
+        'all': (None, None, None)
+    }
+    
+    # Shapes query methods can return rows in (see __init__)
+    ROW_FORMATS = ('dict', 'row', 'record', 'tuple')
+    
+    def __init__(self, db_name: str = "prism.db", max_readers: int = 4,
+                 pragmas: Optional[Dict] = None, row_format: str = 'dict',
+                 slow_query_ms: Optional[float] = 100.0):
+        """Initialize database connection
+        
+        max_readers bounds the pool of read-only connections; pragmas
+        overrides ConnectionManager.DEFAULT_PRAGMAS (synchronous, cache_size,
+        mmap_size, temp_store, ...).
+        
+        row_format picks what song and playlist queries return: 'dict'
+        (the default), 'row' for sqlite3.Row, 'record' for the slotted
+        Song/Playlist types, or 'tuple' for plain tuples, read through the
+        column map of the returned Rows list or column_map().
+        
+        Call counts and latencies are collected in self.metrics; statements
+        slower than slow_query_ms are logged with their query plan.
+        """
+        self.metrics = QueryMetrics(slow_query_ms)
+        if row_format not in self.ROW_FORMATS:
+            raise ValueError(f"Unknown row format: {row_format}")
         self.db_name = db_name
+        self.row_format = row_format
+        self.max_readers = max_readers
+        self.pragmas = pragmas
+        self.pool = None
         self.conn = None
-        self.cursor = None
+        self._tx_depth = 0
+        self._tx_owner = None
+        self._pending_events = []
+        self.events = EventBus()
+        self.fts_enabled = False
+        self._columns = {}
+        self.rebalancer = PositionRebalancer(self.rebalance_playlist)
         self.connect()
         self.create_tables()
     
     def connect(self):
         """Establish database connection"""
         try:
-            self.conn = sqlite3.connect(self.db_name)
-            self.cursor = self.conn.cursor()
-            print(f"Connected to database: {self.db_name}")
+            self.pool = ConnectionManager(self.db_name, self.max_readers, self.pragmas)
+            # The writer runs in autocommit mode: transactions are managed by transaction()
+            self.conn = self.pool.writer
+            logger.info("Connected to database: %s (%s mode)", self.db_name, self.pool.journal_mode)
         except sqlite3.Error as e:
-            print(f"Database connection error: {e}")
+            logger.error("Database connection error: %s", e)
+    
+    @contextmanager
+    def transaction(self):
+        """Group several operations into one atomic unit of work
+        
+        Yields a cursor on the writer connection. The outermost scope holds
+        the write lock and commits once on exit; nested scopes become
+        savepoints so a failing inner scope only undoes its own changes.
+        Methods called outside any scope commit on their own. Raising
+        Rollback inside a scope rolls it back without propagating.
+        
+        Change events raised in the scope are published on self.events
+        after the outermost commit, once the write lock is released. Just
+        before that commit, smart playlists re-match the songs the events
+        name.
+        """
+        committed = None
+        with self.pool.write_lock:
+            depth = self._tx_depth
+            mark = len(self._pending_events)
+            savepoint = f"prism_sp_{depth}"
+            if depth == 0:
+                self._cursor(self.conn).execute("BEGIN IMMEDIATE")
+                self._tx_owner = threading.get_ident()
+            else:
+                self.conn.execute(f"SAVEPOINT {savepoint}")
+            self._tx_depth += 1
+            try:
+                cursor = self._cursor(self.conn)
+                yield cursor
+                if depth == 0 and self._pending_events:
+                    self._update_smart_playlists(cursor)
+            except BaseException as e:
+                self._tx_depth -= 1
+                del self._pending_events[mark:]
+                # An interrupted statement makes SQLite roll the whole
+                # transaction back itself, leaving nothing to undo here
+                if depth == 0:
+                    self._tx_owner = None
+                    if self.conn.in_transaction:
+                        self.conn.execute("ROLLBACK")
+                elif self.conn.in_transaction:
+                    self.conn.execute(f"ROLLBACK TO {savepoint}")
+                    self.conn.execute(f"RELEASE {savepoint}")
+                if isinstance(e, Rollback):
+                    return
+                raise
+            else:
+                if depth == 0:
+                    # A failed COMMIT (busy, disk full, interrupted) can leave
+                    # the transaction open; roll it back so the next scope
+                    # can BEGIN again
+                    try:
+                        self._cursor(self.conn).execute("COMMIT")
+                    except BaseException:
+                        self._pending_events.clear()
+                        if self.conn.in_transaction:
+                            self.conn.execute("ROLLBACK")
+                        raise
+                    finally:
+                        self._tx_depth -= 1
+                        self._tx_owner = None
+                    committed, self._pending_events = self._pending_events, []
+                else:
+                    self._tx_depth -= 1
+                    self.conn.execute(f"RELEASE {savepoint}")
+        if committed:
+            self.events.publish(events.coalesce(committed))
+    
+    def _emit(self, kind: str, playlist_ids: Iterable[int] = (), song_ids: Iterable[int] = ()):
+        """Queue a change event for publishing when the current transaction commits"""
+        event = ChangeEvent(kind, tuple(playlist_ids), tuple(song_ids))
+        if self.in_transaction:
+            self._pending_events.append(event)
+        else:
+            self.events.publish([event])
+    
+    @property
+    def in_transaction(self) -> bool:
+        """Whether the calling thread has a transaction() scope open"""
+        return self._tx_owner == threading.get_ident()
+    
+    @contextmanager
+    def _read(self):
+        """Borrow a connection for reading
+        
+        Inside the caller's own transaction reads go to the writer so they
+        see uncommitted changes; otherwise they use the reader pool.
+        """
+        if self.in_transaction:
+            yield self.conn
+        else:
+            with self.pool.reader() as conn:
+                yield conn
+    
+    def interrupt(self, thread_id: int):
+        """Abort the statement another thread is running through this Database
+        
+        Interrupts that thread's pooled reader, or the writer when the
+        thread owns the open transaction (which is then rolled back). The
+        interrupted method fails the way it does on any SQLite error.
+        """
+        if self._tx_owner == thread_id:
+            self.conn.interrupt()
+        self.pool.interrupt_reader(thread_id)
+    
+    def _cursor(self, conn: sqlite3.Connection) -> TimedCursor:
+        """Open a cursor whose statements are recorded in self.metrics"""
+        cursor = conn.cursor(TimedCursor)
+        cursor.metrics = self.metrics
+        return cursor
+    
+    def _column_layout(self, sql: str, cursor) -> Tuple[Tuple[str, ...], Dict[str, int]]:
+        """Column names and name-to-index map of a query, cached per statement template
+        
+        Keying on the template keeps chunked IN (...) queries to one entry
+        whatever their length, so the cache is bounded by the statements
+        in the code.
+        """
+        key = statement_template(sql)
+        layout = self._columns.get(key)
+        if layout is None:
+            names = tuple(desc[0] for desc in cursor.description)
+            layout = self._columns[key] = (names, {name: i for i, name in enumerate(names)})
+        return layout
+    
+    def _convert(self, cursor, sql: str, rows: list, record: Optional[type]) -> Rows:
+        """Shape fetched rows according to row_format
+        
+        record is the Song/Playlist type used by the 'record' format;
+        internal queries pass None and always get dicts.
+        """
+        names, index = self._column_layout(sql, cursor)
+        row_format = self.row_format if record else 'dict'
+        if row_format == 'dict':
+            rows = [dict(zip(names, row)) for row in rows]
+        elif row_format == 'record':
+            record.check_columns(names)
+            rows = [record.from_row(names, row) for row in rows]
+        return Rows(rows, index)
+    
+    def _execute_read(self, conn, sql: str, params: Tuple, record: Optional[type]):
+        """Execute a read on a fresh cursor set up for the row format"""
+        cursor = conn.cursor()
+        if record and self.row_format == 'row':
+            cursor.row_factory = sqlite3.Row
+        return cursor.execute(sql, params)
+    
+    def _fetch_all(self, sql: str, params: Tuple = (), record: Optional[type] = None) -> Rows:
+        """Run a read query and return every row"""
+        with self._read() as conn:
+            start = time.perf_counter()
+            cursor = self._execute_read(conn, sql, params, record)
+            rows = cursor.fetchall()
+            self.metrics.record_statement(sql, time.perf_counter() - start, len(rows), conn, params)
+            return self._convert(cursor, sql, rows, record)
+    
+    def _fetch_one(self, sql: str, params: Tuple = (), record: Optional[type] = None):
+        """Run a read query and return its first row"""
+        with self._read() as conn:
+            start = time.perf_counter()
+            cursor = self._execute_read(conn, sql, params, record)
+            row = cursor.fetchone()
+            self.metrics.record_statement(sql, time.perf_counter() - start, int(bool(row)),
+                                          conn, params)
+            if row:
+                return self._convert(cursor, sql, [row], record)[0]
+            return None
+    
+    def column_map(self, table: str) -> Dict[str, int]:
+        """Map column names to tuple indexes for SELECT * rows of a table"""
+        with self._read() as conn:
+            columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        return {column[1]: column[0] for column in columns}
     
     def create_tables(self):
-        """Create all necessary tables with proper relationships"""
-        try:
-            # Playlists table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS playlists (
-                    playlist_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    description TEXT,
-                    icon_color TEXT DEFAULT '#8B5CF6',
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Songs table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS songs (
-                    song_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    artist TEXT NOT NULL,
-                    duration TEXT NOT NULL,
-                    file_path TEXT,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Playlist_Songs junction table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS playlist_songs (
-                    ps_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    playlist_id INTEGER NOT NULL,
-                    song_id INTEGER NOT NULL,
-                    position INTEGER NOT NULL,
-                    added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (playlist_id) REFERENCES playlists(playlist_id) ON DELETE CASCADE,
-                    FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE CASCADE,
-                    UNIQUE(playlist_id, song_id)
-                )
-            ''')
-            
-            # Recently played table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS recently_played (
-                    rp_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    song_id INTEGER NOT NULL,
-                    played_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE CASCADE
-                )
-            ''')
+        """Create all necessary tables with proper relationships
+        
+        These statements describe the original (version 0) schema; later
+        changes are layered on top of it by migrate(), which is a no-op for
+        an up-to-date file.
+        """
+        try:
+            # A versioned file already has these tables, so a pragma read
+            # spares it the write transaction on every start
+            if migrations.get_version(self.conn) == 0:
+                with self.transaction() as cursor:
+                    # Playlists table
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS playlists (
+                            playlist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            name TEXT NOT NULL UNIQUE,
+                            description TEXT,
+                            icon_color TEXT DEFAULT '#8B5CF6',
+                            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
+                    
+                    # Songs table
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS songs (
+                            song_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            title TEXT NOT NULL,
+                            artist TEXT NOT NULL,
+                            duration TEXT NOT NULL,
+                            file_path TEXT,
+                            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
+                    
+                    # Playlist_Songs junction table
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS playlist_songs (
+                            ps_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            playlist_id INTEGER NOT NULL,
+                            song_id INTEGER NOT NULL,
+                            position INTEGER NOT NULL,
+                            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            FOREIGN KEY (playlist_id) REFERENCES playlists(playlist_id) ON DELETE CASCADE,
+                            FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE CASCADE,
+                            UNIQUE(playlist_id, song_id)
+                        )
+                    ''')
+                    
+                    # Recently played table
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS recently_played (
+                            rp_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            song_id INTEGER NOT NULL,
+                            played_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE CASCADE
+                        )
+                    ''')
             
-            self.conn.commit()
-            print("Database tables created/verified successfully")
+            self.migrate()
+            logger.info("Database tables created/verified successfully")
         except sqlite3.Error as e:
-            print(f"Error creating tables: {e}")
+            logger.error("Error creating tables: %s", e)
+    
+    def migrate(self) -> int:
+        """Apply pending schema migrations and return the resulting version
+        
+        Each migration commits on its own, together with its version bump.
+        """
+        for version, description, upgrade in migrations.pending(self.conn):
+            with self.transaction() as cursor:
+                upgrade(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+            logger.info("Applied migration %s: %s", version, description)
+            self._columns.clear()
+        
+        self.fts_enabled = self._fetch_one(
+            "SELECT 1 AS found FROM sqlite_master WHERE name = 'songs_fts'") is not None
+        return migrations.get_version(self.conn)
+    
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """Turn free text into an FTS5 query matching every word as a prefix"""
+        terms = re.findall(r"\w+", query)
+        return ' '.join(f'"{term}"*' for term in terms)
     
     # Playlist Operations
     def create_playlist(self, name: str, description: str = "", icon_color: str = "#8B5CF6") -> Optional[int]:
         """Create a new playlist"""
         try:
-            self.cursor.execute('''
-                INSERT INTO playlists (name, description, icon_color)
-                VALUES (?, ?, ?)
-            ''', (name, description, icon_color))
-            self.conn.commit()
-            return self.cursor.lastrowid
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO playlists (name, description, icon_color)
+                    VALUES (?, ?, ?)
+                ''', (name, description, icon_color))
+                playlist_id = cursor.lastrowid
+                self._emit(events.PLAYLIST_CREATED, [playlist_id])
+            return playlist_id
         except sqlite3.IntegrityError:
-            print(f"Playlist '{name}' already exists")
+            logger.warning("Playlist '%s' already exists", name)
             return None
         except sqlite3.Error as e:
-            print(f"Error creating playlist: {e}")
+            logger.error("Error creating playlist: %s", e)
             return None
     
     def get_all_playlists(self) -> List[Dict]:
         """Retrieve all playlists with song count"""
         try:
-            self.cursor.execute('''
-                SELECT p.playlist_id, p.name, p.description, p.icon_color, 
-                       p.created_date, COUNT(ps.song_id) as song_count
-                FROM playlists p
-                LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
-                GROUP BY p.playlist_id
-                ORDER BY p.modified_date DESC
-            ''')
-            
-            columns = [desc[0] for desc in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            return self._fetch_all('''
+                SELECT playlist_id, name, description, icon_color, created_date,
+                       song_count, total_duration_ms
+                FROM playlists
+                ORDER BY modified_date DESC
+            ''', record=Playlist)
         except sqlite3.Error as e:
-            print(f"Error retrieving playlists: {e}")
+            logger.error("Error retrieving playlists: %s", e)
             return []
     
+    def has_playlists(self) -> bool:
+        """Whether any playlist exists, without reading the playlists"""
+        try:
+            return self._fetch_one("SELECT EXISTS (SELECT 1 FROM playlists) AS found")['found'] == 1
+        except sqlite3.Error as e:
+            logger.error("Error checking for playlists: %s", e)
+            return False
+    
     def get_playlist_by_id(self, playlist_id: int) -> Optional[Dict]:
         """Get a specific playlist by ID"""
         try:
-            self.cursor.execute('''
-                SELECT p.*, COUNT(ps.song_id) as song_count
-                FROM playlists p
-                LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
-                WHERE p.playlist_id = ?
-                GROUP BY p.playlist_id
-            ''', (playlist_id,))
-            
-            row = self.cursor.fetchone()
-            if row:
-                columns = [desc[0] for desc in self.cursor.description]
-                return dict(zip(columns, row))
-            return None
+            return self._fetch_one('''
+                SELECT * FROM playlists WHERE playlist_id = ?
+            ''', (playlist_id,), record=Playlist)
         except sqlite3.Error as e:
-            print(f"Error retrieving playlist: {e}")
+            logger.error("Error retrieving playlist: %s", e)
             return None
     
-    def update_playlist(self, playlist_id: int, name: str = None, 
+    def rebuild_playlist_aggregates(self, playlist_id: Optional[int] = None) -> bool:
+        """Recompute stored song counts and durations for one or all playlists
+        
+        The columns are kept current by triggers; this is a repair tool for
+        databases edited behind the application's back.
+        """
+        try:
+            with self.transaction() as cursor:
+                migrations.rebuild_playlist_aggregates(cursor, playlist_id)
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error rebuilding playlist aggregates: %s", e)
+            return False
+    
+    def update_playlist(self, playlist_id: int, name: str = None,
                        description: str = None, icon_color: str = None) -> bool:
         """Update playlist information"""
         try:
@@ -156,204 +448,1329 @@ class Database:
             params.append(playlist_id)
             
             query = f"UPDATE playlists SET {', '.join(updates)} WHERE playlist_id = ?"
-            self.cursor.execute(query, params)
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self.transaction() as cursor:
+                cursor.execute(query, params)
+                if cursor.rowcount > 0:
+                    self._emit(events.PLAYLIST_UPDATED, [playlist_id])
+            return cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error updating playlist: {e}")
+            logger.error("Error updating playlist: %s", e)
             return False
     
     def delete_playlist(self, playlist_id: int) -> bool:
         """Delete a playlist"""
         try:
-            self.cursor.execute("DELETE FROM playlists WHERE playlist_id = ?", (playlist_id,))
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self.transaction() as cursor:
+                cursor.execute("DELETE FROM playlists WHERE playlist_id = ?", (playlist_id,))
+                if cursor.rowcount > 0:
+                    self._emit(events.PLAYLIST_DELETED, [playlist_id])
+            return cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error deleting playlist: {e}")
+            logger.error("Error deleting playlist: %s", e)
             return False
     
     # Song Operations
     def create_song(self, title: str, artist: str, duration: str, file_path: str = "") -> Optional[int]:
-        """Add a new song"""
+        """Add a new song; duration is "M:SS" or "H:MM:SS" text"""
+        duration_ms = migrations.parse_duration(duration)
+        if duration_ms is None:
+            logger.error("Error creating song: invalid duration %r", duration)
+            return None
         try:
-            self.cursor.execute('''
-                INSERT INTO songs (title, artist, duration, file_path)
-                VALUES (?, ?, ?, ?)
-            ''', (title, artist, duration, file_path))
-            self.conn.commit()
-            return self.cursor.lastrowid
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO songs (title, artist, duration, file_path, duration_ms, fingerprint)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (title, artist, duration, file_path, duration_ms,
+                      migrations.song_fingerprint(title, artist)))
+                song_id = cursor.lastrowid
+                self._emit(events.SONGS_CREATED, song_ids=[song_id])
+            return song_id
         except sqlite3.Error as e:
-            print(f"Error creating song: {e}")
+            logger.error("Error creating song: %s", e)
             return None
     
+    def create_songs_bulk(self, songs: Iterable, chunk_size: int = 500) -> Dict:
+        """Add many songs in a single transaction
+        
+        Each song is a (title, artist, duration[, file_path]) tuple or a dict
+        with those keys. Returns {'ids': [...], 'conflicts': [...]} where ids
+        lines up with the input (None for rejected rows) and each conflict is
+        {'index', 'row', 'error'}. Rows with an invalid duration are rejected
+        as conflicts.
+        """
+        sql = '''
+            INSERT INTO songs (title, artist, duration, file_path, duration_ms, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?)
+        '''
+        result = {'ids': [], 'conflicts': []}
+        try:
+            with self.transaction():
+                offset = 0
+                for chunk in self._chunked(songs, chunk_size):
+                    params = [self._song_params(song) for song in chunk]
+                    self._insert_chunk(sql, params, offset, result)
+                    offset += len(chunk)
+                self._emit(events.SONGS_CREATED,
+                           song_ids=[song_id for song_id in result['ids'] if song_id])
+        except sqlite3.Error as e:
+            logger.error("Error creating songs in bulk: %s", e)
+            result['ids'] = [None] * len(result['ids'])
+        return result
+    
+    def get_or_create_song(self, title: str, artist: str, duration: str,
+                           file_path: str = "") -> Optional[int]:
+        """Return the ID of the song matching title and artist, creating it if needed
+        
+        Matching ignores case, whitespace and diacritics (see
+        migrations.song_fingerprint); the oldest match wins.
+        """
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    SELECT song_id FROM songs WHERE fingerprint = ?
+                    ORDER BY song_id LIMIT 1
+                ''', (migrations.song_fingerprint(title, artist),))
+                row = cursor.fetchone()
+                if row:
+                    return row[0]
+                return self.create_song(title, artist, duration, file_path)
+        except sqlite3.Error as e:
+            logger.error("Error finding or creating song: %s", e)
+            return None
+    
+    def resolve_songs(self, songs: List[Dict], create: bool = True) -> List[Optional[int]]:
+        """Find the IDs of songs by file path, then by title/artist fingerprint
+        
+        songs are dicts with title, artist, duration and optionally
+        file_path. Both lookups use an index and take one query per 500
+        songs. Songs not found are added when create is set, once per file
+        path (or fingerprint, for rows without one). Returns IDs in input
+        order, None where a song was neither found nor created.
+        """
+        fingerprints = [migrations.song_fingerprint(song.get('title'), song.get('artist'))
+                        for song in songs]
+        try:
+            with self.transaction() as cursor:
+                found = {}
+                for column, keys in (('file_path', {song.get('file_path') for song in songs}),
+                                     ('fingerprint', set(fingerprints))):
+                    keys.discard(None)
+                    keys.discard('')
+                    matches = {}
+                    for chunk in self._chunked(keys, 500):
+                        cursor.execute(f'''
+                            SELECT {column}, MIN(song_id) FROM songs
+                            WHERE {column} IN ({', '.join('?' * len(chunk))})
+                            GROUP BY {column}
+                        ''', chunk)
+                        matches.update(cursor.fetchall())
+                    found[column] = matches
+                
+                ids = [found['file_path'].get(song.get('file_path'))
+                       or found['fingerprint'].get(fingerprint)
+                       for song, fingerprint in zip(songs, fingerprints)]
+                if create:
+                    # Repeats within the batch are created once, keyed like the lookups
+                    keys = [song.get('file_path') or fingerprint
+                            for song, fingerprint in zip(songs, fingerprints)]
+                    new = {}
+                    for index, song_id in enumerate(ids):
+                        if song_id is None:
+                            new.setdefault(keys[index], songs[index])
+                    created = dict(zip(new, self.create_songs_bulk(list(new.values()))['ids']))
+                    ids = [song_id if song_id is not None else created[key]
+                           for song_id, key in zip(ids, keys)]
+                return ids
+        except sqlite3.Error as e:
+            logger.error("Error resolving songs: %s", e)
+            return [None] * len(songs)
+    
+    def merge_duplicate_songs(self, chunk_size: int = 5000) -> Dict:
+        """Merge songs sharing a fingerprint into the oldest of them
+        
+        Memberships, play history and play rollups of each duplicate are
+        moved to the surviving song in set-based SQL, then the duplicates
+        are deleted. The songs table is walked in fingerprint order about
+        chunk_size rows at a time, each window in its own short
+        transaction, so other writers get the lock between windows.
+        Returns {'groups': ..., 'merged': ...}.
+        """
+        result = {'groups': 0, 'merged': 0}
+        last = ''
+        try:
+            while True:
+                with self.transaction() as cursor:
+                    # Close the window at a fingerprint boundary so no group is split
+                    cursor.execute('''
+                        SELECT fingerprint FROM songs
+                        WHERE fingerprint > ?
+                        ORDER BY fingerprint LIMIT 1 OFFSET ?
+                    ''', (last, chunk_size - 1))
+                    row = cursor.fetchone()
+                    upper = row[0] if row else None
+                    groups, merged = self._merge_window(cursor, last, upper)
+                result['groups'] += groups
+                result['merged'] += merged
+                if upper is None:
+                    break
+                last = upper
+            if result['merged']:
+                self.refresh_top_songs()
+            logger.info("Merged %s duplicate songs in %s groups",
+                        result['merged'], result['groups'])
+        except sqlite3.Error as e:
+            logger.error("Error merging duplicate songs: %s", e)
+        return result
+    
+    def _merge_window(self, cursor, lower: str, upper: Optional[str]) -> Tuple[int, int]:
+        """Merge the duplicate groups with fingerprints in (lower, upper]"""
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS song_merge (
+                dup_id INTEGER PRIMARY KEY,
+                keep_id INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("DELETE FROM temp.song_merge")
+        bound = "AND fingerprint <= ?" if upper is not None else ""
+        cursor.execute(f'''
+            INSERT INTO temp.song_merge (dup_id, keep_id)
+            SELECT s.song_id, g.keep_id
+            FROM (SELECT fingerprint, MIN(song_id) AS keep_id FROM songs
+                  WHERE fingerprint > ? {bound}
+                  GROUP BY fingerprint HAVING COUNT(*) > 1) g
+            JOIN songs s ON s.fingerprint = g.fingerprint AND s.song_id != g.keep_id
+        ''', (lower,) if upper is None else (lower, upper))
+        merged = cursor.rowcount
+        if merged <= 0:
+            return 0, 0
+        cursor.execute("SELECT COUNT(DISTINCT keep_id) FROM temp.song_merge")
+        groups = cursor.fetchone()[0]
+        
+        cursor.execute('''
+            SELECT DISTINCT playlist_id FROM playlist_songs
+            WHERE song_id IN (SELECT dup_id FROM temp.song_merge)
+        ''')
+        playlist_ids = [row[0] for row in cursor.fetchall()]
+        
+        # Repoint memberships; where the survivor is already in the playlist
+        # the duplicate's row is skipped here and removed with the song
+        cursor.execute('''
+            UPDATE OR IGNORE playlist_songs
+            SET song_id = (SELECT keep_id FROM temp.song_merge WHERE dup_id = song_id)
+            WHERE song_id IN (SELECT dup_id FROM temp.song_merge)
+        ''')
+        cursor.execute('''
+            UPDATE recently_played
+            SET song_id = (SELECT keep_id FROM temp.song_merge WHERE dup_id = song_id)
+            WHERE song_id IN (SELECT dup_id FROM temp.song_merge)
+        ''')
+        cursor.execute('''
+            INSERT INTO song_play_stats (song_id, play_count, last_played)
+            SELECT m.keep_id, SUM(st.play_count), MAX(st.last_played)
+            FROM song_play_stats st JOIN temp.song_merge m ON m.dup_id = st.song_id
+            WHERE true
+            GROUP BY m.keep_id
+            ON CONFLICT (song_id) DO UPDATE SET
+                play_count = play_count + excluded.play_count,
+                last_played = MAX(last_played, excluded.last_played)
+        ''')
+        for table, bucket, expression in migrations.PLAY_ROLLUPS:
+            cursor.execute(f'''
+                INSERT INTO {table} (song_id, {bucket}, plays)
+                SELECT m.keep_id, r.{bucket}, SUM(r.plays)
+                FROM {table} r JOIN temp.song_merge m ON m.dup_id = r.song_id
+                WHERE true
+                GROUP BY m.keep_id, r.{bucket}
+                ON CONFLICT (song_id, {bucket}) DO UPDATE SET plays = plays + excluded.plays
+            ''')
+        
+        # Keep the surviving song linked to a file if a duplicate had one
+        cursor.execute('''
+            UPDATE songs SET file_path = (
+                SELECT d.file_path FROM temp.song_merge m JOIN songs d ON d.song_id = m.dup_id
+                WHERE m.keep_id = songs.song_id AND d.file_path != ''
+                ORDER BY m.dup_id LIMIT 1)
+            WHERE song_id IN (SELECT keep_id FROM temp.song_merge)
+              AND COALESCE(file_path, '') = ''
+              AND EXISTS (SELECT 1 FROM temp.song_merge m JOIN songs d ON d.song_id = m.dup_id
+                          WHERE m.keep_id = songs.song_id AND d.file_path != '')
+        ''')
+        cursor.execute('''
+            UPDATE library_files
+            SET song_id = (SELECT keep_id FROM temp.song_merge WHERE dup_id = song_id)
+            WHERE song_id IN (SELECT dup_id FROM temp.song_merge)
+        ''')
+        
+        # Cascades clear the duplicates' remaining rollup rows
+        cursor.execute("SELECT dup_id FROM temp.song_merge")
+        dup_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM songs WHERE song_id IN (SELECT dup_id FROM temp.song_merge)")
+        for playlist_id in playlist_ids:
+            migrations.rebuild_playlist_aggregates(cursor, playlist_id)
+        self._emit(events.SONGS_DELETED, playlist_ids, dup_ids)
+        return groups, merged
+    
     def get_all_songs(self) -> List[Dict]:
         """Retrieve all songs"""
         try:
-            self.cursor.execute("SELECT * FROM songs ORDER BY title")
-            columns = [desc[0] for desc in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            return self._fetch_all("SELECT * FROM songs ORDER BY title COLLATE NOCASE", record=Song)
         except sqlite3.Error as e:
-            print(f"Error retrieving songs: {e}")
+            logger.error("Error retrieving songs: %s", e)
             return []
     
     def get_song_by_id(self, song_id: int) -> Optional[Dict]:
         """Get a specific song by ID"""
         try:
-            self.cursor.execute("SELECT * FROM songs WHERE song_id = ?", (song_id,))
-            row = self.cursor.fetchone()
-            if row:
-                columns = [desc[0] for desc in self.cursor.description]
-                return dict(zip(columns, row))
-            return None
+            return self._fetch_one("SELECT * FROM songs WHERE song_id = ?", (song_id,), record=Song)
         except sqlite3.Error as e:
-            print(f"Error retrieving song: {e}")
+            logger.error("Error retrieving song: %s", e)
             return None
     
     def delete_song(self, song_id: int) -> bool:
         """Delete a song"""
         try:
-            self.cursor.execute("DELETE FROM songs WHERE song_id = ?", (song_id,))
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self.transaction() as cursor:
+                playlist_ids = self._song_playlists(cursor, [song_id])
+                cursor.execute("DELETE FROM songs WHERE song_id = ?", (song_id,))
+                if cursor.rowcount > 0:
+                    self._emit(events.SONGS_DELETED, playlist_ids, [song_id])
+            return cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error deleting song: {e}")
+            logger.error("Error deleting song: %s", e)
             return False
     
+    def delete_songs(self, song_ids: Iterable[int]) -> int:
+        """Delete many songs in one statement and return how many were deleted"""
+        song_ids = list(song_ids)
+        try:
+            with self.transaction() as cursor:
+                playlist_ids = self._song_playlists(cursor, song_ids)
+                cursor.execute('''
+                    DELETE FROM songs
+                    WHERE song_id IN (SELECT value FROM json_each(?))
+                ''', (json.dumps(song_ids),))
+                if cursor.rowcount > 0:
+                    self._emit(events.SONGS_DELETED, playlist_ids, song_ids)
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error("Error deleting songs: %s", e)
+            return 0
+    
+    def _song_playlists(self, cursor, song_ids: List[int]) -> List[int]:
+        """IDs of the playlists containing any of the songs"""
+        cursor.execute('''
+            SELECT DISTINCT playlist_id FROM playlist_songs
+            WHERE song_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(song_ids),))
+        return [row[0] for row in cursor.fetchall()]
+    
     # Playlist-Song Relationship Operations
     def add_song_to_playlist(self, playlist_id: int, song_id: int) -> bool:
-        """Add a song to a playlist"""
+        """Add a song to the end of a playlist"""
+        return self.insert_song_at(playlist_id, song_id)
+    
+    def insert_song_at(self, playlist_id: int, song_id: int,
+                       before_song_id: Optional[int] = None) -> bool:
+        """Add a song to a playlist ahead of before_song_id (or at the end)"""
         try:
-            # Get the next position
-            self.cursor.execute('''
-                SELECT COALESCE(MAX(position), 0) + 1 
-                FROM playlist_songs 
-                WHERE playlist_id = ?
-            ''', (playlist_id,))
-            position = self.cursor.fetchone()[0]
-            
-            self.cursor.execute('''
-                INSERT INTO playlist_songs (playlist_id, song_id, position)
-                VALUES (?, ?, ?)
-            ''', (playlist_id, song_id, position))
-            self.conn.commit()
-            
-            # Update playlist modified date
-            self.cursor.execute('''
-                UPDATE playlists SET modified_date = CURRENT_TIMESTAMP 
-                WHERE playlist_id = ?
-            ''', (playlist_id,))
-            self.conn.commit()
+            with self.transaction() as cursor:
+                if self._reject_smart(cursor, [playlist_id]):
+                    return False
+                position = self._free_position(cursor, playlist_id, before_song_id, song_id)
+                if position is None:
+                    logger.warning("Song %s is not in playlist %s", before_song_id, playlist_id)
+                    return False
+                
+                cursor.execute('''
+                    INSERT INTO playlist_songs (playlist_id, song_id, position)
+                    VALUES (?, ?, ?)
+                ''', (playlist_id, song_id, position))
+                
+                # Update playlist modified date
+                cursor.execute('''
+                    UPDATE playlists SET modified_date = CURRENT_TIMESTAMP
+                    WHERE playlist_id = ?
+                ''', (playlist_id,))
+                self._emit(events.SONGS_ADDED, [playlist_id], [song_id])
             return True
         except sqlite3.IntegrityError:
-            print("Song already in playlist")
+            logger.warning("Song already in playlist")
+            return False
+        except sqlite3.Error as e:
+            logger.error("Error adding song to playlist: %s", e)
+            return False
+    
+    def move_song(self, playlist_id: int, song_id: int,
+                  before_song_id: Optional[int] = None) -> bool:
+        """Move a song ahead of before_song_id (or to the end) of its playlist
+        
+        Only the moved row is updated; the rest of the playlist keeps its
+        positions.
+        """
+        if song_id == before_song_id:
+            return True
+        try:
+            with self.transaction() as cursor:
+                if self._reject_smart(cursor, [playlist_id]):
+                    return False
+                position = self._free_position(cursor, playlist_id, before_song_id, song_id)
+                if position is None:
+                    logger.warning("Song %s is not in playlist %s", before_song_id, playlist_id)
+                    return False
+                
+                cursor.execute('''
+                    UPDATE playlist_songs SET position = ?
+                    WHERE playlist_id = ? AND song_id = ?
+                ''', (position, playlist_id, song_id))
+                if cursor.rowcount == 0:
+                    logger.warning("Song %s is not in playlist %s", song_id, playlist_id)
+                    raise Rollback()
+                
+                cursor.execute('''
+                    UPDATE playlists SET modified_date = CURRENT_TIMESTAMP
+                    WHERE playlist_id = ?
+                ''', (playlist_id,))
+                self._emit(events.SONG_MOVED, [playlist_id], [song_id])
+                return True
             return False
         except sqlite3.Error as e:
-            print(f"Error adding song to playlist: {e}")
+            logger.error("Error moving song in playlist: %s", e)
             return False
     
+    def _free_position(self, cursor, playlist_id: int, before_song_id: Optional[int],
+                       song_id: int) -> Optional[int]:
+        """Pick an unused position key just ahead of before_song_id
+        
+        With no before_song_id the key goes after the last song. The key is
+        the midpoint of the gap between before_song_id and its predecessor
+        (ignoring song_id itself, which may be the song being moved). A gap
+        with no room left is respaced on the spot; a narrow one is queued
+        for the background rebalancer. Returns None when before_song_id is
+        not in the playlist.
+        """
+        if before_song_id is None:
+            cursor.execute('''
+                SELECT COALESCE(MAX(position), 0) + ?
+                FROM playlist_songs
+                WHERE playlist_id = ? AND song_id != ?
+            ''', (migrations.POSITION_GAP, playlist_id, song_id))
+            return cursor.fetchone()[0]
+        
+        for attempt in range(2):
+            cursor.execute('''
+                SELECT position FROM playlist_songs
+                WHERE playlist_id = ? AND song_id = ?
+            ''', (playlist_id, before_song_id))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            upper = row[0]
+            cursor.execute('''
+                SELECT COALESCE(MAX(position), ? - 2 * ?)
+                FROM playlist_songs
+                WHERE playlist_id = ? AND position < ? AND song_id != ?
+            ''', (upper, migrations.POSITION_GAP, playlist_id, upper, song_id))
+            lower = cursor.fetchone()[0]
+            
+            room = (upper - lower) // 2
+            if room >= 1:
+                if room < self.REBALANCE_THRESHOLD:
+                    self.rebalancer.schedule(playlist_id)
+                return lower + room
+            migrations.respace_playlist_positions(cursor, playlist_id)
+        raise sqlite3.IntegrityError(f"No free position in playlist {playlist_id}")
+    
+    def rebalance_playlist(self, playlist_id: Optional[int] = None) -> bool:
+        """Respace position keys of one or all playlists POSITION_GAP apart
+        
+        Runs automatically in the background once moves crowd a playlist;
+        call it directly to compact playlists after many removals.
+        """
+        try:
+            with self.transaction() as cursor:
+                if playlist_id is None:
+                    cursor.execute("SELECT DISTINCT playlist_id FROM playlist_songs")
+                    playlist_ids = [row[0] for row in cursor.fetchall()]
+                else:
+                    playlist_ids = [playlist_id]
+                migrations.respace_playlist_positions(cursor, playlist_id)
+                self._emit(events.POSITIONS_RESPACED, playlist_ids)
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error rebalancing playlist positions: %s", e)
+            return False
+    
+    def add_songs_to_playlist_bulk(self, memberships: Iterable[Tuple[int, int]],
+                                   chunk_size: int = 500) -> Dict:
+        """Add many (playlist_id, song_id) pairs in a single transaction
+        
+        Songs are appended to the end of their playlist in input order.
+        Returns {'ids': [...], 'conflicts': [...]} like create_songs_bulk,
+        where ids are the new playlist_songs row IDs.
+        """
+        sql = '''
+            INSERT INTO playlist_songs (playlist_id, song_id, position)
+            VALUES (?, ?, ?)
+        '''
+        memberships = list(memberships)
+        result = {'ids': [], 'conflicts': []}
+        next_positions = {}
+        added = []
+        try:
+            with self.transaction() as cursor:
+                if self._reject_smart(cursor, {playlist_id for playlist_id, song_id in memberships}):
+                    result['ids'] = [None] * len(memberships)
+                    return result
+                offset = 0
+                for chunk in self._chunked(memberships, chunk_size):
+                    params = []
+                    for playlist_id, song_id in chunk:
+                        if playlist_id not in next_positions:
+                            cursor.execute('''
+                                SELECT COALESCE(MAX(position), 0) + ?
+                                FROM playlist_songs
+                                WHERE playlist_id = ?
+                            ''', (migrations.POSITION_GAP, playlist_id))
+                            next_positions[playlist_id] = cursor.fetchone()[0]
+                        params.append((playlist_id, song_id, next_positions[playlist_id]))
+                        next_positions[playlist_id] += migrations.POSITION_GAP
+                    self._insert_chunk(sql, params, offset, result)
+                    added.extend(song_id for (playlist_id, song_id), row_id
+                                 in zip(chunk, result['ids'][offset:]) if row_id)
+                    offset += len(chunk)
+                
+                # Update modified date once per touched playlist
+                cursor.executemany('''
+                    UPDATE playlists SET modified_date = CURRENT_TIMESTAMP
+                    WHERE playlist_id = ?
+                ''', [(playlist_id,) for playlist_id in next_positions])
+                if added:
+                    self._emit(events.SONGS_ADDED, next_positions, added)
+        except sqlite3.Error as e:
+            logger.error("Error adding songs to playlists in bulk: %s", e)
+            result['ids'] = [None] * len(result['ids'])
+        return result
+    
     def remove_song_from_playlist(self, playlist_id: int, song_id: int) -> bool:
         """Remove a song from a playlist"""
         try:
-            self.cursor.execute('''
-                DELETE FROM playlist_songs 
-                WHERE playlist_id = ? AND song_id = ?
-            ''', (playlist_id, song_id))
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self.transaction() as cursor:
+                if self._reject_smart(cursor, [playlist_id]):
+                    return False
+                cursor.execute('''
+                    DELETE FROM playlist_songs
+                    WHERE playlist_id = ? AND song_id = ?
+                ''', (playlist_id, song_id))
+                if cursor.rowcount > 0:
+                    self._emit(events.SONGS_REMOVED, [playlist_id], [song_id])
+            return cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error removing song from playlist: {e}")
+            logger.error("Error removing song from playlist: %s", e)
             return False
     
+    def add_songs_to_playlist(self, playlist_id: int, song_ids: Iterable[int]) -> int:
+        """Append many songs to a playlist in one statement
+        
+        Songs keep their order in song_ids; unknown songs, repeats and
+        songs already in the playlist are skipped. Returns how many were
+        added.
+        """
+        song_ids = list(song_ids)
+        try:
+            with self.transaction() as cursor:
+                if self._reject_smart(cursor, [playlist_id]):
+                    return 0
+                cursor.execute('''
+                    INSERT INTO playlist_songs (playlist_id, song_id, position)
+                    SELECT ?, r.song_id,
+                           (SELECT COALESCE(MAX(position), 0) FROM playlist_songs
+                            WHERE playlist_id = ?)
+                           + ROW_NUMBER() OVER (ORDER BY r.ordinal) * ?
+                    FROM (SELECT value AS song_id, MIN(key) AS ordinal
+                          FROM json_each(?) GROUP BY value) r
+                    JOIN songs s ON s.song_id = r.song_id
+                    WHERE NOT EXISTS (SELECT 1 FROM playlist_songs ps
+                                      WHERE ps.playlist_id = ? AND ps.song_id = r.song_id)
+                ''', (playlist_id, playlist_id, migrations.POSITION_GAP,
+                      json.dumps(song_ids), playlist_id))
+                added = cursor.rowcount
+                if added:
+                    cursor.execute('''
+                        UPDATE playlists SET modified_date = CURRENT_TIMESTAMP
+                        WHERE playlist_id = ?
+                    ''', (playlist_id,))
+                    # Names every song asked for; skipped ones were already there
+                    self._emit(events.SONGS_ADDED, [playlist_id], song_ids)
+            return added
+        except sqlite3.Error as e:
+            logger.error("Error adding songs to playlist: %s", e)
+            return 0
+    
+    def remove_songs_from_playlist(self, playlist_id: int, song_ids: Iterable[int]) -> int:
+        """Remove many songs from a playlist in one statement and return how many were removed"""
+        song_ids = list(song_ids)
+        try:
+            with self.transaction() as cursor:
+                if self._reject_smart(cursor, [playlist_id]):
+                    return 0
+                cursor.execute('''
+                    DELETE FROM playlist_songs
+                    WHERE playlist_id = ?
+                      AND song_id IN (SELECT value FROM json_each(?))
+                ''', (playlist_id, json.dumps(song_ids)))
+                if cursor.rowcount > 0:
+                    self._emit(events.SONGS_REMOVED, [playlist_id], song_ids)
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error("Error removing songs from playlist: %s", e)
+            return 0
+    
     def get_playlist_songs(self, playlist_id: int) -> List[Dict]:
         """Get all songs in a playlist"""
         try:
-            self.cursor.execute('''
+            return self._fetch_all('''
                 SELECT s.*, ps.position, ps.added_date
                 FROM songs s
                 JOIN playlist_songs ps ON s.song_id = ps.song_id
                 WHERE ps.playlist_id = ?
                 ORDER BY ps.position
-            ''', (playlist_id,))
-            
-            columns = [desc[0] for desc in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            ''', (playlist_id,), record=Song)
+        except sqlite3.Error as e:
+            logger.error("Error retrieving playlist songs: %s", e)
+            return []
+    
+    def get_song_playlist_ids(self, song_id: int) -> List[int]:
+        """Get the IDs of the playlists containing a song"""
+        try:
+            rows = self._fetch_all('''
+                SELECT playlist_id FROM playlist_songs WHERE song_id = ?
+            ''', (song_id,))
+            return [row['playlist_id'] for row in rows]
         except sqlite3.Error as e:
-            print(f"Error retrieving playlist songs: {e}")
+            logger.error("Error retrieving song playlists: %s", e)
             return []
     
+    # Smart Playlists
+    # A smart playlist's songs are materialized in playlist_songs and kept
+    # current from the change events of each transaction, so reading one
+    # costs the same as reading a hand-curated playlist.
+    def create_smart_playlist(self, name: str, rules, description: str = "",
+                              icon_color: str = "#8B5CF6") -> Optional[int]:
+        """Create a playlist whose songs are whichever match rules
+        
+        rules is a rules document or its JSON text (see smart.py); invalid
+        rules raise ValueError.
+        """
+        rules = smart.parse_rules(rules)
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO playlists (name, description, icon_color, rules)
+                    VALUES (?, ?, ?, ?)
+                ''', (name, description, icon_color, json.dumps(rules)))
+                playlist_id = cursor.lastrowid
+                self._emit(events.PLAYLIST_CREATED, [playlist_id])
+                self._match_smart_playlist(cursor, playlist_id, rules)
+            return playlist_id
+        except sqlite3.IntegrityError:
+            logger.warning("Playlist '%s' already exists", name)
+            return None
+        except sqlite3.Error as e:
+            logger.error("Error creating smart playlist: %s", e)
+            return None
+    
+    def get_playlist_rules(self, playlist_id: int) -> Optional[Dict]:
+        """Return a smart playlist's rules, or None for a hand-curated playlist"""
+        try:
+            row = self._fetch_one("SELECT rules FROM playlists WHERE playlist_id = ?",
+                                  (playlist_id,))
+            return json.loads(row['rules']) if row and row['rules'] else None
+        except sqlite3.Error as e:
+            logger.error("Error retrieving playlist rules: %s", e)
+            return None
+    
+    def set_playlist_rules(self, playlist_id: int, rules) -> bool:
+        """Replace a playlist's rules and re-match its songs against them
+        
+        Works on any playlist: giving a hand-curated playlist rules makes it
+        smart, and rules=None makes a smart playlist hand-curated again,
+        keeping the songs it has.
+        """
+        if rules is not None:
+            rules = smart.parse_rules(rules)
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    UPDATE playlists SET rules = ?, modified_date = CURRENT_TIMESTAMP
+                    WHERE playlist_id = ?
+                ''', (json.dumps(rules) if rules else None, playlist_id))
+                if cursor.rowcount == 0:
+                    return False
+                self._emit(events.PLAYLIST_UPDATED, [playlist_id])
+                if rules:
+                    self._match_smart_playlist(cursor, playlist_id, rules)
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error setting playlist rules: %s", e)
+            return False
+    
+    def refresh_smart_playlists(self, playlist_id: Optional[int] = None,
+                                time_rules_only: bool = False) -> bool:
+        """Re-match one or all smart playlists against the whole library
+        
+        Song and play changes are applied as they commit. This catches
+        songs that drift out of an 'added' or 'played' window as time
+        passes, so run it now and then with time_rules_only, e.g. at
+        startup, to re-match just the playlists such windows can change.
+        """
+        try:
+            with self.transaction() as cursor:
+                for smart_id, rules in self._smart_playlists(cursor, playlist_id):
+                    if time_rules_only and not smart.uses_time(rules):
+                        continue
+                    self._match_smart_playlist(cursor, smart_id, rules)
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error refreshing smart playlists: %s", e)
+            return False
+    
+    def _smart_playlists(self, cursor, playlist_id: Optional[int] = None) -> List[Tuple[int, Dict]]:
+        """(playlist_id, rules) of every smart playlist, or of just one"""
+        where = "AND playlist_id = ?" if playlist_id is not None else ""
+        cursor.execute(f'''
+            SELECT playlist_id, rules FROM playlists WHERE rules IS NOT NULL {where}
+        ''', () if playlist_id is None else (playlist_id,))
+        return [(row[0], json.loads(row[1])) for row in cursor.fetchall()]
+    
+    def _reject_smart(self, cursor, playlist_ids: Iterable[int]) -> bool:
+        """Log and return True if any of the playlists is smart
+        
+        A smart playlist's songs follow its rules, so adding, removing and
+        moving them by hand is refused.
+        """
+        cursor.execute('''
+            SELECT playlist_id FROM playlists
+            WHERE rules IS NOT NULL AND playlist_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(playlist_ids)),))
+        row = cursor.fetchone()
+        if row:
+            logger.warning("Playlist %s is a smart playlist; its songs follow its rules", row[0])
+        return row is not None
+    
+    def _match_smart_playlist(self, cursor, playlist_id: int, rules: Dict,
+                              song_ids: Optional[List[int]] = None):
+        """Bring a smart playlist's songs in line with its rules
+        
+        Only song_ids are re-checked when given, otherwise the whole
+        library. Songs that stopped matching are removed and new matches
+        are appended in title order.
+        """
+        condition, params = smart.compile_rules(rules)
+        scope = member_scope = ""
+        scope_params = []
+        if song_ids is not None:
+            scope = "AND s.song_id IN (SELECT value FROM json_each(?))"
+            member_scope = "AND ps.song_id IN (SELECT value FROM json_each(?))"
+            scope_params = [json.dumps(song_ids)]
+        matching = f'''
+            SELECT s.song_id FROM songs s
+            LEFT JOIN song_play_stats st ON st.song_id = s.song_id
+            WHERE ({condition}) {scope}
+        '''
+        
+        cursor.execute(f'''
+            SELECT ps.song_id FROM playlist_songs ps
+            WHERE ps.playlist_id = ? {member_scope}
+              AND ps.song_id NOT IN ({matching})
+        ''', [playlist_id] + scope_params + params + scope_params)
+        removed = [row[0] for row in cursor.fetchall()]
+        if removed:
+            cursor.execute('''
+                DELETE FROM playlist_songs
+                WHERE playlist_id = ? AND song_id IN (SELECT value FROM json_each(?))
+            ''', (playlist_id, json.dumps(removed)))
+            self._emit(events.SONGS_REMOVED, [playlist_id], removed)
+        
+        cursor.execute(f'''
+            {matching}
+              AND NOT EXISTS (SELECT 1 FROM playlist_songs ps
+                              WHERE ps.playlist_id = ? AND ps.song_id = s.song_id)
+            ORDER BY s.title COLLATE NOCASE, s.song_id
+        ''', params + scope_params + [playlist_id])
+        added = [row[0] for row in cursor.fetchall()]
+        if added:
+            cursor.execute('''
+                SELECT COALESCE(MAX(position), 0) FROM playlist_songs WHERE playlist_id = ?
+            ''', (playlist_id,))
+            last = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO playlist_songs (playlist_id, song_id, position) VALUES (?, ?, ?)
+            ''', [(playlist_id, song_id, last + (i + 1) * migrations.POSITION_GAP)
+                  for i, song_id in enumerate(added)])
+            self._emit(events.SONGS_ADDED, [playlist_id], added)
+        
+        if removed or added:
+            cursor.execute('''
+                UPDATE playlists SET modified_date = CURRENT_TIMESTAMP
+                WHERE playlist_id = ?
+            ''', (playlist_id,))
+    
+    def _update_smart_playlists(self, cursor):
+        """Re-match smart playlists against the songs this transaction touched
+        
+        New and updated songs are checked against every smart playlist;
+        songs that were played only against playlists with play rules.
+        """
+        changed, played = {}, {}
+        for event in self._pending_events:
+            if event.kind in (events.SONGS_CREATED, events.SONGS_UPDATED):
+                changed.update(dict.fromkeys(event.song_ids))
+            elif event.kind == events.PLAY_RECORDED:
+                played.update(dict.fromkeys(event.song_ids))
+        if not changed and not played:
+            return
+        for playlist_id, rules in self._smart_playlists(cursor):
+            song_ids = {**changed, **played} if smart.uses_plays(rules) else changed
+            if song_ids:
+                self._match_smart_playlist(cursor, playlist_id, rules, list(song_ids))
+    
     # Recently Played Operations
     def add_to_recently_played(self, song_id: int) -> bool:
         """Add a song to recently played"""
         try:
-            self.cursor.execute('''
-                INSERT INTO recently_played (song_id)
-                VALUES (?)
-            ''', (song_id,))
-            self.conn.commit()
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO recently_played (song_id)
+                    VALUES (?)
+                ''', (song_id,))
+                self._emit(events.PLAY_RECORDED, song_ids=[song_id])
             return True
         except sqlite3.Error as e:
-            print(f"Error adding to recently played: {e}")
+            logger.error("Error adding to recently played: %s", e)
             return False
     
     def get_recently_played(self, limit: int = 10) -> List[Dict]:
-        """Get recently played songs"""
+        """Get the most recently played distinct songs with their play counts"""
         try:
-            self.cursor.execute('''
-                SELECT s.*, rp.played_date
-                FROM songs s
-                JOIN recently_played rp ON s.song_id = rp.song_id
-                ORDER BY rp.played_date DESC
+            return self._fetch_all('''
+                SELECT s.*, st.last_played AS played_date, st.play_count
+                FROM song_play_stats st
+                JOIN songs s ON s.song_id = st.song_id
+                ORDER BY st.last_played DESC
                 LIMIT ?
-            ''', (limit,))
+            ''', (limit,), record=Song)
+        except sqlite3.Error as e:
+            logger.error("Error retrieving recently played: %s", e)
+            return []
+    
+    def get_top_songs(self, period: str = 'week', limit: int = 10) -> List[Dict]:
+        """Get the most played songs of a period from the precomputed ranking
+        
+        The ranking is refreshed by refresh_top_songs() (and on every
+        compact_play_history()); play_count is the number of plays within
+        the period.
+        """
+        if period not in self.PLAY_PERIODS:
+            raise ValueError(f"Unknown play period: {period}")
+        try:
+            return self._fetch_all('''
+                SELECT s.*, t.plays AS play_count
+                FROM top_played t
+                JOIN songs s ON s.song_id = t.song_id
+                WHERE t.period = ?
+                ORDER BY t.rank
+                LIMIT ?
+            ''', (period, limit), record=Song)
+        except sqlite3.Error as e:
+            logger.error("Error retrieving top songs: %s", e)
+            return []
+    
+    def refresh_top_songs(self, top_n: int = 100) -> bool:
+        """Recompute the top_n most played songs of every period"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("DELETE FROM top_played")
+                for period, (table, bucket, since) in self.PLAY_PERIODS.items():
+                    if table is None:
+                        source = "SELECT song_id, play_count AS plays FROM song_play_stats"
+                    else:
+                        # Buckets use the text format of SQLite's datetime()
+                        # and date(), so they compare correctly as strings
+                        source = f'''
+                            SELECT song_id, SUM(plays) AS plays FROM {table}
+                            WHERE {bucket} >= {since}
+                            GROUP BY song_id
+                        '''
+                    cursor.execute(f'''
+                        INSERT INTO top_played (period, rank, song_id, plays)
+                        SELECT ?, ROW_NUMBER() OVER (ORDER BY plays DESC, song_id), song_id, plays
+                        FROM ({source})
+                        ORDER BY plays DESC, song_id
+                        LIMIT ?
+                    ''', (period, top_n))
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error refreshing top songs: %s", e)
+            return False
+    
+    def compact_play_history(self, raw_days: Optional[int] = None,
+                             hourly_days: Optional[int] = None) -> bool:
+        """Apply the play history retention policy
+        
+        Raw play events older than raw_days and hourly counts older than
+        hourly_days are deleted; every play is already counted in the
+        per-song totals and daily counts, which are kept. The top-song
+        rankings are refreshed afterwards.
+        """
+        raw_days = self.RAW_PLAY_RETENTION_DAYS if raw_days is None else raw_days
+        hourly_days = self.HOURLY_PLAY_RETENTION_DAYS if hourly_days is None else hourly_days
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    DELETE FROM recently_played WHERE played_date < datetime('now', ?)
+                ''', (f"-{raw_days} days",))
+                raw_removed = cursor.rowcount
+                cursor.execute('''
+                    DELETE FROM play_counts_hourly WHERE hour < datetime('now', ?)
+                ''', (f"-{hourly_days} days",))
+                hourly_removed = cursor.rowcount
+                self.refresh_top_songs()
+            logger.info("Compacted play history: %s raw plays and %s hourly counts removed",
+                        raw_removed, hourly_removed)
+            return True
+        except sqlite3.Error as e:
+            logger.error("Error compacting play history: %s", e)
+            return False
+    
+    # Paged Listings
+    # Keyset pagination: each page seeks past the last key of the previous
+    # one through an index, so page N costs the same as page 1 and nothing
+    # beyond the current page is held in memory.
+    SONG_ORDERS = {
+        'title': ('title', 'title COLLATE NOCASE'),
+        'artist': ('artist', 'artist COLLATE NOCASE'),
+        'duration': ('duration_ms', 'duration_ms'),
+        'song_id': (None, None)
+    }
+    
+    def count_songs(self) -> int:
+        """Return the number of songs in the library"""
+        try:
+            return self._fetch_one("SELECT COUNT(*) AS total FROM songs")['total']
+        except sqlite3.Error as e:
+            logger.error("Error counting songs: %s", e)
+            return 0
+    
+    def get_songs_page(self, order_by: str = 'title', after_key: Optional[Tuple] = None,
+                       page_size: int = 500) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get one page of songs
+        
+        Pass the key returned with the previous page as after_key (None for
+        the first page). Returns (songs, next_key); next_key is None once
+        the last page has been read.
+        """
+        if order_by not in self.SONG_ORDERS:
+            raise ValueError(f"Unknown song order: {order_by}")
+        column, expr = self.SONG_ORDERS[order_by]
+        try:
+            if column is None:
+                where, order = "song_id > ?", "song_id"
+                params = (after_key[0],) if after_key else ()
+            elif after_key and after_key[0] is None:
+                # NULLs sort first; finish them before seeking into real values
+                where = f"({expr} IS NULL AND song_id > ?) OR {expr} IS NOT NULL"
+                order = f"{expr}, song_id"
+                params = (after_key[1],)
+            else:
+                where = f"{expr} >= ? AND ({expr} > ? OR song_id > ?)"
+                order = f"{expr}, song_id"
+                params = (after_key[0], after_key[0], after_key[1]) if after_key else ()
+            where = f"WHERE {where}" if after_key else ""
             
-            columns = [desc[0] for desc in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            songs = self._fetch_all(f'''
+                SELECT * FROM songs {where}
+                ORDER BY {order}
+                LIMIT ?
+            ''', params + (page_size,), record=Song)
+            next_key = None
+            if len(songs) == page_size:
+                last = songs[-1]
+                song_id = songs.value(last, 'song_id')
+                next_key = (song_id,) if column is None else (songs.value(last, column), song_id)
+            return songs, next_key
         except sqlite3.Error as e:
-            print(f"Error retrieving recently played: {e}")
+            logger.error("Error retrieving songs page: %s", e)
+            return [], None
+    
+    def get_songs_by_duration(self, min_ms: Optional[int] = None, max_ms: Optional[int] = None,
+                              limit: int = 500) -> List[Dict]:
+        """Get songs whose length lies within [min_ms, max_ms], shortest first"""
+        conditions = ["duration_ms >= ?"]
+        params = [min_ms or 0]
+        if max_ms is not None:
+            conditions.append("duration_ms <= ?")
+            params.append(max_ms)
+        params.append(limit)
+        try:
+            return self._fetch_all(f'''
+                SELECT * FROM songs
+                WHERE {" AND ".join(conditions)}
+                ORDER BY duration_ms, song_id
+                LIMIT ?
+            ''', tuple(params), record=Song)
+        except sqlite3.Error as e:
+            logger.error("Error retrieving songs by duration: %s", e)
             return []
     
+    def iter_songs(self, order_by: str = 'title', after_key: Optional[Tuple] = None,
+                   page_size: int = 500):
+        """Stream songs page by page in the given order"""
+        while True:
+            songs, after_key = self.get_songs_page(order_by, after_key, page_size)
+            yield from songs
+            if after_key is None:
+                return
+    
+    def get_playlist_songs_page(self, playlist_id: int, after_key: Optional[Tuple] = None,
+                                page_size: int = 500) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get one page of a playlist's songs in playlist order
+        
+        Works like get_songs_page; keys are (position, song_id).
+        """
+        try:
+            where = "AND (ps.position, ps.song_id) > (?, ?)" if after_key else ""
+            songs = self._fetch_all(f'''
+                SELECT s.*, ps.position, ps.added_date
+                FROM playlist_songs ps
+                JOIN songs s ON s.song_id = ps.song_id
+                WHERE ps.playlist_id = ? {where}
+                ORDER BY ps.position, ps.song_id
+                LIMIT ?
+            ''', (playlist_id,) + tuple(after_key or ()) + (page_size,), record=Song)
+            next_key = None
+            if len(songs) == page_size:
+                next_key = (songs.value(songs[-1], 'position'), songs.value(songs[-1], 'song_id'))
+            return songs, next_key
+        except sqlite3.Error as e:
+            logger.error("Error retrieving playlist songs page: %s", e)
+            return [], None
+    
+    def iter_playlist_songs(self, playlist_id: int, page_size: int = 500):
+        """Stream a playlist's songs page by page"""
+        after_key = None
+        while True:
+            songs, after_key = self.get_playlist_songs_page(playlist_id, after_key, page_size)
+            yield from songs
+            if after_key is None:
+                return
+    
+    def get_playlists_page(self, after_key: Optional[Tuple] = None,
+                           page_size: int = 100) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get one page of playlists, most recently modified first
+        
+        Works like get_songs_page; keys are (modified_date, playlist_id).
+        """
+        try:
+            where = "WHERE (modified_date, playlist_id) < (?, ?)" if after_key else ""
+            playlists = self._fetch_all(f'''
+                SELECT * FROM playlists {where}
+                ORDER BY modified_date DESC, playlist_id DESC
+                LIMIT ?
+            ''', tuple(after_key or ()) + (page_size,), record=Playlist)
+            next_key = None
+            if len(playlists) == page_size:
+                last = playlists[-1]
+                next_key = (playlists.value(last, 'modified_date'), playlists.value(last, 'playlist_id'))
+            return playlists, next_key
+        except sqlite3.Error as e:
+            logger.error("Error retrieving playlists page: %s", e)
+            return [], None
+    
+    def iter_playlists(self, page_size: int = 100):
+        """Stream playlists page by page, most recently modified first"""
+        after_key = None
+        while True:
+            playlists, after_key = self.get_playlists_page(after_key, page_size)
+            yield from playlists
+            if after_key is None:
+                return
+    
     # Search Operations
-    def search_songs(self, query: str) -> List[Dict]:
-        """Search songs by title or artist"""
+    def search_songs(self, query: str, limit: Optional[int] = None) -> List[Dict]:
+        """Search songs by title or artist
+        
+        Every word is matched as a prefix and results are ranked by bm25
+        relevance (title hits weigh more than artist hits).
+        """
         try:
+            match = self._match_expression(query) if self.fts_enabled else ""
+            if match:
+                return self._fetch_all('''
+                    SELECT s.* FROM songs_fts
+                    JOIN songs s ON s.song_id = songs_fts.rowid
+                    WHERE songs_fts MATCH ?
+                    ORDER BY bm25(songs_fts, 10.0, 5.0), s.title
+                    LIMIT ?
+                ''', (match, -1 if limit is None else limit), record=Song)
+            
             search_pattern = f"%{query}%"
-            self.cursor.execute('''
+            return self._fetch_all('''
                 SELECT * FROM songs
                 WHERE title LIKE ? OR artist LIKE ?
-                ORDER BY title
-            ''', (search_pattern, search_pattern))
-            
-            columns = [desc[0] for desc in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+                ORDER BY title COLLATE NOCASE
+                LIMIT ?
+            ''', (search_pattern, search_pattern, -1 if limit is None else limit), record=Song)
         except sqlite3.Error as e:
-            print(f"Error searching songs: {e}")
+            logger.error("Error searching songs: %s", e)
             return []
     
     def search_playlists(self, query: str) -> List[Dict]:
-        """Search playlists by name"""
+        """Search playlists by name or description, best matches first"""
         try:
-            search_pattern = f"%{query}%"
-            self.cursor.execute('''
-                SELECT p.*, COUNT(ps.song_id) as song_count
-                FROM playlists p
-                LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
-                WHERE p.name LIKE ?
-                GROUP BY p.playlist_id
-                ORDER BY p.name
-            ''', (search_pattern,))
+            match = self._match_expression(query) if self.fts_enabled else ""
+            if match:
+                return self._fetch_all('''
+                    SELECT p.* FROM playlists_fts
+                    JOIN playlists p ON p.playlist_id = playlists_fts.rowid
+                    WHERE playlists_fts MATCH ?
+                    ORDER BY bm25(playlists_fts, 10.0, 1.0), p.name
+                ''', (match,), record=Playlist)
             
-            columns = [desc[0] for desc in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            search_pattern = f"%{query}%"
+            return self._fetch_all('''
+                SELECT * FROM playlists
+                WHERE name LIKE ? OR description LIKE ?
+                ORDER BY name
+            ''', (search_pattern, search_pattern), record=Playlist)
         except sqlite3.Error as e:
-            print(f"Error searching playlists: {e}")
+            logger.error("Error searching playlists: %s", e)
             return []
     
+    # Media library
+    def get_library_files(self, root: str) -> Dict[str, Tuple[int, int]]:
+        """Return {path: (size, mtime_ns)} for every manifest entry under root"""
+        prefix = root.rstrip('/\\') + os.sep
+        try:
+            with self._read() as conn:
+                # A range on the primary key instead of LIKE, which cannot use it
+                rows = self._cursor(conn).execute('''
+                    SELECT path, size, mtime_ns FROM library_files
+                    WHERE path >= ? AND path < ?
+                ''', (prefix, prefix[:-1] + chr(ord(os.sep) + 1))).fetchall()
+            return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+        except sqlite3.Error as e:
+            logger.error("Error reading library manifest: %s", e)
+            return {}
+    
+    def apply_library_scan(self, files: List[Dict]) -> Dict:
+        """Create or update the songs for scanned files and record them in the manifest
+        
+        Each file is a dict with path, size, mtime_ns, title, artist and
+        duration. Files already in the manifest, or already imported as a
+        song's file_path, update their song in place; new files, and
+        changed files whose song was deleted, are added through
+        create_songs_bulk. Returns
+        {'added': n, 'updated': n}.
+        """
+        result = {'added': 0, 'updated': 0}
+        if not files:
+            return result
+        try:
+            with self.transaction() as cursor:
+                known = {}
+                for chunk in self._chunked([f['path'] for f in files], 500):
+                    cursor.execute(f'''
+                        SELECT path, song_id FROM library_files
+                        WHERE path IN ({', '.join('?' * len(chunk))})
+                    ''', chunk)
+                    known.update(cursor.fetchall())
+                
+                # A file dropped from the manifest (say while its drive was
+                # unmounted) takes back the song already imported from it
+                unknown = [f['path'] for f in files if known.get(f['path']) is None]
+                for chunk in self._chunked(unknown, 500):
+                    cursor.execute(f'''
+                        SELECT file_path, MIN(song_id) FROM songs
+                        WHERE file_path IN ({', '.join('?' * len(chunk))})
+                        GROUP BY file_path
+                    ''', chunk)
+                    known.update(cursor.fetchall())
+                
+                changed = [f for f in files if known.get(f['path']) is not None]
+                cursor.executemany('''
+                    UPDATE songs SET title = ?, artist = ?, duration = ?,
+                                     duration_ms = ?, fingerprint = ?
+                    WHERE song_id = ?
+                ''', [(f['title'], f['artist'], f['duration'],
+                       migrations.parse_duration(f['duration']),
+                       migrations.song_fingerprint(f['title'], f['artist']),
+                       known[f['path']]) for f in changed])
+                result['updated'] = len(changed)
+                if changed:
+                    self._emit(events.SONGS_UPDATED, song_ids=[known[f['path']] for f in changed])
+                
+                # Includes files whose song was deleted (song_id NULL): the
+                # scanner only passes those on once they have changed
+                new = [f for f in files if known.get(f['path']) is None]
+                created = self.create_songs_bulk(
+                    [(f['title'], f['artist'], f['duration'], f['path']) for f in new])
+                for f, song_id in zip(new, created['ids']):
+                    known[f['path']] = song_id
+                result['added'] = sum(1 for song_id in created['ids'] if song_id)
+                
+                cursor.executemany('''
+                    INSERT INTO library_files (path, size, mtime_ns, song_id)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET
+                        size = excluded.size,
+                        mtime_ns = excluded.mtime_ns,
+                        scanned_date = CURRENT_TIMESTAMP
+                ''', [(f['path'], f['size'], f['mtime_ns'], known[f['path']]) for f in files])
+        except sqlite3.Error as e:
+            logger.error("Error applying library scan: %s", e)
+            return {'added': 0, 'updated': 0}
+        return result
+    
+    def remove_library_files(self, paths: Iterable[str], delete_songs: bool = False) -> int:
+        """Forget files that disappeared from disk, optionally deleting their songs
+        
+        Songs are kept by default so playlists and play history survive a
+        drive that is not mounted. Returns the number of files removed.
+        """
+        removed = 0
+        try:
+            with self.transaction() as cursor:
+                for chunk in self._chunked(paths, 500):
+                    placeholders = ', '.join('?' * len(chunk))
+                    if delete_songs:
+                        cursor.execute(f'''
+                            SELECT song_id FROM library_files
+                            WHERE path IN ({placeholders}) AND song_id IS NOT NULL
+                        ''', chunk)
+                        song_ids = [row[0] for row in cursor.fetchall()]
+                        playlist_ids = self._song_playlists(cursor, song_ids)
+                        cursor.execute('''
+                            DELETE FROM songs WHERE song_id IN (SELECT value FROM json_each(?))
+                        ''', (json.dumps(song_ids),))
+                        if cursor.rowcount > 0:
+                            self._emit(events.SONGS_DELETED, playlist_ids, song_ids)
+                    cursor.execute(f"DELETE FROM library_files WHERE path IN ({placeholders})",
+                                   chunk)
+                    removed += cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error("Error removing library files: %s", e)
+            return 0
+        return removed
+    
+    # Backup
+    def backup(self, path: str, pages: int = 1024, progress: Optional[Callable] = None,
+               throttle: float = 0.0) -> bool:
+        """Copy the database to path with SQLite's online backup API
+        
+        Copies `pages` pages per step from a dedicated read-only connection
+        that keeps one read transaction open for the whole copy. The result
+        is a consistent snapshot, and in WAL mode the app keeps reading and
+        writing meanwhile; checkpoints cannot pass the snapshot, so the WAL
+        grows until the copy ends. progress(remaining, total) is called
+        after each step and may raise to cancel; throttle seconds are slept
+        between steps to leave I/O for the app. The copy is written to
+        path + '.partial' and renamed into place once complete.
+        """
+        partial = path + '.partial'
+        
+        def step(status, remaining, total):
+            if progress:
+                progress(remaining, total)
+            if throttle and remaining:
+                time.sleep(throttle)
+        
+        source = None
+        try:
+            target = sqlite3.connect(partial)
+            try:
+                if self.pool.in_memory:
+                    with self.pool.write_lock:
+                        self.conn.backup(target, pages=pages, progress=step)
+                else:
+                    source = self.pool.dedicated_reader()
+                    # Pin the snapshot so commits from other connections do not
+                    # restart the copy
+                    source.execute("BEGIN")
+                    source.execute("SELECT COUNT(*) FROM sqlite_master")
+                    source.backup(target, pages=pages, progress=step)
+            finally:
+                target.close()
+            os.replace(partial, path)
+            logger.info("Database backed up to %s", path)
+            return True
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Error backing up database: %s", e)
+            return False
+        finally:
+            if source is not None:
+                source.close()
+            if os.path.exists(partial):
+                os.remove(partial)
+    
+    def start_backup(self, directory: str, keep: int = 5, compress: bool = False,
+                     **options) -> BackupJob:
+        """Back up into a rotated snapshot directory on a background thread
+        
+        See BackupJob; options are passed on to backup().
+        """
+        return BackupJob(self, directory, keep, compress, **options).start()
+    
+    # Bulk helpers
+    @staticmethod
+    def _chunked(rows: Iterable, chunk_size: int):
+        """Yield lists of at most chunk_size rows"""
+        iterator = iter(rows)
+        chunk_size = max(1, chunk_size)
+        chunk = list(islice(iterator, chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(islice(iterator, chunk_size))
+    
+    @staticmethod
+    def _song_params(song) -> Tuple:
+        """Normalize a bulk song row to INSERT parameters"""
+        if isinstance(song, dict):
+            title, artist, duration = song.get('title'), song.get('artist'), song.get('duration')
+            file_path = song.get('file_path', "")
+        else:
+            title, artist, duration, *rest = song
+            file_path = rest[0] if rest else ""
+        return (title, artist, duration, file_path, migrations.parse_duration(duration),
+                migrations.song_fingerprint(title, artist))
+    
+    def _insert_chunk(self, sql: str, params: List[Tuple], offset: int, result: Dict):
+        """Insert one chunk with executemany, replaying it row by row on conflict"""
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany(sql, params)
+                # AUTOINCREMENT keys are contiguous inside a single write transaction
+                cursor.execute("SELECT last_insert_rowid()")
+                last_id = cursor.fetchone()[0]
+            result['ids'].extend(range(last_id - len(params) + 1, last_id + 1))
+        except sqlite3.IntegrityError:
+            # A failed INSERT only undoes its own row, so replay without a savepoint
+            cursor = self._cursor(self.conn)
+            for index, row in enumerate(params, start=offset):
+                try:
+                    cursor.execute(sql, row)
+                    result['ids'].append(cursor.lastrowid)
+                except sqlite3.IntegrityError as e:
+                    result['ids'].append(None)
+                    result['conflicts'].append({'index': index, 'row': row, 'error': str(e)})
+    
     def close(self):
         """Close database connection"""
-        if self.conn:
-            self.conn.close()
-            print("Database connection closed")
+        self.rebalancer.stop()
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+            logger.info("Database connection closed")
     
     def __del__(self):
         """Destructor to ensure connection is closed"""
@@ -0,0 +1,133 @@
+"""
+Change events for the P.R.I.S.M database
+
+Database publishes a ChangeEvent on its EventBus (db.events) for every
+committed write, naming the playlists and songs it touched. Events raised
+inside a transaction() scope are held until the outermost scope commits,
+and dropped if it rolls back, so subscribers never hear about changes
+that did not happen.
+
+Subscribers are called on the thread that committed. Views on another
+thread (the Tk main loop) subscribe an EventQueue and drain it on their
+own schedule; drain() coalesces each run of same-kind events in a burst
+into one, keeping the order of the runs.
+"""
+
+import logging
+import threading
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Event kinds
+PLAYLIST_CREATED = 'playlist_created'
+PLAYLIST_UPDATED = 'playlist_updated'
+PLAYLIST_DELETED = 'playlist_deleted'
+SONGS_ADDED = 'songs_added'
+SONGS_REMOVED = 'songs_removed'
+SONG_MOVED = 'song_moved'
+POSITIONS_RESPACED = 'positions_respaced'
+SONGS_CREATED = 'songs_created'
+SONGS_UPDATED = 'songs_updated'
+SONGS_DELETED = 'songs_deleted'
+PLAY_RECORDED = 'play_recorded'
+
+KINDS = (PLAYLIST_CREATED, PLAYLIST_UPDATED, PLAYLIST_DELETED, SONGS_ADDED, SONGS_REMOVED,
+         SONG_MOVED, POSITIONS_RESPACED, SONGS_CREATED, SONGS_UPDATED, SONGS_DELETED,
+         PLAY_RECORDED)
+
+
+class ChangeEvent(NamedTuple):
+    """One committed change and the IDs it affected
+    
+    Membership events (SONGS_ADDED, SONGS_REMOVED, SONG_MOVED) name the
+    playlists and the songs involved; SONGS_DELETED also names the
+    playlists the songs were removed from. POSITIONS_RESPACED names
+    playlists whose position keys changed without their order changing.
+    """
+    kind: str
+    playlist_ids: Tuple[int, ...] = ()
+    song_ids: Tuple[int, ...] = ()
+
+
+class EventBus:
+    """Synchronous publish/subscribe for ChangeEvents"""
+    
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+    
+    def subscribe(self, callback: Callable[[ChangeEvent], None],
+                  kinds: Optional[Iterable[str]] = None) -> Callable[[], None]:
+        """Call callback(event) for every event, or only those of the given kinds
+        
+        Returns a function that removes the subscription.
+        """
+        subscription = (callback, frozenset(kinds) if kinds is not None else None)
+        with self._lock:
+            self._subscribers.append(subscription)
+        
+        def unsubscribe():
+            with self._lock:
+                if subscription in self._subscribers:
+                    self._subscribers.remove(subscription)
+        return unsubscribe
+    
+    def publish(self, events: Iterable[ChangeEvent]):
+        """Deliver events in order; a failing subscriber is logged and skipped"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        for event in events:
+            for callback, kinds in subscribers:
+                if kinds is not None and event.kind not in kinds:
+                    continue
+                try:
+                    callback(event)
+                except Exception:
+                    logger.exception("Change event subscriber failed on %s", event.kind)
+
+
+class EventQueue:
+    """Thread-safe buffer of events, for subscribers that poll
+    
+    Subscribe it with bus.subscribe(queue.put) and call drain() from the
+    consuming thread.
+    """
+    
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+    
+    def put(self, event: ChangeEvent):
+        with self._lock:
+            self._events.append(event)
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._events)
+    
+    def drain(self) -> List[ChangeEvent]:
+        """Take the buffered events, with each run of one kind merged"""
+        with self._lock:
+            events, self._events = self._events, []
+        return coalesce(events)
+
+
+def coalesce(events: Iterable[ChangeEvent]) -> List[ChangeEvent]:
+    """Merge consecutive events of the same kind by uniting their playlist and song IDs
+    
+    Events of different kinds keep their relative order, so adding,
+    removing and re-adding a song still ends with SONGS_ADDED. IDs keep
+    the order they were first named in.
+    """
+    runs = []
+    for event in events:
+        if not runs or runs[-1][0] != event.kind:
+            runs.append((event.kind, {}, {}))
+        kind, playlist_ids, song_ids = runs[-1]
+        playlist_ids.update(dict.fromkeys(event.playlist_ids))
+        song_ids.update(dict.fromkeys(event.song_ids))
+    return [ChangeEvent(kind, tuple(playlist_ids), tuple(song_ids))
+            for kind, playlist_ids, song_ids in runs]
@@ -0,0 +1,252 @@
+"""
+Multi-library mode for P.R.I.S.M
+
+FederatedDatabase puts several prism.db files (say archive, live and
+staging) behind one object. Reads run on a per-thread connection that
+ATTACHes every library, issue one ordered query per library and merge the
+sorted cursors lazily, so a LIMIT only pulls that many rows from each
+library. Every row carries a 'library' key naming where it came from.
+
+Writes are never federated: library(name) returns the library's own
+Database, with its writer, migrations and transactions.
+"""
+
+import heapq
+import logging
+import re
+import sqlite3
+import threading
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from database import Database
+from records import nocase
+
+logger = logging.getLogger(__name__)
+
+# Columns returned by federated song and playlist listings. A library on an
+# older schema returns NULL for the columns it lacks.
+SONG_COLUMNS = ('song_id', 'title', 'artist', 'duration', 'file_path', 'created_date',
+                'duration_ms')
+PLAYLIST_COLUMNS = ('playlist_id', 'name', 'description', 'icon_color', 'created_date',
+                    'modified_date', 'song_count', 'total_duration_ms')
+
+LIBRARY_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class FederatedDatabase:
+    """Search and list across several library files as if they were one
+    
+    Read-write libraries are opened as a full Database (and migrated).
+    Read-only libraries are attached with immutable=1: SQLite then skips
+    file locking and change detection entirely, which is only safe for
+    cold archives that nothing writes to while they are open. SQLite
+    attaches at most MAX_LIBRARIES files to one connection.
+    """
+    
+    MAX_LIBRARIES = 10
+    
+    def __init__(self):
+        self._libraries = {}
+        self._databases = {}
+        self._schemas = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+    
+    def add_library(self, name: str, path: str, read_only: bool = False, **options):
+        """Register a library file under a name
+        
+        options are passed to Database() for read-write libraries.
+        """
+        if not LIBRARY_NAME.match(name) or name.lower() in ('main', 'temp'):
+            raise ValueError(f"Invalid library name: {name!r}")
+        with self._lock:
+            if name in self._libraries:
+                raise ValueError(f"Library already added: {name}")
+            if len(self._libraries) >= self.MAX_LIBRARIES:
+                raise ValueError(f"At most {self.MAX_LIBRARIES} libraries can be federated")
+        if not read_only:
+            self._databases[name] = Database(path, **options)
+        uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+        if read_only:
+            if not Path(path).exists():
+                raise FileNotFoundError(path)
+            uri += "&immutable=1"
+        with self._lock:
+            self._libraries[name] = uri
+        try:
+            self._schemas[name] = self._inspect(name)
+        except sqlite3.Error:
+            with self._lock:
+                del self._libraries[name]
+            if name in self._databases:
+                self._databases.pop(name).close()
+            raise
+        logger.info("Federated library %s: %s%s", name, path, " (read-only)" if read_only else "")
+    
+    @property
+    def libraries(self) -> List[str]:
+        """Names of the federated libraries, in the order they were added"""
+        return list(self._libraries)
+    
+    def library(self, name: str) -> Database:
+        """The Database to send a library's writes (and single-library reads) to"""
+        if name not in self._libraries:
+            raise KeyError(f"Unknown library: {name}")
+        if name not in self._databases:
+            raise ValueError(f"Library {name} is read-only")
+        return self._databases[name]
+    
+    # Connections
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's federation connection, with every library attached"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(":memory:", uri=True, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+            self._local.attached = set()
+            with self._lock:
+                self._connections.append(conn)
+        with self._lock:
+            missing = [(name, uri) for name, uri in self._libraries.items()
+                       if name not in self._local.attached]
+        for name, uri in missing:
+            conn.execute("ATTACH DATABASE ? AS " + name, (uri,))
+            self._local.attached.add(name)
+        return conn
+    
+    def _inspect(self, name: str) -> Dict:
+        """Record which columns and search indexes a library has"""
+        conn = self._connection()
+        schema = {'fts': set()}
+        for table in ('songs', 'playlists'):
+            schema[table] = {row[1] for row in conn.execute(f"PRAGMA {name}.table_info({table})")}
+        for (table,) in conn.execute(f'''
+            SELECT name FROM {name}.sqlite_master WHERE name IN ('songs_fts', 'playlists_fts')
+        '''):
+            schema['fts'].add(table)
+        return schema
+    
+    def _select_list(self, name: str, table: str, columns, alias: str = '') -> str:
+        available = self._schemas[name][table]
+        prefix = f"{alias}." if alias else ''
+        return ', '.join(f"{prefix}{column}" if column in available else f"NULL AS {column}"
+                         for column in columns)
+    
+    # Fan-out
+    def _merge(self, queries: Dict[str, tuple], key: Callable, reverse: bool = False,
+               limit: Optional[int] = None) -> List[Dict]:
+        """Run one ordered query per library and merge the results
+        
+        queries maps each library to its (sql, params); every query must
+        already be sorted by key. Rows become dicts tagged with 'library'.
+        """
+        conn = self._connection()
+        
+        def rows(name, sql, params) -> Iterator[Dict]:
+            cursor = conn.execute(sql, params)
+            names = [description[0] for description in cursor.description]
+            for row in cursor:
+                record = dict(zip(names, row))
+                record['library'] = name
+                yield record
+        
+        streams = [rows(name, sql, params) for name, (sql, params) in queries.items()]
+        try:
+            return list(islice(heapq.merge(*streams, key=key, reverse=reverse), limit))
+        except sqlite3.Error as e:
+            logger.error("Error querying federated libraries: %s", e)
+            return []
+    
+    def get_all_songs(self) -> List[Dict]:
+        """Every song of every library, by title"""
+        queries = {name: (f'''
+            SELECT {self._select_list(name, 'songs', SONG_COLUMNS)} FROM {name}.songs
+            ORDER BY title COLLATE NOCASE
+        ''', ()) for name in self.libraries}
+        return self._merge(queries, key=lambda song: nocase(song['title']))
+    
+    def get_all_playlists(self) -> List[Dict]:
+        """Every playlist of every library, most recently modified first"""
+        queries = {name: (f'''
+            SELECT {self._select_list(name, 'playlists', PLAYLIST_COLUMNS)} FROM {name}.playlists
+            ORDER BY modified_date DESC
+        ''', ()) for name in self.libraries}
+        return self._merge(queries, key=lambda playlist: playlist['modified_date'] or '',
+                           reverse=True)
+    
+    def search_songs(self, query: str, limit: Optional[int] = None) -> List[Dict]:
+        """Search songs by title or artist in every library
+        
+        Libraries with a full-text index rank by bm25 as Database does;
+        LIKE matches from libraries without one follow the ranked hits.
+        Each library contributes at most limit rows before merging.
+        """
+        match = Database._match_expression(query)
+        queries = {}
+        for name in self.libraries:
+            if match and 'songs_fts' in self._schemas[name]['fts']:
+                queries[name] = (f'''
+                    SELECT {self._select_list(name, 'songs', SONG_COLUMNS, 's')},
+                           bm25(songs_fts, 10.0, 5.0) AS rank
+                    FROM {name}.songs_fts
+                    JOIN {name}.songs s ON s.song_id = songs_fts.rowid
+                    WHERE songs_fts MATCH ?
+                    ORDER BY rank, s.title
+                    LIMIT ?
+                ''', (match, -1 if limit is None else limit))
+            else:
+                pattern = f"%{query}%"
+                queries[name] = (f'''
+                    SELECT {self._select_list(name, 'songs', SONG_COLUMNS)}, 0.0 AS rank
+                    FROM {name}.songs
+                    WHERE title LIKE ? OR artist LIKE ?
+                    ORDER BY title
+                    LIMIT ?
+                ''', (pattern, pattern, -1 if limit is None else limit))
+        songs = self._merge(queries, key=lambda song: (song['rank'], song['title']), limit=limit)
+        for song in songs:
+            del song['rank']
+        return songs
+    
+    def search_playlists(self, query: str) -> List[Dict]:
+        """Search playlists by name or description in every library, best matches first"""
+        match = Database._match_expression(query)
+        queries = {}
+        for name in self.libraries:
+            if match and 'playlists_fts' in self._schemas[name]['fts']:
+                queries[name] = (f'''
+                    SELECT {self._select_list(name, 'playlists', PLAYLIST_COLUMNS, 'p')},
+                           bm25(playlists_fts, 10.0, 1.0) AS rank
+                    FROM {name}.playlists_fts
+                    JOIN {name}.playlists p ON p.playlist_id = playlists_fts.rowid
+                    WHERE playlists_fts MATCH ?
+                    ORDER BY rank, p.name
+                ''', (match,))
+            else:
+                pattern = f"%{query}%"
+                queries[name] = (f'''
+                    SELECT {self._select_list(name, 'playlists', PLAYLIST_COLUMNS)}, 0.0 AS rank
+                    FROM {name}.playlists
+                    WHERE name LIKE ? OR description LIKE ?
+                    ORDER BY name
+                ''', (pattern, pattern))
+        playlists = self._merge(queries, key=lambda playlist: (playlist['rank'], playlist['name']))
+        for playlist in playlists:
+            del playlist['rank']
+        return playlists
+    
+    def close(self):
+        """Close the federation connections and every read-write library"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+        for db in self._databases.values():
+            db.close()
+        self._databases.clear()
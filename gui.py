@@ -1,16 +1,59 @@
+import bisect
+import threading
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-from database import Database
+from tkinter import ttk, messagebox
+from typing import Optional
+from database import Database, Rollback
+import events
+from events import EventQueue
+from migrations import parse_duration
+from records import nocase
+import smart
 from datetime import datetime
 
+# File dialogs, the folder scanner and playlist import/export are imported
+# by the commands that use them, keeping them off the startup path
+
 class PRISMApp:
     """Main GUI Application for P.R.I.S.M"""
     
-    def __init__(self, root, db: Database):
+    # Cap on rows shown per search keystroke in the All Songs view
+    SONG_SEARCH_LIMIT = 500
+    
+    # Rows fetched per page when browsing All Songs
+    SONG_PAGE_SIZE = 200
+    
+    # How often committed database changes are applied to the views
+    CHANGE_POLL_MS = 150
+    
+    # Playlist cards built at a time; later pages are built between events
+    PLAYLIST_PAGE_SIZE = 24
+    
+    def __init__(self, root, db: Optional[Database] = None):
+        """Build the window shell, and the views too if db is given
+        
+        Without a database the window opens with its controls disabled;
+        attach() one later, e.g. once a background thread has opened it.
+        """
         self.root = root
-        self.db = db
+        self.db = None
         self.current_playlist_id = None
         
+        # Controls that need a database, enabled by attach()
+        self.db_controls = []
+        
+        # Key of the next page of playlist cards still to build, if any
+        self.playlist_page_key = None
+        
+        # Widgets that change events update in place
+        self.playlist_cards = {}
+        self.playlist_views = {}
+        self.songs_tree = None
+        self.songs_count_label = None
+        self.songs_pager = None
+        self.showing_all_songs = False
+        self.showing_all_playlists = False
+        
         # Configure root window
         self.root.title("P.R.I.S.M - Playlist Repository & Index for Sonic Media")
         self.root.geometry("1200x700")
@@ -29,8 +72,23 @@ class PRISMApp:
         }
         
         self.setup_ui()
+        if db is not None:
+            self.attach(db)
+    
+    def attach(self, db: Database):
+        """Show a database: fill the views, add the menus and follow its changes"""
+        self.db = db
+        for widget in self.db_controls:
+            widget.config(state=tk.NORMAL)
         self.create_menu_bar()
+        self.load_recently_played()
         self.load_playlists()
+        
+        # Changes are committed on whichever thread wrote them; Tk is only
+        # touched from here, so they are queued and applied on a timer
+        self.changes = EventQueue()
+        self.db.events.subscribe(self.changes.put)
+        self.root.after(self.CHANGE_POLL_MS, self.apply_changes)
     
     def format_date(self, date_str):
         """Format timestamp for display"""
@@ -43,6 +101,13 @@ class PRISMApp:
         except:
             return date_str
     
+    def format_duration(self, total_ms):
+        """Format a total length in milliseconds for display"""
+        minutes = (total_ms or 0) // 60000
+        if minutes >= 60:
+            return f"{minutes // 60} hr {minutes % 60} min"
+        return f"{minutes} min"
+    
     def setup_ui(self):
         """Setup the main user interface"""
         main_container = tk.Frame(self.root, bg=self.colors['bg_primary'])
@@ -65,6 +130,12 @@ class PRISMApp:
         file_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="File", menu=file_menu)
         file_menu.add_command(label="New Playlist", command=self.create_playlist_dialog)
+        file_menu.add_command(label="New Smart Playlist...", command=self.create_smart_playlist_dialog)
+        file_menu.add_command(label="Scan Folder...", command=self.scan_folder_dialog)
+        file_menu.add_command(label="Import Playlist...", command=self.import_playlist_dialog)
+        file_menu.add_command(label="Export Library...",
+                              command=lambda: self.export_dialog(None))
+        file_menu.add_command(label="Back Up Now...", command=self.backup_dialog)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         
@@ -131,6 +202,8 @@ class PRISMApp:
         
         self.search_entry.bind('<FocusIn>', on_focus_in)
         self.search_entry.bind('<FocusOut>', on_focus_out)
+        self.search_entry.config(state=tk.DISABLED, disabledbackground='#0c1e42')
+        self.db_controls.append(self.search_entry)
         
         # New Playlist button
         button_frame = tk.Frame(header, bg='#1e3a8a')
@@ -139,8 +212,10 @@ class PRISMApp:
         new_btn = tk.Button(button_frame, text="+ New Playlist", font=('Arial', 12, 'bold'),
                            bg='#3b82f6', fg='#ffffff', activebackground='#2563eb',
                            activeforeground='#ffffff', relief=tk.FLAT, bd=0, padx=25, pady=12,
-                           cursor='hand2', command=self.create_playlist_dialog)
+                           cursor='hand2', command=self.create_playlist_dialog,
+                           state=tk.DISABLED)
         new_btn.pack()
+        self.db_controls.append(new_btn)
         
         new_btn.bind('<Enter>', lambda e: new_btn.config(bg='#2563eb'))
         new_btn.bind('<Leave>', lambda e: new_btn.config(bg='#3b82f6'))
@@ -168,8 +243,9 @@ class PRISMApp:
             btn = tk.Button(sidebar, text=text, font=('Arial', 11),
                            bg=self.colors['bg_secondary'], fg=self.colors['text_secondary'],
                            relief=tk.FLAT, bd=0, anchor='w', padx=20, pady=10,
-                           cursor='hand2', command=command)
+                           cursor='hand2', command=command, state=tk.DISABLED)
             btn.pack(fill=tk.X)
+            self.db_controls.append(btn)
             btn.bind('<Enter>', lambda e, b=btn: b.config(bg=self.colors['hover']))
             btn.bind('<Leave>', lambda e, b=btn: b.config(bg=self.colors['bg_secondary']))
         
@@ -181,8 +257,6 @@ class PRISMApp:
         
         self.recent_frame = tk.Frame(sidebar, bg=self.colors['bg_secondary'])
         self.recent_frame.pack(fill=tk.BOTH, expand=True, padx=10)
-        
-        self.load_recently_played()
     
     def create_main_content(self, parent):
         """Create main content area with playlist grid"""
@@ -220,6 +294,11 @@ class PRISMApp:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         self.main_content_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+        
+        loading_label = tk.Label(self.main_content_frame, text="Loading your library...",
+                                 font=('Arial', 14), bg=self.colors['bg_primary'],
+                                 fg=self.colors['text_secondary'])
+        loading_label.pack(pady=50)
     
     def create_playlist_card(self, parent, playlist_data, row, col):
         """Create a playlist card widget"""
@@ -273,13 +352,37 @@ class PRISMApp:
         
         card.bind('<Enter>', on_enter)
         card.bind('<Leave>', on_leave)
+        
+        self.playlist_cards[playlist_id] = {'card': card, 'name': name_label, 'count': count_label}
     
-    def load_playlists(self):
-        """Load and display all playlists"""
+    def regrid_playlist_cards(self):
+        """Lay the registered cards out again, three per row"""
+        for idx, entry in enumerate(self.playlist_cards.values()):
+            entry['card'].grid(row=idx // 3, column=idx % 3)
+    
+    def clear_main_content(self):
+        """Empty the main content area and forget the widgets it held"""
         for widget in self.main_content_frame.winfo_children():
             widget.destroy()
+        self.playlist_cards = {}
+        self.playlist_page_key = None
+        self.songs_tree = None
+        self.songs_count_label = None
+        self.songs_pager = None
+        self.showing_all_songs = False
+        self.showing_all_playlists = False
+    
+    def load_playlists(self):
+        """Load and display all playlists
+        
+        Only the first page of cards is built straight away; the rest
+        follow a page at a time, so a large library never holds up the
+        window.
+        """
+        self.clear_main_content()
+        self.showing_all_playlists = True
         
-        playlists = self.db.get_all_playlists()
+        playlists, next_key = self.db.get_playlists_page(page_size=self.PLAYLIST_PAGE_SIZE)
         
         if not playlists:
             no_data_label = tk.Label(self.main_content_frame,
@@ -289,10 +392,27 @@ class PRISMApp:
             no_data_label.pack(pady=50)
             return
         
-        for idx, playlist in enumerate(playlists):
-            row = idx // 3
-            col = idx % 3
-            self.create_playlist_card(self.main_content_frame, playlist, row, col)
+        self.add_playlist_page(playlists, next_key)
+    
+    def add_playlist_page(self, playlists, next_key):
+        """Add a page of cards to the end of the grid and schedule the next page"""
+        for playlist in playlists:
+            # A change event may have put the card up already
+            if playlist['playlist_id'] in self.playlist_cards:
+                continue
+            idx = len(self.playlist_cards)
+            self.create_playlist_card(self.main_content_frame, playlist, idx // 3, idx % 3)
+        
+        self.playlist_page_key = next_key
+        if next_key is not None:
+            self.root.after(1, self.load_next_playlist_page, next_key)
+    
+    def load_next_playlist_page(self, after_key):
+        """Build the next page of cards, unless the grid has been replaced since"""
+        if after_key is not self.playlist_page_key:
+            return
+        playlists, next_key = self.db.get_playlists_page(after_key, self.PLAYLIST_PAGE_SIZE)
+        self.add_playlist_page(playlists, next_key)
     
     def load_recently_played(self):
         """Load recently played songs in sidebar"""
@@ -340,12 +460,12 @@ class PRISMApp:
         self.content_title.config(text="All Songs")
         self.content_subtitle.config(text="Browse your complete music library")
         
-        for widget in self.main_content_frame.winfo_children():
-            widget.destroy()
+        self.clear_main_content()
+        self.showing_all_songs = True
         
-        all_songs = self.db.get_all_songs()
+        total_songs = self.db.count_songs()
         
-        if not all_songs:
+        if not total_songs:
             no_songs = tk.Label(self.main_content_frame,
                                text="No songs in library. Add songs through playlists!",
                                font=('Arial', 14), bg=self.colors['bg_primary'],
@@ -357,10 +477,11 @@ class PRISMApp:
         control_frame = tk.Frame(self.main_content_frame, bg=self.colors['bg_primary'])
         control_frame.pack(fill=tk.X, pady=(0, 10))
         
-        count_label = tk.Label(control_frame, text=f"Total: {len(all_songs)} songs",
+        count_label = tk.Label(control_frame, text=f"Total: {total_songs} songs",
                               font=('Arial', 12, 'bold'), bg=self.colors['bg_primary'],
                               fg=self.colors['text_secondary'])
         count_label.pack(side=tk.LEFT)
+        self.songs_count_label = count_label
         
         # Search bar for songs
         search_frame = tk.Frame(control_frame, bg=self.colors['bg_card'],
@@ -402,7 +523,7 @@ class PRISMApp:
         # Create treeview with created_date column
         columns = ('ID', 'Title', 'Artist', 'Duration', 'Added')
         tree = ttk.Treeview(table_frame, columns=columns, show='headings',
-                           style="Songs.Treeview")
+                           style="Songs.Treeview", selectmode='extended')
         
         tree.heading('ID', text='ID')
         tree.heading('Title', text='Title')
@@ -415,47 +536,74 @@ class PRISMApp:
         tree.column('Artist', width=200)
         tree.column('Duration', width=100, anchor='center')
         tree.column('Added', width=180, anchor='center')
+        self.songs_tree = tree
         
-        def populate_tree(songs):
-            tree.delete(*tree.get_children())
+        def insert_songs(songs):
             for song in songs:
-                formatted_date = self.format_date(song.get('created_date', ''))
-                tree.insert('', tk.END,
-                           values=(song['song_id'], song['title'],
-                                  song['artist'], song['duration'], formatted_date),
+                tree.insert('', tk.END, values=self.song_row_values(song),
                            tags=(song['song_id'],))
         
+        # Browse pages are fetched as the user scrolls, so only what has
+        # been scrolled past is ever loaded
+        pager = {'next_key': None, 'browsing': True}
+        self.songs_pager = pager
+        
+        def load_next_page():
+            songs, pager['next_key'] = self.db.get_songs_page(
+                'title', pager['next_key'], self.SONG_PAGE_SIZE)
+            insert_songs(songs)
+        
+        def reset_browse():
+            tree.delete(*tree.get_children())
+            pager['next_key'] = None
+            pager['browsing'] = True
+            load_next_page()
+        
         def search_songs(*args):
             query = song_search_var.get().strip()
             if query:
-                results = self.db.search_songs(query)
-                populate_tree(results)
+                pager['browsing'] = False
+                tree.delete(*tree.get_children())
+                insert_songs(self.db.search_songs(query, limit=self.SONG_SEARCH_LIMIT))
             else:
-                populate_tree(all_songs)
+                reset_browse()
         
         song_search_var.trace('w', search_songs)
         
-        populate_tree(all_songs)
+        reset_browse()
         
         scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscrollcommand=scrollbar.set)
+        
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if pager['browsing'] and pager['next_key'] is not None and float(last) > 0.9:
+                load_next_page()
+        
+        tree.configure(yscrollcommand=on_scroll)
         
         tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # Context menu
+        # Context menu, acting on the whole selection
         def show_context_menu(event):
-            row_id = tree.identify_row(event.y)
-            if row_id:
-                tree.selection_set(row_id)
-                item = tree.selection()
-                if item:
-                    menu = tk.Menu(self.root, tearoff=0)
-                    song_id = int(tree.item(item)['tags'][0])
-                    menu.add_command(label="▶ Play Song", command=lambda: self.play_song(song_id))
-                    menu.add_separator()
-                    menu.add_command(label="🗑 Delete Song", command=lambda: self.delete_song_confirm(song_id))
-                    menu.post(event.x_root, event.y_root)
+            song_ids = self.selected_song_ids(tree, event)
+            if not song_ids:
+                return
+            menu = tk.Menu(self.root, tearoff=0)
+            if len(song_ids) == 1:
+                menu.add_command(label="▶ Play Song", command=lambda: self.play_song(song_ids[0]))
+                menu.add_separator()
+            
+            playlist_menu = tk.Menu(menu, tearoff=0)
+            for playlist in self.db.get_all_playlists():
+                playlist_menu.add_command(
+                    label=playlist['name'],
+                    command=lambda pid=playlist['playlist_id']: self.add_songs_to_playlist(pid, song_ids))
+            menu.add_cascade(label="➕ Add to Playlist", menu=playlist_menu)
+            menu.add_separator()
+            label = "🗑 Delete Song" if len(song_ids) == 1 else f"🗑 Delete {len(song_ids)} Songs"
+            menu.add_command(label=label, command=lambda: self.delete_songs_confirm(song_ids))
+            menu.post(event.x_root, event.y_root)
         
         tree.bind('<Button-3>', show_context_menu)
         tree.bind('<Double-Button-1>',
@@ -514,7 +662,6 @@ class PRISMApp:
             playlist_id = self.db.create_playlist(name, description)
             if playlist_id:
                 messagebox.showinfo("Success", f"Playlist '{name}' created successfully!")
-                self.load_playlists()
                 dialog.destroy()
             else:
                 messagebox.showerror("Error", "Failed to create playlist. Name might already exist.")
@@ -531,6 +678,102 @@ class PRISMApp:
         
         dialog.bind('<Return>', lambda e: create())
     
+    def create_smart_playlist_dialog(self):
+        """Dialog to create a playlist whose songs are chosen by rules"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Create Smart Playlist")
+        dialog.geometry("420x560")
+        dialog.configure(bg=self.colors['bg_secondary'])
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        # Center dialog
+        dialog.update_idletasks()
+        x = (dialog.winfo_screenwidth() // 2) - (dialog.winfo_width() // 2)
+        y = (dialog.winfo_screenheight() // 2) - (dialog.winfo_height() // 2)
+        dialog.geometry(f"+{x}+{y}")
+        
+        title_label = tk.Label(dialog, text="Create Smart Playlist", font=('Arial', 16, 'bold'),
+                              bg=self.colors['bg_secondary'], fg=self.colors['text_primary'])
+        title_label.pack(pady=(20, 5))
+        
+        hint_label = tk.Label(dialog, text="Songs matching every filled-in rule are kept in it",
+                             font=('Arial', 9), bg=self.colors['bg_secondary'],
+                             fg=self.colors['text_secondary'])
+        hint_label.pack(pady=(0, 10))
+        
+        fields = [('name', "Playlist Name:"),
+                  ('artist', "Artist is:"),
+                  ('min_length', "At least this long (M:SS):"),
+                  ('max_length', "At most this long (M:SS):"),
+                  ('added', "Added in the last N days:"),
+                  ('plays', "Played at least N times:"),
+                  ('played', "Played in the last N days:")]
+        entries = {}
+        for key, text in fields:
+            label = tk.Label(dialog, text=text, font=('Arial', 11),
+                            bg=self.colors['bg_secondary'], fg=self.colors['text_primary'])
+            label.pack(anchor='w', padx=30)
+            entry = tk.Entry(dialog, font=('Arial', 12), bg=self.colors['bg_primary'],
+                            fg=self.colors['text_primary'], insertbackground=self.colors['text_primary'])
+            entry.pack(fill=tk.X, padx=30, pady=(2, 6))
+            entries[key] = entry
+        entries['name'].focus()
+        
+        # Buttons
+        btn_frame = tk.Frame(dialog, bg=self.colors['bg_secondary'])
+        btn_frame.pack(pady=15)
+        
+        def create():
+            values = {key: entry.get().strip() for key, entry in entries.items()}
+            if not values['name']:
+                messagebox.showwarning("Invalid Input", "Please enter a playlist name")
+                return
+            
+            rules = []
+            if values['artist']:
+                rules.append({'field': 'artist', 'value': values['artist']})
+            lengths = {}
+            for key, bound in (('min_length', 'min'), ('max_length', 'max')):
+                if values[key]:
+                    duration_ms = parse_duration(values[key])
+                    if duration_ms is None:
+                        messagebox.showwarning("Invalid Input", "Lengths must look like 3:45")
+                        return
+                    lengths[bound] = duration_ms // 1000
+            if lengths:
+                rules.append(dict(field='duration', **lengths))
+            for key, field, bound in (('added', 'added', 'days'), ('plays', 'plays', 'min'),
+                                      ('played', 'played', 'days')):
+                if values[key]:
+                    if not values[key].isdigit():
+                        messagebox.showwarning("Invalid Input", "Day and play counts must be numbers")
+                        return
+                    rules.append({'field': field, bound: int(values[key])})
+            
+            try:
+                playlist_id = self.db.create_smart_playlist(values['name'], {'rules': rules})
+            except ValueError as e:
+                messagebox.showwarning("Invalid Rules", str(e))
+                return
+            if playlist_id:
+                dialog.destroy()
+                self.open_playlist(playlist_id)
+            else:
+                messagebox.showerror("Error", "Failed to create playlist. Name might already exist.")
+        
+        create_btn = tk.Button(btn_frame, text="Create", font=('Arial', 11, 'bold'),
+                              bg=self.colors['accent'], fg=self.colors['text_primary'],
+                              padx=20, pady=5, command=create, cursor='hand2')
+        create_btn.pack(side=tk.LEFT, padx=5)
+        
+        cancel_btn = tk.Button(btn_frame, text="Cancel", font=('Arial', 11),
+                              bg=self.colors['bg_card'], fg=self.colors['text_primary'],
+                              padx=20, pady=5, command=dialog.destroy, cursor='hand2')
+        cancel_btn.pack(side=tk.LEFT, padx=5)
+        
+        dialog.bind('<Return>', lambda e: create())
+    
     def open_playlist(self, playlist_id):
         """Open a playlist and show its songs"""
         self.current_playlist_id = playlist_id
@@ -578,7 +821,8 @@ class PRISMApp:
                                 bg=self.colors['bg_secondary'], fg=self.colors['text_secondary'])
             separator.pack(side=tk.LEFT, padx=5)
         
-        count = tk.Label(info_frame, text=f"{playlist['song_count']} songs",
+        count = tk.Label(info_frame,
+                        text=f"{playlist['song_count']} songs  •  {self.format_duration(playlist['total_duration_ms'])}",
                         font=('Arial', 11), bg=self.colors['bg_secondary'],
                         fg=self.colors['text_secondary'])
         count.pack(side=tk.LEFT)
@@ -596,12 +840,19 @@ class PRISMApp:
                               fg=self.colors['text_secondary'])
         dates_label.pack(side=tk.LEFT)
         
-        # Right side - Add button
-        add_song_btn = tk.Button(header, text="+ Add Song", font=('Arial', 11),
-                                bg=self.colors['accent'], fg=self.colors['text_primary'],
-                                cursor='hand2', padx=20, pady=8,
-                                command=lambda: self.add_song_dialog(playlist_id, playlist_window))
-        add_song_btn.pack(side=tk.RIGHT, padx=5)
+        # Right side - Add button, or the rules that choose a smart playlist's songs
+        rules = smart.parse_rules(playlist['rules']) if playlist.get('rules') else None
+        if rules is None:
+            add_song_btn = tk.Button(header, text="+ Add Song", font=('Arial', 11),
+                                    bg=self.colors['accent'], fg=self.colors['text_primary'],
+                                    cursor='hand2', padx=20, pady=8,
+                                    command=lambda: self.add_song_dialog(playlist_id, playlist_window))
+            add_song_btn.pack(side=tk.RIGHT, padx=5)
+        else:
+            rules_label = tk.Label(header, text=f"✨ Smart: {smart.describe(rules)}",
+                                   font=('Arial', 10), bg=self.colors['bg_secondary'],
+                                   fg=self.colors['text_secondary'], wraplength=300, justify='right')
+            rules_label.pack(side=tk.RIGHT, padx=10)
         
         # Songs list - Container with consistent background
         songs_container = tk.Frame(playlist_window, bg=self.colors['bg_card'])
@@ -636,7 +887,7 @@ class PRISMApp:
         
         columns = ('ID', 'Title', 'Artist', 'Duration', 'Date Added')
         tree = ttk.Treeview(songs_frame, columns=columns, show='headings',
-                           height=15, style=playlist_style)
+                           height=15, style=playlist_style, selectmode='extended')
         
         tree.heading('ID', text='ID')
         tree.heading('Title', text='Title')
@@ -650,40 +901,91 @@ class PRISMApp:
         tree.column('Duration', width=100, anchor='center')
         tree.column('Date Added', width=180, anchor='center')
         
-        songs = self.db.get_playlist_songs(playlist_id)
+        empty_text = ("No songs in this playlist yet. Click '+ Add Song' to add some!" if rules is None
+                      else "No songs match this playlist's rules yet.")
+        no_songs = tk.Label(songs_container, text=empty_text,
+                            font=('Arial', 12), bg=self.colors['bg_card'],
+                            fg=self.colors['text_secondary'])
+        scrollbar = ttk.Scrollbar(songs_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
         
-        if not songs:
-            no_songs = tk.Label(songs_container, text="No songs in this playlist yet. Click '+ Add Song' to add some!",
-                              font=('Arial', 12), bg=self.colors['bg_card'],
-                              fg=self.colors['text_secondary'])
-            no_songs.pack(pady=50, fill=tk.BOTH, expand=True)
-        else:
-            for song in songs:
-                formatted_date = self.format_date(song.get('added_date', ''))
-                tree.insert('', tk.END, values=(song['song_id'], song['title'],
-                                               song['artist'], song['duration'], formatted_date),
-                           tags=(song['song_id'],))
-            
-            scrollbar = ttk.Scrollbar(songs_frame, orient=tk.VERTICAL, command=tree.yview)
-            tree.configure(yscrollcommand=scrollbar.set)
-            
-            tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-            
-            def show_song_context_menu(event):
-                item = tree.selection()
-                if item:
-                    menu = tk.Menu(playlist_window, tearoff=0)
-                    menu.add_command(label="Play Song",
-                                   command=lambda: self.play_song(int(tree.item(item)['tags'][0])))
+        # Change events refresh this window in place while it is open
+        view = {'window': playlist_window, 'title': title, 'count': count, 'dates': dates_label,
+                'tree': tree, 'scrollbar': scrollbar, 'placeholder': no_songs}
+        self.playlist_views.setdefault(playlist_id, []).append(view)
+        
+        def forget_view(event):
+            if event.widget is playlist_window and view in self.playlist_views.get(playlist_id, []):
+                self.playlist_views[playlist_id].remove(view)
+        
+        playlist_window.bind('<Destroy>', forget_view, add='+')
+        self.fill_playlist_view(playlist_id, view)
+        
+        def show_song_context_menu(event):
+            song_ids = self.selected_song_ids(tree, event)
+            if not song_ids:
+                return
+            menu = tk.Menu(playlist_window, tearoff=0)
+            if len(song_ids) == 1:
+                menu.add_command(label="Play Song", command=lambda: self.play_song(song_ids[0]))
+            # A smart playlist's songs follow its rules and cannot be removed by hand
+            if rules is None:
+                if len(song_ids) == 1:
                     menu.add_separator()
-                    menu.add_command(label="Remove from Playlist",
-                                   command=lambda: self.remove_song_from_playlist(
-                                       playlist_id, int(tree.item(item)['tags'][0]), playlist_window))
-                    menu.post(event.x_root, event.y_root)
-            
-            tree.bind('<Button-3>', show_song_context_menu)
-            tree.bind('<Double-Button-1>', lambda e: self.play_song(int(tree.item(tree.selection()[0])['tags'][0])) if tree.selection() else None)
+                label = ("Remove from Playlist" if len(song_ids) == 1
+                         else f"Remove {len(song_ids)} Songs from Playlist")
+                menu.add_command(label=label,
+                               command=lambda: self.remove_songs_from_playlist(
+                                   playlist_id, song_ids))
+            elif len(song_ids) > 1:
+                return
+            menu.post(event.x_root, event.y_root)
+        
+        tree.bind('<Button-3>', show_song_context_menu)
+        tree.bind('<Double-Button-1>', lambda e: self.play_song(int(tree.item(tree.selection()[0])['tags'][0])) if tree.selection() else None)
+        
+        # Drag and drop reordering
+        drag = {'item': None}
+        
+        def start_drag(event):
+            drag['item'] = tree.identify_row(event.y)
+        
+        def drop(event):
+            source, drag['item'] = drag['item'], None
+            target = tree.identify_row(event.y)
+            if not source or not target or source == target:
+                return
+            # Dragging down lands after the target, dragging up before it
+            before = tree.next(target) if tree.index(source) < tree.index(target) else target
+            before_id = int(tree.item(before)['tags'][0]) if before else None
+            if self.db.move_song(playlist_id, int(tree.item(source)['tags'][0]), before_id):
+                tree.move(source, '', tree.index(target))
+        
+        if rules is None:
+            tree.bind('<ButtonPress-1>', start_drag, add='+')
+            tree.bind('<ButtonRelease-1>', drop, add='+')
+    
+    def fill_playlist_view(self, playlist_id, view):
+        """Load a playlist window's songs into its tree"""
+        tree = view['tree']
+        tree.delete(*tree.get_children())
+        for song in self.db.iter_playlist_songs(playlist_id):
+            formatted_date = self.format_date(song.get('added_date', ''))
+            tree.insert('', tk.END, values=(song['song_id'], song['title'],
+                                           song['artist'], song['duration'], formatted_date),
+                       tags=(song['song_id'],))
+        self.pack_playlist_view(view)
+    
+    def pack_playlist_view(self, view):
+        """Show a playlist window's songs, or the placeholder once it is empty"""
+        if view['tree'].get_children():
+            view['placeholder'].pack_forget()
+            view['tree'].pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            view['scrollbar'].pack(side=tk.RIGHT, fill=tk.Y)
+        else:
+            view['tree'].pack_forget()
+            view['scrollbar'].pack_forget()
+            view['placeholder'].pack(pady=50, fill=tk.BOTH, expand=True)
     
     def add_song_dialog(self, playlist_id, parent_window):
         """Dialog to add a song to playlist"""
@@ -733,15 +1035,25 @@ class PRISMApp:
                 messagebox.showwarning("Invalid Input", "Please fill in all required fields")
                 return
             
-            song_id = self.db.create_song(title, artist, duration, path)
-            if song_id:
-                if self.db.add_song_to_playlist(playlist_id, song_id):
-                    messagebox.showinfo("Success", f"Song added successfully!")
-                    dialog.destroy()
-                    parent_window.destroy()
-                    self.open_playlist(playlist_id)
-                else:
-                    messagebox.showerror("Error", "Failed to add song to playlist")
+            if parse_duration(duration) is None:
+                messagebox.showwarning("Invalid Input", "Duration must look like 3:45 or 1:02:03")
+                return
+            
+            # Create and link the song atomically, with a single commit
+            song_id = None
+            added = False
+            with self.db.transaction():
+                song_id = self.db.get_or_create_song(title, artist, duration, path)
+                if song_id:
+                    added = self.db.add_song_to_playlist(playlist_id, song_id)
+                    if not added:
+                        raise Rollback()
+            
+            if added:
+                messagebox.showinfo("Success", f"Song added successfully!")
+                dialog.destroy()
+            elif song_id:
+                messagebox.showerror("Error", "Failed to add song to playlist")
             else:
                 messagebox.showerror("Error", "Failed to create song")
         
@@ -765,33 +1077,245 @@ class PRISMApp:
         song = self.db.get_song_by_id(song_id)
         if song:
             self.db.add_to_recently_played(song_id)
-            self.load_recently_played()
             messagebox.showinfo("Now Playing", f"🎵 {song['title']}\n🎤 {song['artist']}\n⏱ {song['duration']}")
     
-    def remove_song_from_playlist(self, playlist_id, song_id, parent_window):
-        """Remove a song from playlist"""
-        if messagebox.askyesno("Confirm", "Remove this song from the playlist?"):
-            if self.db.remove_song_from_playlist(playlist_id, song_id):
-                messagebox.showinfo("Success", "Song removed from playlist")
-                parent_window.destroy()
-                self.open_playlist(playlist_id)
-            else:
-                messagebox.showerror("Error", "Failed to remove song")
+    def selected_song_ids(self, tree, event):
+        """Song IDs of a tree's selection, after a right-click on a row
+        
+        Right-clicking outside the selection selects just that row, as
+        file managers do.
+        """
+        row_id = tree.identify_row(event.y)
+        if row_id and row_id not in tree.selection():
+            tree.selection_set(row_id)
+        return [int(tree.item(item)['tags'][0]) for item in tree.selection()]
+    
+    def add_songs_to_playlist(self, playlist_id, song_ids):
+        """Append the selected songs to a playlist"""
+        added = self.db.add_songs_to_playlist(playlist_id, song_ids)
+        skipped = len(song_ids) - added
+        message = f"{added} song{'s' if added != 1 else ''} added"
+        if skipped:
+            message += f" ({skipped} already in the playlist)"
+        messagebox.showinfo("Success", message)
+    
+    def remove_songs_from_playlist(self, playlist_id, song_ids):
+        """Remove the selected songs from a playlist"""
+        question = ("Remove this song from the playlist?" if len(song_ids) == 1
+                    else f"Remove {len(song_ids)} songs from the playlist?")
+        if messagebox.askyesno("Confirm", question):
+            if not self.db.remove_songs_from_playlist(playlist_id, song_ids):
+                messagebox.showerror("Error", "Failed to remove songs")
+    
+    def delete_songs_confirm(self, song_ids):
+        """Delete the selected songs from the database"""
+        question = ("Delete this song? It will be removed from all playlists." if len(song_ids) == 1
+                    else f"Delete {len(song_ids)} songs? They will be removed from all playlists.")
+        if messagebox.askyesno("Confirm Delete", question):
+            if not self.db.delete_songs(song_ids):
+                messagebox.showerror("Error", "Failed to delete songs")
     
-    def delete_song_confirm(self, song_id):
-        """Delete a song from the database"""
-        if messagebox.askyesno("Confirm Delete", "Delete this song? It will be removed from all playlists."):
-            if self.db.delete_song(song_id):
-                messagebox.showinfo("Success", "Song deleted successfully!")
+    # Change events
+    def apply_changes(self):
+        """Update just the widgets showing what the latest commits changed
+        
+        Runs every CHANGE_POLL_MS; a burst of events since the last run
+        arrives in order, with each run of one kind coalesced.
+        """
+        try:
+            for event in self.changes.drain():
+                if event.kind == events.PLAYLIST_CREATED:
+                    self.add_playlist_cards(event.playlist_ids)
+                elif event.kind == events.PLAYLIST_DELETED:
+                    self.remove_playlists(event.playlist_ids)
+                elif event.kind == events.PLAYLIST_UPDATED:
+                    self.refresh_playlists(event.playlist_ids, to_front=True)
+                elif event.kind == events.SONG_MOVED:
+                    for playlist_id in event.playlist_ids:
+                        for view in self.playlist_views.get(playlist_id, []):
+                            self.reorder_playlist_view(playlist_id, view)
+                    self.refresh_playlists(event.playlist_ids, to_front=True)
+                elif event.kind in (events.SONGS_CREATED, events.SONGS_UPDATED):
+                    self.update_song_rows(event)
+                elif event.kind == events.SONGS_ADDED:
+                    for playlist_id in event.playlist_ids:
+                        for view in self.playlist_views.get(playlist_id, []):
+                            self.fill_playlist_view(playlist_id, view)
+                    self.refresh_playlists(event.playlist_ids, to_front=True)
+                elif event.kind in (events.SONGS_REMOVED, events.SONGS_DELETED):
+                    self.remove_song_rows(event)
+                    self.refresh_playlists(event.playlist_ids)
+                if event.kind in (events.PLAY_RECORDED, events.SONGS_DELETED):
+                    self.load_recently_played()
+        finally:
+            self.root.after(self.CHANGE_POLL_MS, self.apply_changes)
+    
+    def add_playlist_cards(self, playlist_ids):
+        """Put cards for new playlists at the front of the playlist grid"""
+        if not self.showing_all_playlists:
+            return
+        if not self.playlist_cards:
+            # Replace the empty-library message
+            self.load_playlists()
+            return
+        existing = self.playlist_cards
+        self.playlist_cards = {}
+        for playlist_id in playlist_ids:
+            if playlist_id in existing:
+                continue
+            playlist = self.db.get_playlist_by_id(playlist_id)
+            if playlist:
+                self.create_playlist_card(self.main_content_frame, playlist, 0, 0)
+        self.playlist_cards.update(existing)
+        self.regrid_playlist_cards()
+    
+    def remove_playlists(self, playlist_ids):
+        """Drop the cards and close the windows of deleted playlists"""
+        for playlist_id in playlist_ids:
+            entry = self.playlist_cards.pop(playlist_id, None)
+            if entry:
+                entry['card'].destroy()
+            for view in list(self.playlist_views.pop(playlist_id, [])):
+                view['window'].destroy()
+        self.regrid_playlist_cards()
+    
+    def refresh_playlists(self, playlist_ids, to_front=False):
+        """Update the names and counts shown for changed playlists
+        
+        With to_front, their cards move to the front of the playlist grid,
+        which is ordered by modification date.
+        """
+        # A playlist changed while its page is still to be built may have
+        # moved ahead of the page key, so put its card up now
+        if self.showing_all_playlists and self.playlist_page_key is not None:
+            unseen = [playlist_id for playlist_id in playlist_ids
+                      if playlist_id not in self.playlist_cards]
+            if unseen:
+                self.add_playlist_cards(unseen)
+        
+        moved = {}
+        for playlist_id in playlist_ids:
+            entry = self.playlist_cards.get(playlist_id)
+            views = self.playlist_views.get(playlist_id, [])
+            if not entry and not views:
+                continue
+            playlist = self.db.get_playlist_by_id(playlist_id)
+            if not playlist:
+                continue
+            if entry:
+                entry['name'].config(text=playlist['name'])
+                entry['count'].config(text=f"{playlist['song_count']} songs")
+                if to_front and self.showing_all_playlists:
+                    moved[playlist_id] = self.playlist_cards.pop(playlist_id)
+            for view in views:
+                view['window'].title(f"P.R.I.S.M - {playlist['name']}")
+                view['title'].config(text=playlist['name'])
+                view['count'].config(
+                    text=f"{playlist['song_count']} songs  •  {self.format_duration(playlist['total_duration_ms'])}")
+                view['dates'].config(
+                    text=f"Created: {self.format_date(playlist.get('created_date', ''))}  •  "
+                         f"Modified: {self.format_date(playlist.get('modified_date', ''))}")
+        if moved:
+            moved.update(self.playlist_cards)
+            self.playlist_cards = moved
+            self.regrid_playlist_cards()
+    
+    def remove_song_rows(self, event):
+        """Delete the rows of removed or deleted songs from open song lists"""
+        song_ids = set(event.song_ids)
+        
+        def prune(tree):
+            doomed = [item for item in tree.get_children()
+                      if int(tree.item(item)['tags'][0]) in song_ids]
+            if doomed:
+                tree.delete(*doomed)
+        
+        for playlist_id in event.playlist_ids:
+            for view in self.playlist_views.get(playlist_id, []):
+                prune(view['tree'])
+                self.pack_playlist_view(view)
+        if event.kind == events.SONGS_DELETED and self.songs_tree is not None:
+            prune(self.songs_tree)
+            self.songs_count_label.config(text=f"Total: {self.db.count_songs()} songs")
+    
+    def reorder_playlist_view(self, playlist_id, view):
+        """Put a playlist window's rows back in the playlist's order"""
+        tree = view['tree']
+        items = {int(tree.item(item)['tags'][0]): item for item in tree.get_children()}
+        index = 0
+        for song in self.db.iter_playlist_songs(playlist_id):
+            item = items.get(song['song_id'])
+            if item:
+                tree.move(item, '', index)
+                index += 1
+    
+    def update_song_rows(self, event):
+        """Show created and edited songs in All Songs and edited ones in playlist windows"""
+        if not self.showing_all_songs and (event.kind == events.SONGS_CREATED
+                                           or not self.playlist_views):
+            return
+        songs = [song for song in map(self.db.get_song_by_id, event.song_ids) if song]
+        if event.kind == events.SONGS_UPDATED:
+            by_id = {song['song_id']: song for song in songs}
+            for views in self.playlist_views.values():
+                for view in views:
+                    tree = view['tree']
+                    for item in tree.get_children():
+                        song = by_id.get(int(tree.item(item)['tags'][0]))
+                        if song:
+                            added = tree.item(item)['values'][4]
+                            tree.item(item, values=(song['song_id'], song['title'], song['artist'],
+                                                    song['duration'], added))
+        
+        if self.songs_tree is None:
+            if self.showing_all_songs and event.kind == events.SONGS_CREATED:
+                # Replace the empty-library message
                 self.show_all_songs_view()
-            else:
-                messagebox.showerror("Error", "Failed to delete song")
+            return
+        tree = self.songs_tree
+        if not self.songs_pager['browsing']:
+            # Search results: edit matching rows, leave the result set alone
+            if event.kind == events.SONGS_UPDATED:
+                rows = {int(tree.item(item)['tags'][0]): item for item in tree.get_children()}
+                for song in songs:
+                    if song['song_id'] in rows:
+                        tree.item(rows[song['song_id']], values=self.song_row_values(song))
+            return
+        
+        # Browsing by title: put each song where the next page would have,
+        # or leave it for that page if it sorts past what is loaded
+        changed = {song['song_id'] for song in songs}
+        stale = [item for item in tree.get_children()
+                 if int(tree.item(item)['tags'][0]) in changed]
+        if stale:
+            tree.delete(*stale)
+        items = list(tree.get_children())
+        keys = [(nocase(str(tree.item(item)['values'][1])), int(tree.item(item)['tags'][0]))
+                for item in items]
+        next_key = self.songs_pager['next_key']
+        limit = (nocase(next_key[0]), next_key[1]) if next_key else None
+        for song in songs:
+            key = (nocase(song['title']), song['song_id'])
+            if limit is not None and key > limit:
+                continue
+            index = bisect.bisect(keys, key)
+            keys.insert(index, key)
+            items.insert(index, tree.insert('', index, values=self.song_row_values(song),
+                                            tags=(song['song_id'],)))
+        if event.kind == events.SONGS_CREATED:
+            self.songs_count_label.config(text=f"Total: {self.db.count_songs()} songs")
+    
+    def song_row_values(self, song):
+        """Column values of a song's row in All Songs"""
+        return (song['song_id'], song['title'], song['artist'], song['duration'],
+                self.format_date(song.get('created_date', '')))
     
     def show_playlist_menu(self, event, playlist_id):
         """Show context menu for playlist"""
         menu = tk.Menu(self.root, tearoff=0)
         menu.add_command(label="Open", command=lambda: self.open_playlist(playlist_id))
         menu.add_command(label="Rename", command=lambda: self.rename_playlist(playlist_id))
+        menu.add_command(label="Export...", command=lambda: self.export_dialog(playlist_id))
         menu.add_separator()
         menu.add_command(label="Delete", command=lambda: self.delete_playlist(playlist_id))
         menu.post(event.x_root, event.y_root)
@@ -802,12 +1326,12 @@ class PRISMApp:
         if not playlist:
             return
         
+        from tkinter import simpledialog
         new_name = simpledialog.askstring("Rename Playlist", "Enter new name:",
                                          initialvalue=playlist['name'])
         if new_name and new_name.strip():
             if self.db.update_playlist(playlist_id, name=new_name.strip()):
                 messagebox.showinfo("Success", "Playlist renamed successfully!")
-                self.load_playlists()
             else:
                 messagebox.showerror("Error", "Failed to rename playlist")
     
@@ -816,12 +1340,13 @@ class PRISMApp:
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this playlist?"):
             if self.db.delete_playlist(playlist_id):
                 messagebox.showinfo("Success", "Playlist deleted successfully!")
-                self.load_playlists()
             else:
                 messagebox.showerror("Error", "Failed to delete playlist")
     
     def on_search(self, *args):
         """Handle search input"""
+        if self.db is None:
+            return
         query = self.search_var.get()
         if query and query != "Search playlists...":
             playlists = self.db.search_playlists(query)
@@ -831,8 +1356,7 @@ class PRISMApp:
     
     def display_search_results(self, playlists):
         """Display search results"""
-        for widget in self.main_content_frame.winfo_children():
-            widget.destroy()
+        self.clear_main_content()
         
         if not playlists:
             no_results = tk.Label(self.main_content_frame, text="No playlists found",
@@ -857,11 +1381,9 @@ class PRISMApp:
         self.content_title.config(text="Recent Activity")
         self.content_subtitle.config(text="Recently updated playlists")
         
-        for widget in self.main_content_frame.winfo_children():
-            widget.destroy()
+        self.clear_main_content()
         
-        playlists = self.db.get_all_playlists()
-        recent = playlists[:6]
+        recent, _ = self.db.get_playlists_page(page_size=6)
         
         if not recent:
             no_data = tk.Label(self.main_content_frame, text="No recent activity",
@@ -875,6 +1397,99 @@ class PRISMApp:
             col = idx % 3
             self.create_playlist_card(self.main_content_frame, playlist, row, col)
     
+    def scan_folder_dialog(self):
+        """Import audio files from a folder without blocking the window"""
+        from tkinter import filedialog
+        from scanner import LibraryScanner
+        folder = filedialog.askdirectory(title="Scan Folder", mustexist=True)
+        if not folder:
+            return
+        
+        self.content_subtitle.config(text=f"Scanning {folder}...")
+        result = {}
+        worker = threading.Thread(target=lambda: result.update(LibraryScanner(self.db).scan([folder])),
+                                  daemon=True)
+        worker.start()
+        
+        # Tk must only be touched from this thread, so poll for completion
+        def check_done():
+            if worker.is_alive():
+                self.root.after(200, check_done)
+                return
+            self.show_all_playlists()
+            if not result:
+                messagebox.showerror("Error", "Folder scan failed")
+                return
+            messagebox.showinfo("Scan Complete",
+                                f"{result['files']} audio files found\n"
+                                f"{result['added']} added, {result['updated']} updated, "
+                                f"{result['removed']} removed")
+        
+        check_done()
+    
+    def import_playlist_dialog(self):
+        """Create a playlist from an M3U, JSON Lines or CSV file"""
+        from tkinter import filedialog
+        import playlist_io
+        path = filedialog.askopenfilename(
+            title="Import Playlist",
+            filetypes=[("Playlists", "*.m3u *.m3u8 *.jsonl *.ndjson *.csv"), ("All files", "*")])
+        if not path:
+            return
+        try:
+            result = playlist_io.import_playlist(self.db, path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Failed to import playlist:\n{e}")
+            return
+        if result['playlist_id'] is None:
+            messagebox.showerror("Error", "Failed to create playlist. Name might already exist.")
+            return
+        messagebox.showinfo("Import Complete",
+                            f"{result['added']} of {result['songs']} songs imported")
+    
+    def export_dialog(self, playlist_id):
+        """Export a playlist, or the whole library when playlist_id is None"""
+        from tkinter import filedialog
+        import playlist_io
+        path = filedialog.asksaveasfilename(
+            title="Export Library" if playlist_id is None else "Export Playlist",
+            defaultextension=".m3u8",
+            filetypes=[("M3U playlist", "*.m3u8 *.m3u"), ("JSON Lines", "*.jsonl"),
+                       ("CSV", "*.csv")])
+        if not path:
+            return
+        try:
+            if playlist_id is None:
+                count = playlist_io.export_library(self.db, path)
+            else:
+                count = playlist_io.export_playlist(self.db, playlist_id, path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Failed to export:\n{e}")
+            return
+        messagebox.showinfo("Export Complete", f"{count} songs exported")
+    
+    def backup_dialog(self):
+        """Snapshot the database into a folder while the app keeps running"""
+        from tkinter import filedialog
+        folder = filedialog.askdirectory(title="Back Up To")
+        if not folder:
+            return
+        
+        job = self.db.start_backup(folder, compress=True, throttle=0.005)
+        
+        def check_done():
+            if not job.done:
+                self.content_subtitle.config(text=f"Backing up... {job.progress:.0%}")
+                self.root.after(200, check_done)
+                return
+            self.content_subtitle.config(text="Organize and explore your sonic collections")
+            if job.path:
+                messagebox.showinfo("Backup Complete", f"Backup saved to:\n{job.path}")
+            else:
+                messagebox.showerror("Error", "Backup failed")
+        
+        check_done()
+    
     def show_about(self):
         """Show about dialog"""
         about_window = tk.Toplevel(self.root)
@@ -3,21 +3,46 @@ P.R.I.S.M - Playlist Repository & Index for Sonic Media
 Main Application Entry Point
 """
 
+import time
+
+# Reference point for --startup-profile, taken before anything heavy loads
+LAUNCHED = time.perf_counter()
+
+import argparse
+import logging
+import threading
 import tkinter as tk
-from tkinter import messagebox
 import sys
-from database import Database
-from gui import PRISMApp
+
+# The database, cache and GUI modules are imported once the window is on
+# screen, and the scanner and server by the commands that run them, so
+# none of them delay the first paint
+
+
+class StartupProfile:
+    """Timestamps of the startup milestones, in milliseconds since launch"""
+    
+    def __init__(self):
+        self.marks = {}
+    
+    def mark(self, name: str):
+        """Record that a milestone has been reached (from any thread)"""
+        self.marks[name] = (time.perf_counter() - LAUNCHED) * 1000
+    
+    def report(self):
+        print("Startup profile (ms since launch):")
+        for name, elapsed in self.marks.items():
+            print(f"  {name:<20} {elapsed:8.1f}")
 
 
 def initialize_database():
     """Initialize the database and populate with sample data if empty"""
+    from database import Database
+    from cache import CachedDatabase
     try:
-        db = Database("prism.db")
-        
-        playlists = db.get_all_playlists()
+        db = Database("prism.db", row_format="record")
         
-        if not playlists:
+        if not db.has_playlists():
             print("Database is empty. Adding sample data...")
             
             # Create sample playlists
@@ -66,38 +91,23 @@ def initialize_database():
                 ("Thunder", "Imagine Dragons", "3:07")
             ]
             
-            song_ids = []
-            for title, artist, duration in sample_songs:
-                song_id = db.create_song(title, artist, duration)
-                if song_id:
-                    song_ids.append(song_id)
-                    print(f"Created song: {title} by {artist}")
+            result = db.create_songs_bulk(sample_songs)
+            song_ids = [song_id for song_id in result['ids'] if song_id]
+            print(f"Created {len(song_ids)} songs")
             
             # Add songs to playlists
             if playlist_ids and song_ids:
-                # Late Night Vibes
-                for i in range(0, 4):
-                    db.add_song_to_playlist(playlist_ids[0], song_ids[i])
-                
-                # Morning Energy
-                for i in range(7, 10):
-                    db.add_song_to_playlist(playlist_ids[1], song_ids[i])
-                
-                # Focus Flow
-                for i in range(16, 20):
-                    db.add_song_to_playlist(playlist_ids[2], song_ids[i])
-                
-                # Weekend Mood
-                for i in range(4, 8):
-                    db.add_song_to_playlist(playlist_ids[3], song_ids[i])
-                
-                # Chill Sundays
-                for i in range(10, 13):
-                    db.add_song_to_playlist(playlist_ids[4], song_ids[i])
-                
-                # Workout Beast
-                for i in range(20, 25):
-                    db.add_song_to_playlist(playlist_ids[5], song_ids[i])
+                playlist_ranges = [
+                    (0, range(0, 4)),      # Late Night Vibes
+                    (1, range(7, 10)),     # Morning Energy
+                    (2, range(16, 20)),    # Focus Flow
+                    (3, range(4, 8)),      # Weekend Mood
+                    (4, range(10, 13)),    # Chill Sundays
+                    (5, range(20, 25))     # Workout Beast
+                ]
+                memberships = [(playlist_ids[p], song_ids[i])
+                               for p, songs in playlist_ranges for i in songs]
+                db.add_songs_to_playlist_bulk(memberships)
                 
                 print("Sample songs added to playlists")
             
@@ -107,50 +117,184 @@ def initialize_database():
             
             print("Sample data initialization complete!")
         
-        return db
+        # The GUI re-reads the same rows after every change
+        return CachedDatabase(db)
     
     except Exception as e:
         print(f"Error initializing database: {e}")
-        messagebox.showerror("Database Error",
-                           f"Failed to initialize database:\n{str(e)}")
         return None
 
 
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="P.R.I.S.M - Playlist Repository & Index for Sonic Media")
+    parser.add_argument("--rebuild-aggregates", action="store_true",
+                        help="recompute stored playlist song counts and durations, then exit")
+    parser.add_argument("--scan", nargs="+", metavar="FOLDER",
+                        help="import audio files from these folders into prism.db, then exit")
+    parser.add_argument("--backup", metavar="FOLDER",
+                        help="write a compressed snapshot of prism.db into FOLDER, keeping "
+                             "the newest 5, then exit")
+    parser.add_argument("--serve", nargs="?", const="127.0.0.1:8080", metavar="[HOST:]PORT",
+                        help="serve prism.db as an HTTP/JSON API instead of starting the GUI "
+                             "(default: 127.0.0.1:8080)")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="print how long the GUI took to first paint and to become "
+                             "interactive")
+    parser.add_argument("--log-level", default="INFO",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="minimum level of database diagnostics to print (default: INFO)")
+    return parser.parse_args()
+
+
+def rebuild_aggregates():
+    """Recompute playlist aggregates in prism.db without starting the GUI"""
+    from database import Database
+    db = Database("prism.db")
+    ok = db.rebuild_playlist_aggregates()
+    db.close()
+    print("Playlist aggregates rebuilt" if ok else "Failed to rebuild playlist aggregates")
+    return ok
+
+
+def scan_library(folders):
+    """Scan media folders into prism.db without starting the GUI"""
+    from database import Database
+    from scanner import LibraryScanner
+    db = Database("prism.db")
+    stats = LibraryScanner(db).scan(folders)
+    db.close()
+    print(f"Scanned {stats['files']} files: {stats['added']} added, "
+          f"{stats['updated']} updated, {stats['unchanged']} unchanged, "
+          f"{stats['removed']} removed, {stats['failed']} unreadable")
+    return True
+
+
+def backup_database(folder):
+    """Snapshot prism.db into a rotated backup folder without starting the GUI"""
+    from database import Database
+    db = Database("prism.db")
+    path = db.start_backup(folder, compress=True).wait()
+    db.close()
+    print(f"Backed up to {path}" if path else "Backup failed")
+    return path is not None
+
+
+def serve_api(address):
+    """Serve prism.db over HTTP until interrupted, without starting the GUI"""
+    from database import Database
+    from server import serve
+    host, _, port = address.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        print(f"Invalid port: {address}")
+        return False
+    # Every request gets its own thread, so allow more pooled readers than the GUI uses
+    db = Database("prism.db", max_readers=8)
+    print(f"Serving prism.db on http://{host or '127.0.0.1'}:{port} (Ctrl+C to stop)")
+    serve(db, host or "127.0.0.1", port)
+    db.close()
+    return True
+
+
 def main():
     """Main application entry point"""
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level),
+                        format="%(levelname)s %(name)s: %(message)s")
+    if args.rebuild_aggregates:
+        sys.exit(0 if rebuild_aggregates() else 1)
+    if args.backup:
+        sys.exit(0 if backup_database(args.backup) else 1)
+    if args.scan:
+        sys.exit(0 if scan_library(args.scan) else 1)
+    if args.serve:
+        sys.exit(0 if serve_api(args.serve) else 1)
+    
     print("=" * 60)
     print("P.R.I.S.M - Playlist Repository & Index for Sonic Media")
     print("=" * 60)
     print()
     
-    # Initialize database
+    profile = StartupProfile()
+    profile.mark("imports")
+    
+    # Put a window on screen before anything heavy is imported
+    print("Launching GUI...")
+    root = tk.Tk()
+    root.title("P.R.I.S.M - Playlist Repository & Index for Sonic Media")
+    root.geometry("1200x700")
+    root.configure(bg='#0f172a')
+    root.update()
+    profile.mark("first paint")
+    
+    # Importing, opening, migrating and seeding the database runs off the
+    # Tk thread while the window shell is built
     print("Initializing database...")
-    db = initialize_database()
+    state = {'db': None, 'failed': False, 'maintenance': None}
     
-    if not db:
-        print("Failed to initialize database. Exiting...")
-        sys.exit(1)
+    def open_database():
+        state['db'] = initialize_database()
+        profile.mark("database ready")
     
-    print("Database initialized successfully!")
-    print()
+    opener = threading.Thread(target=open_database, name="prism-open", daemon=True)
+    opener.start()
     
-    # Create main window
-    print("Launching GUI...")
-    root = tk.Tk()
+    from gui import PRISMApp
+    from tkinter import messagebox
+    app = PRISMApp(root)
+    root.update_idletasks()
+    profile.mark("window shell")
     
-    # Initialize the application
-    app = PRISMApp(root, db)
+    def check_opened():
+        """Attach the database once it is open (Tk must only be touched here)"""
+        if opener.is_alive():
+            root.after(10, check_opened)
+            return
+        db = state['db']
+        if not db:
+            state['failed'] = True
+            print("Failed to initialize database. Exiting...")
+            messagebox.showerror("Database Error", "Failed to initialize database")
+            root.destroy()
+            return
+        
+        print("Database initialized successfully!")
+        app.attach(db)
+        root.update_idletasks()
+        profile.mark("interactive")
+        
+        print("Application launched successfully!")
+        print("=" * 60)
+        print()
+        if args.startup_profile:
+            profile.report()
+        
+        # Fold old play events into the rollups, refresh the top-song
+        # rankings and re-match smart playlists whose rules depend on the
+        # date; nothing on screen waits for it
+        def maintain():
+            db.compact_play_history()
+            db.refresh_smart_playlists(time_rules_only=True)
+        
+        state['maintenance'] = threading.Thread(target=maintain, name="prism-maintenance",
+                                                daemon=True)
+        state['maintenance'].start()
     
-    print("Application launched successfully!")
-    print("=" * 60)
-    print()
+    check_opened()
     
     # Handle window close event
     def on_closing():
         """Handle application closing"""
         if messagebox.askokcancel("Quit", "Do you want to quit P.R.I.S.M?"):
-            print("Closing database connection...")
-            db.close()
+            opener.join()
+            if state['maintenance'] is not None:
+                state['maintenance'].join()
+            if state['db']:
+                print("Closing database connection...")
+                state['db'].close()
             print("Goodbye!")
             root.destroy()
     
@@ -158,6 +302,9 @@ def main():
     
     # Start the GUI event loop
     root.mainloop()
+    
+    if state['failed']:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -168,5 +315,6 @@ if __name__ == "__main__":
         sys.exit(0)
     except Exception as e:
         print(f"\n\nUnexpected error: {e}")
+        from tkinter import messagebox
         messagebox.showerror("Error", f"An unexpected error occurred:\n{str(e)}")
         sys.exit(1)
@@ -0,0 +1,207 @@
+"""
+Query instrumentation for the P.R.I.S.M database
+
+QueryMetrics collects call counts, rows and latency histograms per Database
+method and per SQL statement, and logs statements slower than a threshold
+together with their query plan. snapshot() returns everything as plain
+dicts with p50/p95/p99 latencies in milliseconds.
+"""
+
+import functools
+import inspect
+import logging
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Placeholder lists of any length, as built for chunked IN (...) queries
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_template(sql: str) -> str:
+    """One key per statement: whitespace collapsed, placeholder lists of any length alike"""
+    return _PLACEHOLDER_LIST.sub('?, ...', ' '.join(sql.split()))
+
+
+class LatencyHistogram:
+    """Log-scale latency histogram with quarter-octave buckets
+    
+    Buckets run from 1 µs to about 2 minutes. Percentiles are read back as
+    the upper edge of the bucket they fall in, so they overstate the true
+    value by at most ~19%.
+    """
+    
+    BOUNDS_US = [2 ** (i / 4) for i in range(4 * 27)]
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_US) + 1)
+        self.count = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, seconds: float, rows: int = 0):
+        """Record one call"""
+        self.counts[bisect_left(self.BOUNDS_US, seconds * 1e6)] += 1
+        self.count += 1
+        self.rows += rows
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def percentile(self, p: float) -> float:
+        """Latency in milliseconds below which p percent of calls fall"""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == len(self.BOUNDS_US):
+                    return self.max * 1000
+                return min(self.BOUNDS_US[index] / 1000, self.max * 1000)
+        return self.max * 1000
+    
+    def summary(self) -> Dict:
+        """Counts and latencies as a plain dict"""
+        return {
+            'count': self.count,
+            'rows': self.rows,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max * 1000
+        }
+
+
+class QueryMetrics:
+    """Thread-safe latency statistics for Database methods and SQL statements
+    
+    Statements taking longer than slow_query_ms are logged at WARNING with
+    their parameters and EXPLAIN QUERY PLAN output; None disables the
+    slow-query log.
+    """
+    
+    def __init__(self, slow_query_ms: Optional[float] = 100.0):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._methods = {}
+        self._statements = {}
+        self.slow_queries = 0
+    
+    def record_method(self, name: str, seconds: float, rows: int = 0):
+        """Record one call of a Database method"""
+        with self._lock:
+            histogram = self._methods.get(name)
+            if histogram is None:
+                histogram = self._methods[name] = LatencyHistogram()
+            histogram.add(seconds, rows)
+    
+    def record_statement(self, sql: str, seconds: float, rows: int = 0,
+                         conn: Optional[sqlite3.Connection] = None, params=None):
+        """Record one execution of a statement, logging it if it was slow
+        
+        conn and params are only used to explain slow statements; pass no
+        params for statements run with executemany.
+        """
+        with self._lock:
+            key = statement_template(sql)
+            histogram = self._statements.get(key)
+            if histogram is None:
+                histogram = self._statements[key] = LatencyHistogram()
+            histogram.add(seconds, rows)
+            slow = self.slow_query_ms is not None and seconds * 1000 >= self.slow_query_ms
+            if slow:
+                self.slow_queries += 1
+        if slow:
+            self._log_slow(' '.join(sql.split()), seconds, conn, params)
+    
+    def _log_slow(self, sql: str, seconds: float, conn, params):
+        plan = "(not available)"
+        if conn is not None and params is not None:
+            try:
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+                plan = '; '.join(row[3] for row in rows) or plan
+            except sqlite3.Error:
+                pass
+        logger.warning("Slow query (%.1f ms): %s | params=%r | plan: %s",
+                       seconds * 1000, sql, params, plan)
+    
+    def snapshot(self) -> Dict:
+        """Return current statistics as plain dicts"""
+        with self._lock:
+            return {
+                'methods': {name: h.summary() for name, h in self._methods.items()},
+                'statements': {sql: h.summary() for sql, h in self._statements.items()},
+                'slow_queries': self.slow_queries,
+                'slow_query_ms': self.slow_query_ms
+            }
+    
+    def reset(self):
+        """Discard all collected statistics"""
+        with self._lock:
+            self._methods.clear()
+            self._statements.clear()
+            self.slow_queries = 0
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports the latency of every statement it runs"""
+    
+    metrics = None
+    
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_statement(sql, time.perf_counter() - start,
+                                              max(self.rowcount, 0), self.connection, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_statement(sql, time.perf_counter() - start,
+                                              max(self.rowcount, 0))
+
+
+def instrumented(cls):
+    """Class decorator timing every public method into self.metrics
+    
+    Generators and names listed in cls.UNTIMED are left alone, since only
+    their creation could be timed. A list result counts as rows returned.
+    """
+    untimed = set(getattr(cls, 'UNTIMED', ()))
+    for name, method in list(vars(cls).items()):
+        if (name.startswith('_') or name in untimed or not inspect.isfunction(method)
+                or inspect.isgeneratorfunction(method)):
+            continue
+        setattr(cls, name, _timed(name, method))
+    return cls
+
+
+def _timed(name: str, method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        finally:
+            self.metrics.record_method(name, time.perf_counter() - start,
+                                       len(result) if isinstance(result, list) else 0)
+    return wrapper
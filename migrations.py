@@ -0,0 +1,468 @@
+"""
+Versioned schema migrations for the P.R.I.S.M database
+
+The schema version is stored in PRAGMA user_version. Each migration moves
+the schema forward by exactly one version and runs in its own transaction,
+so an existing prism.db is upgraded in place and an interrupted upgrade
+resumes where it stopped.
+"""
+
+import logging
+import re
+import sqlite3
+import unicodedata
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# (table, key column, indexed columns) for full-text search
+SEARCH_INDEXES = [
+    ('songs', 'song_id', ('title', 'artist')),
+    ('playlists', 'playlist_id', ('name', 'description'))
+]
+
+# Distance between neighbouring playlist positions after respacing, leaving
+# room to insert or move songs between them without renumbering
+POSITION_GAP = 1024
+
+# (table, bucket column, SQL bucketing a timestamp) for play-count rollups
+PLAY_ROLLUPS = [
+    ('play_counts_hourly', 'hour', "strftime('%Y-%m-%d %H:00:00', {})"),
+    ('play_counts_daily', 'day', "date({})")
+]
+
+
+def get_version(conn) -> int:
+    """Return the schema version recorded in the database file"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def fts5_available(cursor) -> bool:
+    """Check whether this SQLite build ships the FTS5 extension"""
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        cursor.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def add_secondary_indexes(cursor):
+    """Index the columns used for playlist order, history and title sorting"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_playlist_songs_position
+        ON playlist_songs(playlist_id, position)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_playlist_songs_song
+        ON playlist_songs(song_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recently_played_date
+        ON recently_played(played_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_songs_title
+        ON songs(title COLLATE NOCASE)
+    ''')
+
+
+def add_search_index(cursor):
+    """Create the FTS5 search tables and the triggers that keep them in sync
+    
+    Skipped when this SQLite build lacks FTS5; search then falls back to
+    LIKE scans.
+    """
+    if not fts5_available(cursor):
+        logger.warning("FTS5 not available, search will use table scans")
+        return
+    
+    for table, key, columns in SEARCH_INDEXES:
+        fts = f"{table}_fts"
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,))
+        exists = cursor.fetchone() is not None
+        
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f"new.{c}" for c in columns)
+        old_values = ', '.join(f"old.{c}" for c in columns)
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {column_list}, content='{table}', content_rowid='{key}',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.{key}, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list})
+                VALUES ('delete', old.{key}, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list})
+                VALUES ('delete', old.{key}, {old_values});
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.{key}, {new_values});
+            END
+        ''')
+        
+        # Index rows that existed before the search tables did
+        if not exists:
+            cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+# "M:SS", "MM:SS" or "H:MM:SS"
+DURATION_PATTERN = re.compile(r'^(?:(\d+):)?(\d+):([0-5]\d)$')
+
+
+def parse_duration(text) -> Optional[int]:
+    """Parse an "M:SS" or "H:MM:SS" duration into milliseconds, or None if invalid"""
+    match = DURATION_PATTERN.match(str(text or '').strip())
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    if hours is not None and int(minutes) > 59:
+        return None
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000
+
+
+def song_fingerprint(title: str, artist: str) -> str:
+    """Identity key for duplicate detection: title and artist folded for
+    case, whitespace and diacritics"""
+    def fold(text):
+        decomposed = unicodedata.normalize('NFKD', text or '')
+        stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+        return ' '.join(stripped.casefold().split())
+    return f"{fold(title)}\x1f{fold(artist)}"
+
+
+def duration_ms_sql(column: str) -> str:
+    """SQL expression converting an "M:SS" duration column to milliseconds"""
+    return f'''
+        (CASE WHEN instr({column}, ':') > 0
+              THEN (CAST(substr({column}, 1, instr({column}, ':') - 1) AS INTEGER) * 60
+                    + CAST(substr({column}, instr({column}, ':') + 1) AS INTEGER)) * 1000
+              ELSE 0 END)
+    '''
+
+
+def rebuild_playlist_aggregates(cursor, playlist_id: int = None,
+                                song_duration: str = "s.duration_ms"):
+    """Recompute stored song counts and total durations from playlist_songs
+    
+    song_duration is the SQL for a song's length in milliseconds; the
+    default reads the duration_ms column added in version 7.
+    """
+    where = "WHERE playlist_id = ?" if playlist_id is not None else ""
+    cursor.execute(f'''
+        UPDATE playlists SET
+            song_count = (SELECT COUNT(*) FROM playlist_songs ps
+                          WHERE ps.playlist_id = playlists.playlist_id),
+            total_duration_ms = (SELECT COALESCE(SUM({song_duration}), 0)
+                                 FROM playlist_songs ps
+                                 JOIN songs s ON s.song_id = ps.song_id
+                                 WHERE ps.playlist_id = playlists.playlist_id)
+        {where}
+    ''', () if playlist_id is None else (playlist_id,))
+
+
+def add_playlist_aggregates(cursor):
+    """Store song_count and total_duration_ms on playlists, maintained by triggers"""
+    cursor.execute("ALTER TABLE playlists ADD COLUMN song_count INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE playlists ADD COLUMN total_duration_ms INTEGER NOT NULL DEFAULT 0")
+    
+    song_duration = f"(SELECT {duration_ms_sql('duration')} FROM songs WHERE song_id = {{}}.song_id)"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS playlist_songs_aggregate_ai AFTER INSERT ON playlist_songs BEGIN
+            UPDATE playlists SET
+                song_count = song_count + 1,
+                total_duration_ms = total_duration_ms + COALESCE({song_duration.format('new')}, 0)
+            WHERE playlist_id = new.playlist_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS playlist_songs_aggregate_ad AFTER DELETE ON playlist_songs BEGIN
+            UPDATE playlists SET
+                song_count = song_count - 1,
+                total_duration_ms = total_duration_ms - COALESCE({song_duration.format('old')}, 0)
+            WHERE playlist_id = old.playlist_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_duration_au AFTER UPDATE OF duration ON songs BEGIN
+            UPDATE playlists SET
+                total_duration_ms = total_duration_ms
+                    - {duration_ms_sql('old.duration')} + {duration_ms_sql('new.duration')}
+            WHERE playlist_id IN (SELECT playlist_id FROM playlist_songs
+                                  WHERE song_id = new.song_id);
+        END
+    ''')
+    # Foreign key cascades run after the song row is gone, when its duration
+    # can no longer be read, so detach the song from its playlists first
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS songs_detach_bd BEFORE DELETE ON songs BEGIN
+            DELETE FROM playlist_songs WHERE song_id = old.song_id;
+        END
+    ''')
+    
+    rebuild_playlist_aggregates(cursor, song_duration=duration_ms_sql('s.duration'))
+
+
+def add_listing_indexes(cursor):
+    """Index every sort order offered by the paged listings"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_songs_artist
+        ON songs(artist COLLATE NOCASE)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_playlists_modified
+        ON playlists(modified_date)
+    ''')
+    # song_id breaks ties between equal positions so playlist pages can seek
+    cursor.execute("DROP INDEX IF EXISTS idx_playlist_songs_position")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_playlist_songs_position
+        ON playlist_songs(playlist_id, position, song_id)
+    ''')
+
+
+def respace_playlist_positions(cursor, playlist_id: int = None):
+    """Renumber playlist positions to multiples of POSITION_GAP, keeping their order"""
+    where = "WHERE playlist_id = ?" if playlist_id is not None else ""
+    cursor.execute(f'''
+        UPDATE playlist_songs SET position = ranked.rank * {POSITION_GAP}
+        FROM (SELECT ps_id, ROW_NUMBER() OVER (
+                  PARTITION BY playlist_id ORDER BY position, song_id) AS rank
+              FROM playlist_songs {where}) AS ranked
+        WHERE playlist_songs.ps_id = ranked.ps_id
+    ''', () if playlist_id is None else (playlist_id,))
+
+
+def add_sparse_positions(cursor):
+    """Spread existing playlist positions POSITION_GAP apart"""
+    respace_playlist_positions(cursor)
+
+
+def add_play_rollups(cursor):
+    """Roll play events up into per-song totals and hourly/daily counts
+    
+    Triggers keep the rollups current on every play, so raw
+    recently_played rows are only needed for the retention window and
+    can be compacted away afterwards.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS song_play_stats (
+            song_id INTEGER PRIMARY KEY,
+            play_count INTEGER NOT NULL DEFAULT 0,
+            last_played TIMESTAMP NOT NULL,
+            FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_song_play_stats_last
+        ON song_play_stats(last_played)
+    ''')
+    for table, bucket, expression in PLAY_ROLLUPS:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                song_id INTEGER NOT NULL,
+                {bucket} TEXT NOT NULL,
+                plays INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (song_id, {bucket}),
+                FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table}_{bucket} ON {table}({bucket})
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS top_played (
+            period TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            plays INTEGER NOT NULL,
+            PRIMARY KEY (period, rank),
+            FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    
+    rollup_upserts = ''.join(f'''
+            INSERT INTO {table} (song_id, {bucket}, plays)
+            VALUES (new.song_id, {expression.format('new.played_date')}, 1)
+            ON CONFLICT (song_id, {bucket}) DO UPDATE SET plays = plays + 1;'''
+        for table, bucket, expression in PLAY_ROLLUPS)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS recently_played_rollup_ai AFTER INSERT ON recently_played BEGIN
+            INSERT INTO song_play_stats (song_id, play_count, last_played)
+            VALUES (new.song_id, 1, new.played_date)
+            ON CONFLICT (song_id) DO UPDATE SET
+                play_count = play_count + 1,
+                last_played = MAX(last_played, excluded.last_played);{rollup_upserts}
+        END
+    ''')
+    
+    # Backfill from the history recorded so far
+    cursor.execute('''
+        INSERT INTO song_play_stats (song_id, play_count, last_played)
+        SELECT song_id, COUNT(*), MAX(played_date) FROM recently_played GROUP BY song_id
+    ''')
+    for table, bucket, expression in PLAY_ROLLUPS:
+        cursor.execute(f'''
+            INSERT INTO {table} (song_id, {bucket}, plays)
+            SELECT song_id, {expression.format('played_date')}, COUNT(*)
+            FROM recently_played GROUP BY 1, 2
+        ''')
+
+
+def add_duration_ms(cursor):
+    """Store song lengths as integer milliseconds and total playlists from them
+    
+    Durations that cannot be parsed are left NULL and logged; new songs
+    must come with a valid duration_ms.
+    """
+    cursor.execute("ALTER TABLE songs ADD COLUMN duration_ms INTEGER")
+    cursor.execute("SELECT song_id, duration FROM songs")
+    parsed = [(parse_duration(duration), song_id) for song_id, duration in cursor.fetchall()]
+    cursor.executemany("UPDATE songs SET duration_ms = ? WHERE song_id = ?", parsed)
+    invalid = [song_id for duration_ms, song_id in parsed if duration_ms is None]
+    if invalid:
+        logger.warning("%s songs have unparseable durations and no duration_ms "
+                       "(first song ids: %s)", len(invalid), invalid[:20])
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_songs_duration ON songs(duration_ms)
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS songs_duration_valid_bi BEFORE INSERT ON songs
+        WHEN new.duration_ms IS NULL BEGIN
+            SELECT RAISE(ABORT, 'invalid duration');
+        END
+    ''')
+    
+    # Rebuild the aggregate triggers on top of the numeric column
+    for trigger in ('playlist_songs_aggregate_ai', 'playlist_songs_aggregate_ad',
+                    'songs_duration_au'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    song_duration = "(SELECT duration_ms FROM songs WHERE song_id = {}.song_id)"
+    cursor.execute(f'''
+        CREATE TRIGGER playlist_songs_aggregate_ai AFTER INSERT ON playlist_songs BEGIN
+            UPDATE playlists SET
+                song_count = song_count + 1,
+                total_duration_ms = total_duration_ms + COALESCE({song_duration.format('new')}, 0)
+            WHERE playlist_id = new.playlist_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER playlist_songs_aggregate_ad AFTER DELETE ON playlist_songs BEGIN
+            UPDATE playlists SET
+                song_count = song_count - 1,
+                total_duration_ms = total_duration_ms - COALESCE({song_duration.format('old')}, 0)
+            WHERE playlist_id = old.playlist_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER songs_duration_au AFTER UPDATE OF duration_ms ON songs BEGIN
+            UPDATE playlists SET
+                total_duration_ms = total_duration_ms
+                    - COALESCE(old.duration_ms, 0) + COALESCE(new.duration_ms, 0)
+            WHERE playlist_id IN (SELECT playlist_id FROM playlist_songs
+                                  WHERE song_id = new.song_id);
+        END
+    ''')
+    
+    rebuild_playlist_aggregates(cursor)
+
+
+def add_song_fingerprints(cursor):
+    """Fingerprint every song so duplicates can be found through an index"""
+    cursor.execute("ALTER TABLE songs ADD COLUMN fingerprint TEXT")
+    cursor.execute("SELECT song_id, title, artist FROM songs")
+    cursor.executemany("UPDATE songs SET fingerprint = ? WHERE song_id = ?",
+                       [(song_fingerprint(title, artist), song_id)
+                        for song_id, title, artist in cursor.fetchall()])
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_songs_fingerprint ON songs(fingerprint)
+    ''')
+
+
+def add_library_manifest(cursor):
+    """Track scanned media files so re-scans only read what changed
+    
+    song_id becomes NULL when the user deletes the song; the file is then
+    remembered as seen and not imported again until it changes.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS library_files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            song_id INTEGER,
+            scanned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (song_id) REFERENCES songs(song_id) ON DELETE SET NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_library_files_song ON library_files(song_id)
+    ''')
+
+
+def add_file_path_index(cursor):
+    """Index songs by file path so imports can match files without scanning"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_songs_file_path ON songs(file_path)
+    ''')
+
+
+def add_play_history_song_index(cursor):
+    """Index play events by song so cascading song deletes seek instead of scan"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recently_played_song ON recently_played(song_id)
+    ''')
+
+
+def add_smart_playlists(cursor):
+    """Give playlists an optional rules document and index what rules filter on
+    
+    A playlist with rules is a smart playlist (see smart.py); its matching
+    songs are kept in playlist_songs like anyone else's.
+    """
+    cursor.execute("ALTER TABLE playlists ADD COLUMN rules TEXT")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_playlists_smart
+        ON playlists(playlist_id) WHERE rules IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_songs_created ON songs(created_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_song_play_stats_count ON song_play_stats(play_count)
+    ''')
+
+
+# Ordered list of (version, description, upgrade function)
+MIGRATIONS = [
+    (1, "secondary indexes", add_secondary_indexes),
+    (2, "full-text search index", add_search_index),
+    (3, "stored playlist aggregates", add_playlist_aggregates),
+    (4, "listing indexes", add_listing_indexes),
+    (5, "sparse playlist positions", add_sparse_positions),
+    (6, "play history rollups", add_play_rollups),
+    (7, "numeric song durations", add_duration_ms),
+    (8, "song fingerprints", add_song_fingerprints),
+    (9, "media library manifest", add_library_manifest),
+    (10, "song file path index", add_file_path_index),
+    (11, "play history song index", add_play_history_song_index),
+    (12, "smart playlists", add_smart_playlists)
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def pending(conn) -> list:
+    """Return the migrations not yet applied to this database"""
+    version = get_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
@@ -0,0 +1,259 @@
+"""
+Playlist and library import/export for the P.R.I.S.M database
+
+Supported formats are M3U/M3U8 (extended M3U, UTF-8), JSON Lines and CSV.
+Readers turn lines into song dicts and writers turn songs into text, both
+as generators working a chunk at a time, so a whole library streams
+through in constant memory: exports page through the database with the
+keyset iterators, and imports resolve each chunk of rows against the
+songs table with Database.resolve_songs.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from scanner import UNKNOWN_ARTIST, format_duration
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('m3u', 'jsonl', 'csv')
+
+EXTENSIONS = {
+    '.m3u': 'm3u', '.m3u8': 'm3u',
+    '.jsonl': 'jsonl', '.ndjson': 'jsonl',
+    '.csv': 'csv'
+}
+
+# Song fields written by the JSON Lines and CSV exports, in column order
+FIELDS = ('title', 'artist', 'duration', 'file_path')
+
+CHUNK_SIZE = 500
+
+
+def detect_format(path: str) -> str:
+    """Pick the format from a file name's extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f"Unknown playlist format: {path}")
+    return EXTENSIONS[extension]
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _field(song, name: str) -> str:
+    """Read a field from a dict, sqlite3.Row or record row, with '' for NULL"""
+    value = song[name]
+    return '' if value is None else str(value)
+
+
+# Readers
+def read_m3u(lines: Iterable[str], base_dir: Optional[str] = None) -> Iterator[Dict]:
+    """Yield songs from extended or plain M3U lines
+    
+    #EXTINF supplies the duration and "Artist - Title"; entries without it
+    are named after their file. Relative paths are resolved against
+    base_dir when given.
+    """
+    info = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXTINF:'):
+            seconds, _, name = line[8:].partition(',')
+            artist, separator, title = name.partition(' - ')
+            if not separator:
+                artist, title = '', name
+            try:
+                duration = format_duration(max(0, int(float(seconds))) * 1000)
+            except ValueError:
+                duration = format_duration(0)
+            info = {'title': title.strip(), 'artist': artist.strip(), 'duration': duration}
+            continue
+        if line.startswith('#'):
+            continue
+        path = line
+        if base_dir and '://' not in path and not os.path.isabs(path):
+            path = os.path.normpath(os.path.join(base_dir, path))
+        song = info or {'title': '', 'artist': '', 'duration': format_duration(0)}
+        song['title'] = song['title'] or os.path.splitext(os.path.basename(path))[0]
+        song['artist'] = song['artist'] or UNKNOWN_ARTIST
+        song['file_path'] = path
+        yield song
+        info = None
+
+
+def read_jsonl(lines: Iterable[str]) -> Iterator[Dict]:
+    """Yield songs from JSON Lines, one object per line"""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            logger.warning("Skipping line %s: %s", number, e)
+            continue
+        if not isinstance(row, dict):
+            logger.warning("Skipping line %s: not a JSON object", number)
+            continue
+        yield {name: row.get(name) or '' for name in FIELDS}
+
+
+def read_csv(lines: Iterable[str]) -> Iterator[Dict]:
+    """Yield songs from CSV with a header row naming the FIELDS columns"""
+    for row in csv.DictReader(lines):
+        yield {name: (row.get(name) or '').strip() for name in FIELDS}
+
+
+READERS = {'m3u': read_m3u, 'jsonl': read_jsonl, 'csv': read_csv}
+
+
+# Writers
+def write_m3u(songs: Iterable) -> Iterator[str]:
+    """Yield extended M3U text, one chunk of songs at a time
+    
+    Songs without a file fall back to their title as the location, which
+    players skip but a re-import still matches by title and artist.
+    """
+    yield "#EXTM3U\n"
+    for chunk in _chunks(songs, CHUNK_SIZE):
+        yield ''.join(
+            f"#EXTINF:{round((song['duration_ms'] or 0) / 1000)},"
+            f"{_field(song, 'artist')} - {_field(song, 'title')}\n"
+            f"{_field(song, 'file_path') or _field(song, 'title')}\n"
+            for song in chunk)
+
+
+def write_jsonl(songs: Iterable) -> Iterator[str]:
+    """Yield JSON Lines text, one chunk of songs at a time"""
+    for chunk in _chunks(songs, CHUNK_SIZE):
+        yield ''.join(json.dumps({name: _field(song, name) for name in FIELDS},
+                                 ensure_ascii=False) + '\n'
+                      for song in chunk)
+
+
+def write_csv(songs: Iterable) -> Iterator[str]:
+    """Yield CSV text with a header row, one chunk of songs at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for chunk in _chunks(songs, CHUNK_SIZE):
+        writer.writerows([_field(song, name) for name in FIELDS] for song in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+WRITERS = {'m3u': write_m3u, 'jsonl': write_jsonl, 'csv': write_csv}
+
+
+# Export
+def export_songs(songs: Iterable, path: str, fmt: Optional[str] = None) -> int:
+    """Write songs to a file and return how many were written
+    
+    Songs are read by name, so a Database with row_format='tuple' cannot
+    be exported from.
+    """
+    fmt = fmt or detect_format(path)
+    count = 0
+    
+    def counted():
+        nonlocal count
+        for song in songs:
+            count += 1
+            yield song
+    
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        out.writelines(WRITERS[fmt](counted()))
+    return count
+
+
+def export_playlist(db, playlist_id: int, path: str, fmt: Optional[str] = None) -> int:
+    """Export a playlist in play order"""
+    return export_songs(db.iter_playlist_songs(playlist_id, CHUNK_SIZE), path, fmt)
+
+
+def export_library(db, path: str, fmt: Optional[str] = None) -> int:
+    """Export every song, oldest first"""
+    return export_songs(db.iter_songs('song_id', page_size=CHUNK_SIZE), path, fmt)
+
+
+# Import
+def read_songs(path: str, fmt: Optional[str] = None) -> Iterator[Dict]:
+    """Stream song dicts from a playlist file"""
+    fmt = fmt or detect_format(path)
+    with open(path, encoding='utf-8-sig', errors='replace', newline='') as f:
+        if fmt == 'm3u':
+            yield from read_m3u(f, os.path.dirname(os.path.abspath(path)))
+        else:
+            yield from READERS[fmt](f)
+
+
+def import_songs(db, songs: Iterable[Dict],
+                 chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[Dict, Optional[int]]]:
+    """Yield (song, song_id) for each input song, matching or adding it
+    
+    Each chunk is resolved with one Database.resolve_songs call; song_id
+    is None for rows that could not be added (e.g. a bad duration).
+    """
+    for chunk in _chunks(songs, chunk_size):
+        yield from zip(chunk, db.resolve_songs(chunk))
+
+
+def import_library(db, path: str, fmt: Optional[str] = None,
+                   chunk_size: int = CHUNK_SIZE) -> Dict:
+    """Add the songs listed in a file to the library
+    
+    Returns counts of songs read and songs that could not be imported.
+    """
+    result = {'songs': 0, 'skipped': 0}
+    for song, song_id in import_songs(db, read_songs(path, fmt), chunk_size):
+        result['songs'] += 1
+        if song_id is None:
+            result['skipped'] += 1
+    return result
+
+
+def import_playlist(db, path: str, name: Optional[str] = None, fmt: Optional[str] = None,
+                    chunk_size: int = CHUNK_SIZE) -> Dict:
+    """Create a playlist from a file, adding songs missing from the library
+    
+    The playlist is named after the file unless name is given. Songs
+    listed twice are added once. Returns the new playlist_id (None if the
+    playlist could not be created) with counts of songs read, added and
+    skipped.
+    """
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    # Open the file and read its first song before the playlist exists, so
+    # a missing or unreadable file leaves nothing behind
+    songs = read_songs(path, fmt)
+    first = list(islice(songs, 1))
+    result = {'playlist_id': db.create_playlist(name), 'songs': 0, 'added': 0, 'skipped': 0}
+    if result['playlist_id'] is None:
+        return result
+    
+    try:
+        rows = import_songs(db, chain(first, songs), chunk_size)
+        for chunk in _chunks(rows, chunk_size):
+            song_ids = [song_id for song, song_id in chunk if song_id is not None]
+            added = db.add_songs_to_playlist_bulk(
+                [(result['playlist_id'], song_id) for song_id in song_ids], chunk_size)
+            result['songs'] += len(chunk)
+            result['added'] += sum(1 for row_id in added['ids'] if row_id)
+    except Exception:
+        db.delete_playlist(result['playlist_id'])
+        raise
+    result['skipped'] = result['songs'] - result['added']
+    return result
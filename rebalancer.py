@@ -0,0 +1,58 @@
+import threading
+
+
+class PositionRebalancer:
+    """Background thread that respaces crowded playlists
+    
+    Moves and mid-playlist inserts split the gap between two position keys.
+    When a gap gets narrow the playlist is queued here and renumbered off
+    the caller's thread, so the next drag-and-drop finds room again without
+    a renumber on the critical path.
+    """
+    
+    def __init__(self, rebalance, delay: float = 0.5):
+        """rebalance is called with each queued playlist id
+        
+        delay lets a burst of moves in the same playlist settle into a
+        single renumbering pass.
+        """
+        self.rebalance = rebalance
+        self.delay = delay
+        self._pending = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+    
+    def schedule(self, playlist_id: int):
+        """Queue a playlist for respacing, starting the thread on first use"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._pending.add(playlist_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prism-rebalancer",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+                self._cond.wait_for(lambda: self._stopped, timeout=self.delay)
+                if self._stopped:
+                    return
+                pending, self._pending = self._pending, set()
+            for playlist_id in pending:
+                self.rebalance(playlist_id)
+    
+    def stop(self, timeout: float = 5.0):
+        """Stop the thread; queued playlists stay dense but correctly ordered"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
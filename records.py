@@ -0,0 +1,109 @@
+"""
+Compact row types for P.R.I.S.M query results
+
+Database returns dicts by default. These types back its other row formats:
+slotted Song/Playlist records that still support song['title'] and
+song.get('title'), and a result list that carries the column-index map
+needed to read plain tuple rows. nocase() sorts rows in Python the way
+COLLATE NOCASE sorts them in SQL.
+"""
+
+import string
+from typing import Dict, Iterable, Optional, Sequence
+
+# SQLite's NOCASE collation only folds ASCII letters
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def nocase(text: Optional[str]) -> str:
+    """Sort key matching ORDER BY ... COLLATE NOCASE"""
+    return (text or '').translate(_NOCASE)
+
+
+class Record:
+    """Base for slotted result rows with dict-style read access
+    
+    Only the columns a query selected are set; reading any other field
+    raises KeyError (or returns the default from get()), as a dict would.
+    """
+    
+    __slots__ = ()
+    
+    @classmethod
+    def from_row(cls, columns: Sequence[str], row: Iterable):
+        """Build a record from a row and the query's column names"""
+        record = object.__new__(cls)
+        for name, value in zip(columns, row):
+            object.__setattr__(record, name, value)
+        return record
+    
+    @classmethod
+    def check_columns(cls, columns: Sequence[str]):
+        """Fail early when a query selects a column the record cannot hold"""
+        unknown = set(columns) - set(cls.__slots__)
+        if unknown:
+            raise ValueError(f"{cls.__name__} has no field for: {', '.join(sorted(unknown))}")
+    
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+    
+    def __contains__(self, key: str) -> bool:
+        return hasattr(self, key)
+    
+    def keys(self) -> list:
+        return [name for name in self.__slots__ if hasattr(self, name)]
+    
+    def as_dict(self) -> Dict:
+        """Convert to the default dict row"""
+        return {name: getattr(self, name) for name in self.keys()}
+    
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.as_dict() == other.as_dict()
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+    
+    def __repr__(self):
+        fields = ', '.join(f"{k}={v!r}" for k, v in self.as_dict().items())
+        return f"{type(self).__name__}({fields})"
+
+
+class Song(Record):
+    """A songs row, plus the playlist and history columns joined onto it"""
+    
+    __slots__ = ('song_id', 'title', 'artist', 'duration', 'file_path', 'created_date',
+                 'duration_ms', 'fingerprint', 'position', 'added_date', 'played_date', 'play_count')
+
+
+class Playlist(Record):
+    """A playlists row"""
+    
+    __slots__ = ('playlist_id', 'name', 'description', 'icon_color', 'created_date',
+                 'modified_date', 'song_count', 'total_duration_ms', 'rules')
+
+
+class Rows(list):
+    """Query result list that remembers its column layout
+    
+    columns maps each column name to its index, which is how tuple rows
+    are read; value() reads a field from a row in any format.
+    """
+    
+    __slots__ = ('columns',)
+    
+    def __init__(self, rows: Iterable = (), columns: Dict[str, int] = None):
+        super().__init__(rows)
+        self.columns = columns or {}
+    
+    def value(self, row, name: str):
+        """Read one field from a row of this result"""
+        if isinstance(row, tuple):
+            return row[self.columns[name]]
+        return row[name]
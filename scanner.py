@@ -0,0 +1,360 @@
+"""
+Media folder scanner for the P.R.I.S.M database
+
+LibraryScanner walks folders for WAV, FLAC and MP3 files and imports them
+as songs with file_path set. Tags and durations are read on a process
+pool, and results are written in batches through
+Database.apply_library_scan. Every imported file is recorded in the
+library_files manifest with its size and modification time, so a re-scan
+only stats each file and reads just the ones that are new or changed.
+"""
+
+import logging
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav')
+
+UNKNOWN_ARTIST = "Unknown Artist"
+
+# Largest tag field read into memory; bigger frames (cover art) are skipped
+MAX_FIELD_BYTES = 1 << 20
+
+# ID3v2 frames read, for v2.3/v2.4 and v2.2 tags
+ID3_FRAMES = {
+    b'TIT2': 'title', b'TPE1': 'artist', b'TLEN': 'length',
+    b'TT2': 'title', b'TP1': 'artist', b'TLE': 'length'
+}
+ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+# Layer III bitrates in kbit/s by header index, for MPEG-1 and MPEG-2/2.5
+MPEG1_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MPEG2_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+MPEG_SAMPLE_RATES = (44100, 48000, 32000)
+
+
+def format_duration(ms: Optional[int]) -> str:
+    """Format milliseconds as "M:SS" or "H:MM:SS", the form songs store"""
+    seconds = max(0, round((ms or 0) / 1000))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def _syncsafe(data: bytes) -> int:
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7F)
+    return value
+
+
+def _id3_text(data: bytes) -> str:
+    """Decode an ID3v2 text frame body"""
+    if not data:
+        return ''
+    codec = ID3_ENCODINGS[data[0]] if data[0] < len(ID3_ENCODINGS) else 'latin-1'
+    return data[1:].decode(codec, 'replace').split('\0')[0].strip()
+
+
+def _read_id3v2(f) -> Tuple[Dict, int]:
+    """Read the ID3v2 tag at the current position, if any
+    
+    Returns the tag fields found and the offset where the tag ends (the
+    start position when there is no tag).
+    """
+    start = f.tell()
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        f.seek(start)
+        return {}, start
+    major, flags = header[3], header[5]
+    end = start + 10 + _syncsafe(header[6:10]) + (10 if flags & 0x10 else 0)
+    if flags & 0x40:
+        extended = f.read(4)
+        if major == 4:
+            f.seek(_syncsafe(extended) - 4, 1)
+        else:
+            f.seek(struct.unpack('>I', extended)[0], 1)
+    
+    id_size, header_size = (3, 6) if major == 2 else (4, 10)
+    tags = {}
+    while f.tell() + header_size <= end:
+        frame = f.read(header_size)
+        frame_id = frame[:id_size]
+        if len(frame) < header_size or not frame_id.strip(b'\0'):
+            break
+        size_bytes = frame[id_size:id_size + (3 if major == 2 else 4)]
+        size = _syncsafe(size_bytes) if major == 4 else int.from_bytes(size_bytes, 'big')
+        name = ID3_FRAMES.get(frame_id)
+        if name and size <= MAX_FIELD_BYTES and name not in tags:
+            tags[name] = _id3_text(f.read(size))
+        else:
+            f.seek(size, 1)
+    f.seek(end)
+    return tags, end
+
+
+def _mpeg_duration_ms(f, audio_start: int, audio_end: int) -> Optional[int]:
+    """Duration of an MP3 stream from its first frame
+    
+    Uses the Xing/Info or VBRI frame count when the encoder wrote one and
+    falls back to a constant-bitrate estimate from the stream length.
+    """
+    f.seek(audio_start)
+    data = f.read(65536)
+    index = data.find(b'\xff')
+    while 0 <= index <= len(data) - 4:
+        header = int.from_bytes(data[index:index + 4], 'big')
+        version = (header >> 19) & 3
+        layer = (header >> 17) & 3
+        bitrate_index = (header >> 12) & 15
+        rate_index = (header >> 10) & 3
+        if ((header >> 21) & 0x7FF == 0x7FF and version != 1 and layer == 1
+                and bitrate_index not in (0, 15) and rate_index != 3):
+            mpeg1 = version == 3
+            sample_rate = MPEG_SAMPLE_RATES[rate_index] >> (0 if mpeg1 else 1 if version == 2 else 2)
+            samples = 1152 if mpeg1 else 576
+            mono = (header >> 6) & 3 == 3
+            side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+            xing = data[index + 4 + side_info:index + 16 + side_info]
+            if xing[:4] in (b'Xing', b'Info') and len(xing) == 12 and xing[7] & 1:
+                return int.from_bytes(xing[8:12], 'big') * samples * 1000 // sample_rate
+            vbri = data[index + 36:index + 54]
+            if vbri[:4] == b'VBRI' and len(vbri) == 18:
+                return int.from_bytes(vbri[14:18], 'big') * samples * 1000 // sample_rate
+            bitrate = (MPEG1_BITRATES if mpeg1 else MPEG2_BITRATES)[bitrate_index] * 1000
+            return (audio_end - audio_start - index) * 8 * 1000 // bitrate
+        index = data.find(b'\xff', index + 1)
+    return None
+
+
+def _read_mp3(f, size: int) -> Dict:
+    tags, audio_start = _read_id3v2(f)
+    audio_end = size
+    if size >= 128:
+        f.seek(size - 128)
+        id3v1 = f.read(128)
+        if id3v1[:3] == b'TAG':
+            audio_end -= 128
+            for name, field in (('title', id3v1[3:33]), ('artist', id3v1[33:63])):
+                if not tags.get(name):
+                    tags[name] = field.split(b'\0')[0].decode('latin-1').strip()
+    length = tags.pop('length', '')
+    tags['duration_ms'] = (int(length) if length.isdigit() and int(length)
+                           else _mpeg_duration_ms(f, audio_start, audio_end))
+    return tags
+
+
+def _read_flac(f, size: int) -> Dict:
+    tags, _ = _read_id3v2(f)
+    if f.read(4) != b'fLaC':
+        return tags
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        last, block_type = header[0] & 0x80, header[0] & 0x7F
+        length = int.from_bytes(header[1:4], 'big')
+        if block_type == 0:
+            info = f.read(length)
+            sample_rate = int.from_bytes(info[10:13], 'big') >> 4
+            total_samples = ((info[13] & 0x0F) << 32) | int.from_bytes(info[14:18], 'big')
+            if sample_rate and total_samples:
+                tags['duration_ms'] = total_samples * 1000 // sample_rate
+        elif block_type == 4 and length <= MAX_FIELD_BYTES:
+            comments = BytesIO(f.read(length))
+            vendor_length = struct.unpack('<I', comments.read(4))[0]
+            comments.seek(vendor_length, 1)
+            for _ in range(struct.unpack('<I', comments.read(4))[0]):
+                entry_length = struct.unpack('<I', comments.read(4))[0]
+                key, _, value = comments.read(entry_length).decode('utf-8', 'replace').partition('=')
+                name = key.lower()
+                if name in ('title', 'artist') and not tags.get(name):
+                    tags[name] = value.strip()
+        else:
+            f.seek(length, 1)
+    return tags
+
+
+def _read_wav(f, size: int) -> Dict:
+    header = f.read(12)
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return {}
+    tags = {}
+    byte_rate = data_size = 0
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        chunk_id, length = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+        if chunk_id == b'fmt ':
+            byte_rate = struct.unpack('<I', f.read(length)[8:12])[0]
+        elif chunk_id == b'data':
+            data_size = length
+            f.seek(length, 1)
+        elif chunk_id == b'LIST' and length <= MAX_FIELD_BYTES:
+            info = f.read(length)
+            position = 4 if info[:4] == b'INFO' else len(info)
+            while position + 8 <= len(info):
+                sub_id = info[position:position + 4]
+                sub_length = struct.unpack('<I', info[position + 4:position + 8])[0]
+                value = info[position + 8:position + 8 + sub_length]
+                name = {b'INAM': 'title', b'IART': 'artist'}.get(sub_id)
+                if name:
+                    tags[name] = value.split(b'\0')[0].decode('latin-1').strip()
+                position += 8 + sub_length + (sub_length & 1)
+        elif chunk_id in (b'id3 ', b'ID3 ') and length <= MAX_FIELD_BYTES:
+            id3, _ = _read_id3v2(BytesIO(f.read(length)))
+            for name, value in id3.items():
+                if name != 'length' and not tags.get(name):
+                    tags[name] = value
+        else:
+            f.seek(length, 1)
+        if length & 1:
+            f.seek(1, 1)
+    if byte_rate and data_size:
+        tags['duration_ms'] = data_size * 1000 // byte_rate
+    return tags
+
+
+READERS = {'.mp3': _read_mp3, '.flac': _read_flac, '.wav': _read_wav}
+
+
+def read_tags(path: str) -> Optional[Dict]:
+    """Read title, artist and duration ("M:SS") from an audio file
+    
+    Missing tags fall back to the file name and UNKNOWN_ARTIST, and an
+    unknown length to "0:00". Returns None if the file cannot be read.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            tags = READERS[extension](f, os.fstat(f.fileno()).st_size)
+    except OSError as e:
+        logger.warning("Cannot read %s: %s", path, e)
+        return None
+    except (KeyError, IndexError, ValueError, struct.error) as e:
+        logger.debug("Malformed tags in %s: %s", path, e)
+        tags = {}
+    return {
+        'title': tags.get('title') or os.path.splitext(os.path.basename(path))[0],
+        'artist': tags.get('artist') or UNKNOWN_ARTIST,
+        'duration': format_duration(tags.get('duration_ms'))
+    }
+
+
+def walk_audio_files(root: str, failed: Optional[List[str]] = None) -> Iterator[Tuple[str, int, int]]:
+    """Yield (path, size, mtime_ns) for every audio file under root
+    
+    Symbolic links to directories are not followed, so link cycles cannot
+    trap the walk; unreadable directories are logged, skipped and appended
+    to failed when it is given (root itself if it is unmounted).
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                            stat = entry.stat()
+                            yield entry.path, stat.st_size, stat.st_mtime_ns
+                    except OSError as e:
+                        logger.warning("Skipping %s: %s", entry.path, e)
+        except OSError as e:
+            logger.warning("Cannot scan %s: %s", directory, e)
+            if failed is not None:
+                failed.append(directory)
+
+
+class LibraryScanner:
+    """Incremental import of audio files into a Database
+    
+    A scan compares every file's size and mtime with the manifest and only
+    reads tags of files that are new or changed, spreading them over
+    `workers` processes. Small batches are read in-process, since starting
+    the pool would cost more than it saves.
+    """
+    
+    # Fewer changed files than this are read without a process pool
+    POOL_THRESHOLD = 64
+    
+    def __init__(self, db, workers: Optional[int] = None, batch_size: int = 500):
+        self.db = db
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+    
+    def scan(self, roots: Iterable[str], delete_missing: bool = False) -> Dict:
+        """Scan folders and bring songs and the manifest up to date
+        
+        Files that disappeared from a scanned folder are dropped from the
+        manifest; their songs are only deleted with delete_missing. Returns
+        counts of files seen, unchanged, added, updated, removed and failed.
+        """
+        stats = {'files': 0, 'unchanged': 0, 'added': 0, 'updated': 0,
+                 'removed': 0, 'failed': 0}
+        changed = []
+        missing = []
+        for root in roots:
+            root = os.path.abspath(root)
+            manifest = self.db.get_library_files(root)
+            failed = []
+            for path, size, mtime_ns in walk_audio_files(root, failed):
+                stats['files'] += 1
+                if manifest.pop(path, None) == (size, mtime_ns):
+                    stats['unchanged'] += 1
+                else:
+                    changed.append((path, size, mtime_ns))
+            # Files under a folder that could not be read (an unmounted
+            # drive) are unknown, not gone
+            if root in failed:
+                continue
+            prefixes = tuple(directory + os.sep for directory in failed)
+            missing.extend(path for path in manifest if not path.startswith(prefixes))
+        
+        if changed:
+            self._import(changed, stats)
+        if missing:
+            stats['removed'] = self.db.remove_library_files(missing, delete_missing)
+        logger.info("Library scan: %s", stats)
+        return stats
+    
+    def _import(self, changed, stats: Dict):
+        """Read tags of changed files and write them in batches"""
+        paths = [path for path, size, mtime_ns in changed]
+        pool = None
+        if self.workers > 1 and len(changed) >= self.POOL_THRESHOLD:
+            pool = ProcessPoolExecutor(self.workers)
+            results = pool.map(read_tags, paths, chunksize=64)
+        else:
+            results = map(read_tags, paths)
+        try:
+            batch = []
+            for (path, size, mtime_ns), tags in zip(changed, results):
+                if tags is None:
+                    stats['failed'] += 1
+                    continue
+                batch.append(dict(tags, path=path, size=size, mtime_ns=mtime_ns))
+                if len(batch) >= self.batch_size:
+                    self._write(batch, stats)
+                    batch = []
+            self._write(batch, stats)
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+    
+    def _write(self, batch, stats: Dict):
+        result = self.db.apply_library_scan(batch)
+        stats['added'] += result['added']
+        stats['updated'] += result['updated']
@@ -0,0 +1,473 @@
+"""
+Headless HTTP/JSON API for the P.R.I.S.M database
+
+PRISMServer exposes playlists, songs, playlist membership, search and play
+history over HTTP on a ThreadingHTTPServer. A playlist created or patched
+with a "rules" document is a smart playlist (see smart.py), whose songs
+cannot be added, removed or moved by hand. Every request runs on its own
+thread; reads borrow a connection from the Database's reader pool and
+writes queue on its single writer.
+
+Listings return one keyset page at a time ({"items": [...], "next": cursor};
+pass the cursor back as ?after=). With ?stream=1 or an Accept header of
+application/x-ndjson they stream the whole collection as chunked JSON
+Lines instead, a page at a time. GET responses carry an ETag that changes
+with every commit to the database, so clients can revalidate with
+If-None-Match and get an empty 304 without the query being run.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import zlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from records import Record
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Rows per chunk of a streamed listing
+STREAM_PAGE_SIZE = 500
+
+# Largest request body accepted, in bytes
+MAX_BODY = 1 << 20
+
+NDJSON = 'application/x-ndjson'
+
+
+class APIError(Exception):
+    """Fails a request with an HTTP status and a message"""
+    
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Stream:
+    """A listing to send as chunked JSON Lines"""
+    
+    def __init__(self, rows: Iterator):
+        self.rows = rows
+
+
+def _json_default(value):
+    if isinstance(value, Record):
+        return value.as_dict()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def encode(payload) -> bytes:
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False,
+                      default=_json_default).encode('utf-8')
+
+
+def encode_cursor(key: Optional[Tuple]) -> Optional[str]:
+    """Opaque ?after= token for a page key"""
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple]:
+    if not token:
+        return None
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))))
+    except (ValueError, TypeError):
+        raise APIError(HTTPStatus.BAD_REQUEST, "Invalid cursor") from None
+
+
+class PRISMServer:
+    """The API's routes, bound to one Database
+    
+    Route handlers take the parsed query string, the JSON body (or None)
+    and the IDs captured from the path, and return a JSON-encodable
+    payload, a (status, payload) pair or a Stream.
+    """
+    
+    ROUTES = [
+        ('GET', r'/playlists', 'list_playlists'),
+        ('POST', r'/playlists', 'create_playlist'),
+        ('GET', r'/playlists/(\d+)', 'get_playlist'),
+        ('PATCH', r'/playlists/(\d+)', 'update_playlist'),
+        ('DELETE', r'/playlists/(\d+)', 'delete_playlist'),
+        ('GET', r'/playlists/(\d+)/songs', 'list_playlist_songs'),
+        ('POST', r'/playlists/(\d+)/songs', 'add_playlist_songs'),
+        ('DELETE', r'/playlists/(\d+)/songs', 'remove_playlist_songs'),
+        ('POST', r'/playlists/(\d+)/songs/(\d+)/move', 'move_playlist_song'),
+        ('GET', r'/songs', 'list_songs'),
+        ('POST', r'/songs', 'create_song'),
+        ('GET', r'/songs/(\d+)', 'get_song'),
+        ('DELETE', r'/songs/(\d+)', 'delete_song'),
+        ('GET', r'/search/songs', 'search_songs'),
+        ('GET', r'/search/playlists', 'search_playlists'),
+        ('GET', r'/recent', 'list_recent'),
+        ('POST', r'/recent', 'record_play'),
+        ('GET', r'/top', 'list_top'),
+    ]
+    
+    def __init__(self, db, host: str = '127.0.0.1', port: int = 8080):
+        self.db = db
+        self._routes = [(method, re.compile(pattern + '$'), name)
+                        for method, pattern, name in self.ROUTES]
+        # Bumped on every commit made through db; commits by other
+        # processes show up in the database and WAL file stats instead
+        self._generation = 0
+        self._unsubscribe = db.events.subscribe(self._on_change)
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+    
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+    
+    def serve_forever(self):
+        logger.info("Serving the P.R.I.S.M API on http://%s:%s", *self.address)
+        self.httpd.serve_forever()
+    
+    def shutdown(self):
+        """Stop serve_forever (from another thread) and release the port"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._unsubscribe()
+    
+    # Dispatch
+    def _on_change(self, event):
+        self._generation += 1
+    
+    def version(self) -> str:
+        """Token that changes whenever the database does"""
+        state = [self._generation]
+        if not self.db.pool.in_memory:
+            for path in (self.db.db_name, self.db.db_name + '-wal'):
+                try:
+                    stat = os.stat(path)
+                    state.extend((stat.st_mtime_ns, stat.st_size))
+                except OSError:
+                    state.append(None)
+        return f"{zlib.crc32(repr(state).encode()):08x}"
+    
+    def route(self, method: str, path: str):
+        """Find the handler and path IDs for a request"""
+        allowed = False
+        for route_method, pattern, name in self._routes:
+            match = pattern.match(path)
+            if match:
+                if route_method == method:
+                    return getattr(self, name), [int(value) for value in match.groups()]
+                allowed = True
+        if allowed:
+            raise APIError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed on {path}")
+        raise APIError(HTTPStatus.NOT_FOUND, f"No such resource: {path}")
+    
+    # Helpers
+    @staticmethod
+    def _param(query: Dict, name: str, default=None):
+        values = query.get(name)
+        return values[-1] if values else default
+    
+    def _page_size(self, query: Dict) -> int:
+        try:
+            size = int(self._param(query, 'limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise APIError(HTTPStatus.BAD_REQUEST, "limit must be a number") from None
+        return max(1, min(size, MAX_PAGE_SIZE))
+    
+    @staticmethod
+    def _required(body: Optional[Dict], *names):
+        if not isinstance(body, dict):
+            raise APIError(HTTPStatus.BAD_REQUEST, "Expected a JSON object")
+        missing = [name for name in names if body.get(name) in (None, '')]
+        if missing:
+            raise APIError(HTTPStatus.BAD_REQUEST, f"Missing field: {', '.join(missing)}")
+        return [body[name] for name in names]
+    
+    @staticmethod
+    def _song_ids(body: Optional[Dict]):
+        song_ids = PRISMServer._required(body, 'song_ids')[0]
+        if not isinstance(song_ids, list) or not all(isinstance(i, int) for i in song_ids):
+            raise APIError(HTTPStatus.BAD_REQUEST, "song_ids must be a list of integers")
+        return song_ids
+    
+    @staticmethod
+    def _found(row, what: str):
+        if row is None:
+            raise APIError(HTTPStatus.NOT_FOUND, f"{what} not found")
+        return row
+    
+    def _listing(self, query: Dict, stream: bool, page, iterate):
+        """A page of a listing, or the whole of it as a Stream"""
+        if stream:
+            return Stream(iterate())
+        rows, next_key = page(decode_cursor(self._param(query, 'after')), self._page_size(query))
+        return {'items': rows, 'next': encode_cursor(next_key)}
+    
+    # Playlists
+    def list_playlists(self, query, body, stream):
+        return self._listing(query, stream, self.db.get_playlists_page,
+                             lambda: self.db.iter_playlists(STREAM_PAGE_SIZE))
+    
+    def _curated(self, playlist_id: int):
+        """Fail unless the playlist exists and its songs are chosen by hand"""
+        playlist = self._found(self.db.get_playlist_by_id(playlist_id), "Playlist")
+        if playlist.get('rules'):
+            raise APIError(HTTPStatus.CONFLICT, "A smart playlist's songs follow its rules")
+    
+    def create_playlist(self, query, body, stream):
+        name, = self._required(body, 'name')
+        if body.get('rules') is not None:
+            try:
+                playlist_id = self.db.create_smart_playlist(
+                    name, body['rules'], body.get('description', ''),
+                    body.get('icon_color') or '#8B5CF6')
+            except ValueError as e:
+                raise APIError(HTTPStatus.BAD_REQUEST, str(e))
+        else:
+            playlist_id = self.db.create_playlist(name, body.get('description', ''),
+                                                  body.get('icon_color') or '#8B5CF6')
+        if playlist_id is None:
+            raise APIError(HTTPStatus.CONFLICT, f"Playlist '{name}' already exists")
+        return HTTPStatus.CREATED, {'playlist_id': playlist_id}
+    
+    def get_playlist(self, query, body, stream, playlist_id):
+        return self._found(self.db.get_playlist_by_id(playlist_id), "Playlist")
+    
+    def update_playlist(self, query, body, stream, playlist_id):
+        fields = {'name', 'description', 'icon_color'}
+        if not isinstance(body, dict) or not body.keys() & (fields | {'rules'}):
+            raise APIError(HTTPStatus.BAD_REQUEST, "Nothing to update")
+        self._found(self.db.get_playlist_by_id(playlist_id), "Playlist")
+        # Rules and fields change together or not at all
+        with self.db.transaction():
+            if 'rules' in body:
+                try:
+                    updated = self.db.set_playlist_rules(playlist_id, body['rules'])
+                except ValueError as e:
+                    raise APIError(HTTPStatus.BAD_REQUEST, str(e))
+                if not updated:
+                    raise APIError(HTTPStatus.CONFLICT, "Playlist not updated")
+            if body.keys() & fields and not self.db.update_playlist(
+                    playlist_id, body.get('name'), body.get('description'), body.get('icon_color')):
+                raise APIError(HTTPStatus.CONFLICT, "Playlist not updated")
+        return self.db.get_playlist_by_id(playlist_id)
+    
+    def delete_playlist(self, query, body, stream, playlist_id):
+        if not self.db.delete_playlist(playlist_id):
+            raise APIError(HTTPStatus.NOT_FOUND, "Playlist not found")
+        return HTTPStatus.NO_CONTENT, None
+    
+    def list_playlist_songs(self, query, body, stream, playlist_id):
+        self._found(self.db.get_playlist_by_id(playlist_id), "Playlist")
+        return self._listing(
+            query, stream,
+            lambda after_key, size: self.db.get_playlist_songs_page(playlist_id, after_key, size),
+            lambda: self.db.iter_playlist_songs(playlist_id, STREAM_PAGE_SIZE))
+    
+    def add_playlist_songs(self, query, body, stream, playlist_id):
+        song_ids = self._song_ids(body)
+        self._curated(playlist_id)
+        return {'added': self.db.add_songs_to_playlist(playlist_id, song_ids)}
+    
+    def remove_playlist_songs(self, query, body, stream, playlist_id):
+        self._curated(playlist_id)
+        return {'removed': self.db.remove_songs_from_playlist(playlist_id, self._song_ids(body))}
+    
+    def move_playlist_song(self, query, body, stream, playlist_id, song_id):
+        before_song_id = (body or {}).get('before_song_id')
+        self._curated(playlist_id)
+        if not self.db.move_song(playlist_id, song_id, before_song_id):
+            raise APIError(HTTPStatus.NOT_FOUND, "Song not in playlist")
+        return HTTPStatus.NO_CONTENT, None
+    
+    # Songs
+    def list_songs(self, query, body, stream):
+        order_by = self._param(query, 'order', 'title')
+        if order_by not in self.db.SONG_ORDERS:
+            raise APIError(HTTPStatus.BAD_REQUEST, f"Unknown order: {order_by}")
+        return self._listing(
+            query, stream,
+            lambda after_key, size: self.db.get_songs_page(order_by, after_key, size),
+            lambda: self.db.iter_songs(order_by, page_size=STREAM_PAGE_SIZE))
+    
+    def create_song(self, query, body, stream):
+        title, artist, duration = self._required(body, 'title', 'artist', 'duration')
+        song_id = self.db.create_song(title, artist, duration, body.get('file_path', ''))
+        if song_id is None:
+            raise APIError(HTTPStatus.BAD_REQUEST, "Song not created (check the duration)")
+        return HTTPStatus.CREATED, {'song_id': song_id}
+    
+    def get_song(self, query, body, stream, song_id):
+        return self._found(self.db.get_song_by_id(song_id), "Song")
+    
+    def delete_song(self, query, body, stream, song_id):
+        if not self.db.delete_song(song_id):
+            raise APIError(HTTPStatus.NOT_FOUND, "Song not found")
+        return HTTPStatus.NO_CONTENT, None
+    
+    # Search and history
+    def search_songs(self, query, body, stream):
+        text = self._param(query, 'q', '')
+        return {'items': self.db.search_songs(text, self._page_size(query)) if text else []}
+    
+    def search_playlists(self, query, body, stream):
+        text = self._param(query, 'q', '')
+        return {'items': self.db.search_playlists(text) if text else []}
+    
+    def list_recent(self, query, body, stream):
+        return {'items': self.db.get_recently_played(self._page_size(query))}
+    
+    def record_play(self, query, body, stream):
+        song_id, = self._required(body, 'song_id')
+        self._found(self.db.get_song_by_id(song_id), "Song")
+        if not self.db.add_to_recently_played(song_id):
+            raise APIError(HTTPStatus.INTERNAL_SERVER_ERROR, "Play not recorded")
+        return HTTPStatus.NO_CONTENT, None
+    
+    def list_top(self, query, body, stream):
+        period = self._param(query, 'period', 'week')
+        if period not in self.db.PLAY_PERIODS:
+            raise APIError(HTTPStatus.BAD_REQUEST, f"Unknown period: {period}")
+        return {'items': self.db.get_top_songs(period, self._page_size(query))}
+
+
+def _make_handler(server: PRISMServer):
+    
+    class Handler(BaseHTTPRequestHandler):
+        """HTTP plumbing for PRISMServer: keep-alive, ETags, JSON and chunked streams"""
+        
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; with Nagle's algorithm
+        # on, each keep-alive response would wait out the client's delayed ACK
+        disable_nagle_algorithm = True
+        
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+        
+        def do_GET(self):
+            self._dispatch('GET')
+        
+        def do_POST(self):
+            self._dispatch('POST')
+        
+        def do_PATCH(self):
+            self._dispatch('PATCH')
+        
+        def do_DELETE(self):
+            self._dispatch('DELETE')
+        
+        def _dispatch(self, method: str):
+            url = urlsplit(self.path)
+            try:
+                # Consume the body before anything can fail, or on a
+                # keep-alive connection it would be parsed as the next request
+                raw = self._read_body()
+                handler, ids = server.route(method, url.path.rstrip('/') or '/')
+                body = self._parse_body(raw)
+                query = parse_qs(url.query)
+                stream = (server._param(query, 'stream') == '1'
+                          or NDJSON in self.headers.get('Accept', ''))
+                
+                etag = None
+                if method == 'GET':
+                    # Read before the query runs, so a commit racing it
+                    # can only make the tag older than the data
+                    etag = f'"{server.version()}-{zlib.crc32(self.path.encode()):08x}"'
+                    if etag in self.headers.get('If-None-Match', ''):
+                        self._send(HTTPStatus.NOT_MODIFIED, None, etag)
+                        return
+                
+                result = handler(query, body, stream, *ids)
+            except APIError as e:
+                self._send(e.status, {'error': str(e)})
+                return
+            except Exception:
+                logger.exception("Error handling %s %s", method, self.path)
+                self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Internal error"})
+                return
+            
+            if isinstance(result, Stream):
+                self._send_stream(result, etag)
+            elif isinstance(result, tuple):
+                self._send(result[0], result[1], etag)
+            else:
+                self._send(HTTPStatus.OK, result, etag)
+        
+        def _read_body(self) -> bytes:
+            """Read the request body; a body that cannot be read closes the connection"""
+            if self.headers.get('Transfer-Encoding'):
+                self.close_connection = True
+                raise APIError(HTTPStatus.LENGTH_REQUIRED, "Request body needs a Content-Length")
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.close_connection = True
+                raise APIError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+            if length > MAX_BODY:
+                self.close_connection = True
+                raise APIError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+            return self.rfile.read(length) if length else b''
+        
+        def _parse_body(self, raw: bytes):
+            if not raw:
+                return None
+            try:
+                return json.loads(raw)
+            except ValueError:
+                raise APIError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON") from None
+        
+        def _send(self, status: HTTPStatus, payload, etag: Optional[str] = None):
+            body = b'' if payload is None else encode(payload)
+            self.send_response(status)
+            if etag:
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+            if status not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+        
+        def _send_stream(self, stream: Stream, etag: Optional[str]):
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', NDJSON + '; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            if etag:
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            rows = iter(stream.rows)
+            try:
+                while True:
+                    lines = [encode(row) + b'\n' for _, row in zip(range(STREAM_PAGE_SIZE), rows)]
+                    if not lines:
+                        break
+                    chunk = b''.join(lines)
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.write(b'0\r\n\r\n')
+            except ConnectionError:
+                # The client went away mid-stream
+                self.close_connection = True
+    
+    return Handler
+
+
+def serve(db, host: str = '127.0.0.1', port: int = 8080):
+    """Run the API on db until interrupted"""
+    server = PRISMServer(db, host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
@@ -0,0 +1,166 @@
+"""
+Rule-based smart playlists for P.R.I.S.M
+
+A smart playlist is a playlists row with a rules document. Its matching
+songs are materialized into playlist_songs like any hand-curated
+playlist's, so opening, paging and exporting one costs the same; Database
+re-matches only the songs a commit touched. This module validates rules
+and compiles them into a single SQL condition over
+songs s LEFT JOIN song_play_stats st. Every rule is an equality or range
+test on an indexed column except artist "contains", a LIKE '%...%' that
+no index serves: a full re-match of a playlist using it scans the songs
+table, though matching the songs a commit touched still seeks by song_id.
+
+    {"match": "all",                     # or "any"
+     "rules": [{"field": "artist", "value": "Radiohead"},
+               {"field": "artist", "contains": "the"},
+               {"field": "duration", "min": 180, "max": 300},   # seconds
+               {"field": "added", "days": 30},
+               {"field": "plays", "min": 5},
+               {"field": "played", "days": 7}]}
+"""
+
+import json
+from typing import Dict, List, Tuple, Union
+
+MATCH_MODES = ('all', 'any')
+
+# Fields whose results change as plays are recorded
+PLAY_FIELDS = ('plays', 'played')
+
+# Fields whose results change as time passes, with no write at all
+TIME_FIELDS = ('added', 'played')
+
+
+def _positive_int(rule: Dict, key: str, minimum: int = 1) -> int:
+    value = rule.get(key)
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f"'{rule['field']}' rule needs an integer '{key}' of at least {minimum}")
+    return value
+
+
+def _check_rule(rule) -> Dict:
+    """Validate one rule and return it with only the keys it uses"""
+    if not isinstance(rule, dict):
+        raise ValueError(f"Rule must be an object: {rule!r}")
+    field = rule.get('field')
+    if field == 'artist':
+        for key in ('value', 'contains'):
+            if isinstance(rule.get(key), str) and rule[key].strip():
+                return {'field': field, key: rule[key].strip()}
+        raise ValueError("'artist' rule needs a 'value' or 'contains' string")
+    if field == 'duration':
+        checked = {'field': field}
+        for key in ('min', 'max'):
+            if rule.get(key) is not None:
+                checked[key] = _positive_int(rule, key, minimum=0)
+        if len(checked) == 1:
+            raise ValueError("'duration' rule needs a 'min' or 'max' in seconds")
+        if checked.get('min', 0) > checked.get('max', checked.get('min', 0)):
+            raise ValueError("'duration' rule has min above max")
+        return checked
+    if field in ('added', 'played'):
+        return {'field': field, 'days': _positive_int(rule, 'days')}
+    if field == 'plays':
+        return {'field': field, 'min': _positive_int(rule, 'min')}
+    raise ValueError(f"Unknown rule field: {field!r}")
+
+
+def parse_rules(rules: Union[str, Dict]) -> Dict:
+    """Validate a rules document (or its JSON text) and return it normalized
+    
+    Raises ValueError describing the first problem found.
+    """
+    if isinstance(rules, str):
+        try:
+            rules = json.loads(rules)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Rules are not valid JSON: {e}") from None
+    if not isinstance(rules, dict):
+        raise ValueError("Rules must be an object with a 'rules' list")
+    match = rules.get('match', 'all')
+    if match not in MATCH_MODES:
+        raise ValueError(f"'match' must be one of {', '.join(MATCH_MODES)}")
+    items = rules.get('rules')
+    if not isinstance(items, list) or not items:
+        raise ValueError("Rules need a non-empty 'rules' list")
+    return {'match': match, 'rules': [_check_rule(rule) for rule in items]}
+
+
+def compile_rules(rules: Dict) -> Tuple[str, List]:
+    """Compile normalized rules into a WHERE condition and its parameters
+    
+    The condition reads songs as s and song_play_stats as st (LEFT
+    JOINed, so songs never played have NULL stats and fail play rules).
+    """
+    terms = []
+    params = []
+    for rule in rules['rules']:
+        field = rule['field']
+        if field == 'artist' and 'value' in rule:
+            terms.append("s.artist = ? COLLATE NOCASE")
+            params.append(rule['value'])
+        elif field == 'artist':
+            terms.append("s.artist LIKE ?")
+            params.append(f"%{rule['contains']}%")
+        elif field == 'duration':
+            bounds = []
+            if 'min' in rule:
+                bounds.append("s.duration_ms >= ?")
+                params.append(rule['min'] * 1000)
+            if 'max' in rule:
+                bounds.append("s.duration_ms <= ?")
+                params.append(rule['max'] * 1000)
+            terms.append(' AND '.join(bounds))
+        elif field == 'added':
+            terms.append("s.created_date >= datetime('now', ?)")
+            params.append(f"-{rule['days']} days")
+        elif field == 'plays':
+            terms.append("st.play_count >= ?")
+            params.append(rule['min'])
+        elif field == 'played':
+            terms.append("st.last_played >= datetime('now', ?)")
+            params.append(f"-{rule['days']} days")
+    joiner = ' AND ' if rules['match'] == 'all' else ' OR '
+    return joiner.join(f"({term})" for term in terms), params
+
+
+def uses_plays(rules: Dict) -> bool:
+    """Whether recording a play can change what the rules match"""
+    return any(rule['field'] in PLAY_FIELDS for rule in rules['rules'])
+
+
+def uses_time(rules: Dict) -> bool:
+    """Whether the rules' matches drift as time passes"""
+    return any(rule['field'] in TIME_FIELDS for rule in rules['rules'])
+
+
+def _length(seconds: int) -> str:
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def describe(rules: Dict) -> str:
+    """One-line summary of the rules for display"""
+    parts = []
+    for rule in rules['rules']:
+        field = rule['field']
+        if field == 'artist' and 'value' in rule:
+            parts.append(f"artist is {rule['value']}")
+        elif field == 'artist':
+            parts.append(f"artist contains \"{rule['contains']}\"")
+        elif field == 'duration':
+            low = rule.get('min')
+            high = rule.get('max')
+            if low is not None and high is not None:
+                parts.append(f"{_length(low)} to {_length(high)} long")
+            elif low is not None:
+                parts.append(f"at least {_length(low)} long")
+            else:
+                parts.append(f"at most {_length(high)} long")
+        elif field == 'added':
+            parts.append(f"added in the last {rule['days']} days")
+        elif field == 'plays':
+            parts.append(f"played at least {rule['min']} times")
+        elif field == 'played':
+            parts.append(f"played in the last {rule['days']} days")
+    return (' and ' if rules['match'] == 'all' else ' or ').join(parts)
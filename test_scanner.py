@@ -0,0 +1,82 @@
+"""
+Regression tests for LibraryScanner and the library_files manifest
+"""
+
+import os
+import tempfile
+import unittest
+
+from database import Database
+from scanner import LibraryScanner
+
+
+class ScannerTestCase(unittest.TestCase):
+    """A database and a music folder holding one audio file"""
+    
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.db = Database(os.path.join(self.folder.name, 'prism.db'), slow_query_ms=None)
+        self.addCleanup(self.db.close)
+        self.music = os.path.join(self.folder.name, 'music')
+        os.mkdir(self.music)
+        self.path = os.path.join(self.music, 'Track One.mp3')
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.scanner = LibraryScanner(self.db, workers=1)
+
+
+class DeletedSongRescanTest(ScannerTestCase):
+    """A file whose song was deleted stays out until the file changes"""
+    
+    def test_deleted_song_is_reimported_after_file_changes(self):
+        self.assertEqual(self.scanner.scan([self.music])['added'], 1)
+        song_id = self.db.get_all_songs()[0]['song_id']
+        self.assertTrue(self.db.delete_song(song_id))
+        
+        stats = self.scanner.scan([self.music])
+        self.assertEqual((stats['unchanged'], stats['added']), (1, 0))
+        self.assertEqual(self.db.get_all_songs(), [])
+        
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * 64)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        
+        stats = self.scanner.scan([self.music])
+        self.assertEqual((stats['added'], stats['updated']), (1, 0))
+        songs = self.db.get_all_songs()
+        self.assertEqual([song['title'] for song in songs], ['Track One'])
+        self.assertEqual(self.db.get_library_files(self.music)[self.path][0], 128)
+
+
+
+class UnmountedRootTest(ScannerTestCase):
+    """A root that cannot be read keeps its files and songs"""
+    
+    def test_unmounted_root_is_not_emptied_or_duplicated(self):
+        self.assertEqual(self.scanner.scan([self.music])['added'], 1)
+        unmounted = self.music + '-unmounted'
+        os.rename(self.music, unmounted)
+        
+        stats = self.scanner.scan([self.music])
+        self.assertEqual((stats['files'], stats['removed']), (0, 0))
+        self.assertIn(self.path, self.db.get_library_files(self.music))
+        
+        os.rename(unmounted, self.music)
+        stats = self.scanner.scan([self.music])
+        self.assertEqual((stats['unchanged'], stats['added']), (1, 0))
+        self.assertEqual(len(self.db.get_all_songs()), 1)
+    
+    def test_forgotten_file_takes_back_its_song(self):
+        self.assertEqual(self.scanner.scan([self.music])['added'], 1)
+        song_id = self.db.get_all_songs()[0]['song_id']
+        self.assertEqual(self.db.remove_library_files([self.path]), 1)
+        
+        stats = self.scanner.scan([self.music])
+        self.assertEqual((stats['added'], stats['updated']), (0, 1))
+        self.assertEqual([song['song_id'] for song in self.db.get_all_songs()], [song_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+"""
+Regression tests for smart playlists kept current by Database writes
+"""
+
+import os
+import tempfile
+import unittest
+
+from database import Database
+
+
+class SmartPlaylistWriteTest(unittest.TestCase):
+    """Writes that re-match smart playlists still report their own IDs"""
+    
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.db = Database(os.path.join(self.folder.name, 'prism.db'), slow_query_ms=None)
+        self.addCleanup(self.db.close)
+        self.db.create_songs_bulk([("Filler %d" % i, "Other", "3:00") for i in range(5)])
+        self.smart_id = self.db.create_smart_playlist(
+            "Radiohead", {"rules": [{"field": "artist", "value": "Radiohead"}]})
+    
+    def test_create_song_returns_song_id_when_a_smart_playlist_matches(self):
+        song_id = self.db.create_song("Reckoner", "Radiohead", "4:50")
+        song = self.db.get_song_by_id(song_id)
+        self.assertEqual((song['title'], song['artist']), ("Reckoner", "Radiohead"))
+        self.assertEqual([s['song_id'] for s in self.db.get_playlist_songs(self.smart_id)],
+                         [song_id])
+    
+    def test_create_playlist_returns_playlist_id(self):
+        playlist_id = self.db.create_playlist("Mix")
+        self.assertEqual(self.db.get_playlist_by_id(playlist_id)['name'], "Mix")
+
+
+if __name__ == '__main__':
+    unittest.main()